@@ -139,15 +139,100 @@ DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 CORS_ALLOW_ALL_ORIGINS = True
 
 REST_FRAMEWORK = {
-    'EXCEPTION_HANDLER': 'restapi.exception_handler.custom_exception_handler'
+    'EXCEPTION_HANDLER': 'restapi.exception_handler.custom_exception_handler',
+    #  ADDED: orjson-backed JSON (restapi/fastjson.py), same bytes as DRF's
+    # stdlib classes; without orjson installed they are the stdlib classes
+    'DEFAULT_RENDERER_CLASSES': [
+        'restapi.fastjson.FastJSONRenderer',
+        'rest_framework.renderers.BrowsableAPIRenderer',
+    ],
+    'DEFAULT_PARSER_CLASSES': [
+        'restapi.fastjson.FastJSONParser',
+        'rest_framework.parsers.FormParser',
+        'rest_framework.parsers.MultiPartParser',
+    ],
 }
 
+#  ADDED: Validate nested write payloads with the compiled checker
+# (restapi/validation.py); False forces the plain DRF field-by-field path
+COMPILED_VALIDATION = True
 
+#  ADDED: Rows dropped from a nested update (or removed by PATCH) are
+# soft-deleted: deleted_at is set with one UPDATE per tree level instead of
+# a cascade delete, and `manage.py archive_deleted` moves them to the
+# ArchivedRow table later. False restores hard deletes.
+SOFT_DELETE = True
+
+#  ADDED: Render clinic reads from values() rows (restapi/readers.py)
+# instead of model instances + read serializers; False forces the serializers
+COMPILED_READS = True
+
+#  ADDED: Serve GET /api/get_clinic/<id>/ from ClinicSnapshot rows rebuilt
+# after every write (restapi/snapshots.py). Run `manage.py rebuild_snapshots`
+# once after turning it on; clinics without a snapshot are read as before
+CLINIC_SNAPSHOTS = False
+
+#  ADDED: Per-request profile (restapi/profiling.py): wall / DB / serializer
+# time and response size, logged to perf.log in LOG_DIR by request_id;
+# SERVER_TIMING_HEADER also sends it to the client as Server-Timing
+REQUEST_PROFILING = True
+SERVER_TIMING_HEADER = True
+
+
+import atexit
 import os
+import shutil
+import sys
+import tempfile
 from pathlib import Path
 
 BASE_DIR = Path(__file__).resolve().parent.parent
 
+#  ADDED: Log queue and rotation (see LOGGING below)
+# `manage.py test` logs to a throwaway directory, not restapi/log
+if os.environ.get("LOG_DIR"):
+    LOG_DIR = Path(os.environ["LOG_DIR"])
+elif sys.argv[1:2] == ["test"]:
+    LOG_DIR = Path(tempfile.mkdtemp(prefix="restapi-log-"))
+    atexit.register(shutil.rmtree, LOG_DIR, ignore_errors=True)
+else:
+    LOG_DIR = BASE_DIR / "restapi/log"
+LOG_QUEUE_SIZE = int(os.environ.get("LOG_QUEUE_SIZE", 10000))
+
+# Every worker process appends to the same files, so by default none of them
+# rotates: WatchedFileHandler reopens a file once it has been moved away, and
+# logrotate does the moving, e.g.
+#
+#     /srv/app/restapi/log/*.log {
+#         daily
+#         maxsize 50M
+#         rotate 5
+#         missingok
+#         notifempty
+#     }
+#
+# LOG_ROTATION=internal rotates in the process by size and age instead; that
+# is only safe with a single process (runserver, one worker), as workers
+# rotating the same file race and lose records.
+LOG_ROTATION = os.environ.get("LOG_ROTATION", "external")
+LOG_MAX_BYTES = int(os.environ.get("LOG_MAX_BYTES", 50 * 1024 * 1024))
+LOG_BACKUP_COUNT = int(os.environ.get("LOG_BACKUP_COUNT", 5))
+LOG_ROTATE_INTERVAL = int(os.environ.get("LOG_ROTATE_INTERVAL", 24 * 60 * 60))
+
+if LOG_ROTATION == "internal":
+    LOG_FILE_HANDLER = {
+        "class": "restapi.logqueue.SizeAndTimeRotatingFileHandler",
+        "maxBytes": LOG_MAX_BYTES,
+        "backupCount": LOG_BACKUP_COUNT,
+        "interval": LOG_ROTATE_INTERVAL,
+        "encoding": "utf-8",
+    }
+else:
+    LOG_FILE_HANDLER = {
+        "class": "logging.handlers.WatchedFileHandler",
+        "encoding": "utf-8",
+    }
+
 LOGGING = {
     "version": 1,
     "disable_existing_loggers": False,
@@ -159,15 +244,32 @@ LOGGING = {
             "style": "{",
             "datefmt": "%Y-%m-%d %H:%M:%S",
         },
+        #  ADDED: one JSON object per line, with the request_id
+        "json": {
+            "()": "restapi.logqueue.JsonFormatter",
+        },
     },
 
     #  Updated API log handler
+    #  ADDED: records are queued (bounded, dropped when full and counted in
+    # log_records_dropped_total at /metrics) and formatted and written by a
+    # listener thread (restapi/logqueue.py), so file I/O stays off the
+    # request path
     "handlers": {
         "api_file": {
             "level": "ERROR",
-            "class": "logging.FileHandler",
-            "filename": BASE_DIR / "restapi/log/api.log",
-            "formatter": "detailed",
+            "class": "restapi.logqueue.QueuedHandler",
+            "queue_size": LOG_QUEUE_SIZE,
+            "handler": {**LOG_FILE_HANDLER, "filename": LOG_DIR / "api.log"},
+            "formatter": "json",
+        },
+        #  ADDED: one JSON record per request from the profiling middleware
+        "perf_file": {
+            "level": "INFO",
+            "class": "restapi.logqueue.QueuedHandler",
+            "queue_size": LOG_QUEUE_SIZE,
+            "handler": {**LOG_FILE_HANDLER, "filename": LOG_DIR / "perf.log"},
+            "formatter": "json",
         },
     },
 
@@ -183,5 +285,60 @@ LOGGING = {
             "level": "ERROR",
             "propagate": True,
         },
+        "restapi.profiling": {
+            "handlers": ["perf_file"],
+            "level": "INFO",
+            "propagate": False,
+        },
     },
 }
+
+
+#  ADDED: Cache for rendered clinic trees (restapi/cache.py)
+# Entries are keyed by the tree's ETag, which is read from the database on
+# every request, so no worker can serve a tree another worker has changed.
+# The default local-memory LRU (bounded to CLINIC_CACHE_MAX_ENTRIES) is per
+# process, though: each worker keeps its own copy. With several workers set
+# CLINIC_CACHE_REDIS_URL (e.g. redis://localhost:6379/1) to share one cache
+# through Redis instead. CLINIC_CACHE_TIMEOUT only bounds how long
+# superseded trees hold memory.
+CLINIC_CACHE_ALIAS = "clinics"
+CLINIC_CACHE_TIMEOUT = int(os.environ.get("CLINIC_CACHE_TIMEOUT", 300))
+
+CACHES = {
+    "default": {
+        "BACKEND": "django.core.cache.backends.locmem.LocMemCache",
+    },
+    "clinics": {
+        "BACKEND": "django.core.cache.backends.locmem.LocMemCache",
+        "LOCATION": "clinic-trees",
+        "TIMEOUT": CLINIC_CACHE_TIMEOUT,
+        "OPTIONS": {
+            "MAX_ENTRIES": int(os.environ.get("CLINIC_CACHE_MAX_ENTRIES", 500)),
+            "CULL_FREQUENCY": 10,
+        },
+    },
+}
+
+if os.environ.get("CLINIC_CACHE_REDIS_URL"):
+    CACHES["clinics"] = {
+        "BACKEND": "django.core.cache.backends.redis.RedisCache",
+        "LOCATION": os.environ["CLINIC_CACHE_REDIS_URL"],
+        "TIMEOUT": CLINIC_CACHE_TIMEOUT,
+    }
+
+
+#  ADDED: /metrics (restapi/metrics.py). With several worker processes set
+# METRICS_MULTIPROC_DIR to an empty directory shared by all of them (tmpfs
+# is best) and clear it on every server start.
+METRICS_MULTIPROC_DIR = os.environ.get("METRICS_MULTIPROC_DIR") or None
+
+
+#  ADDED: Background writes (?async=true, restapi/jobs.py). Each web
+# process runs JOB_WORKERS threads that poll the Job table every
+# JOB_POLL_INTERVAL seconds; set it to 0 to leave jobs to `manage.py run_jobs`
+JOB_WORKERS = int(os.environ.get("JOB_WORKERS", 2))
+JOB_POLL_INTERVAL = 1.0
+# jobs left running this long (seconds) by a process that died are queued
+# again by the worker pool; keep it above the longest job, 0 disables it
+JOB_STALE_AFTER = int(os.environ.get("JOB_STALE_AFTER", 600))
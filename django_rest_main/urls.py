@@ -5,6 +5,7 @@ from django.urls import path, include
 from drf_yasg.views import get_schema_view
 from drf_yasg import openapi
 from rest_framework import permissions
+from restapi.views import metrics_view
 
 #  Swagger Configuration
 schema_view = get_schema_view(
@@ -21,6 +22,9 @@ urlpatterns = [
     path('admin/', admin.site.urls),
     path('api/', include('restapi.urls')),
 
+    #  Prometheus scrape endpoint
+    path('metrics', metrics_view, name='metrics'),
+
     #  Swagger UI Routes
     path('swagger/', schema_view.with_ui('swagger', cache_timeout=0), name='swagger-ui'),
     path('redoc/', schema_view.with_ui('redoc', cache_timeout=0), name='redoc'),
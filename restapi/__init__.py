@@ -1 +0,0 @@
-welcome to devops
@@ -1,8 +1,34 @@
 from django.contrib import admin
 from .models import Clinic, Department, Equipments, EquipmentDetails, Parameters
+from .signals import clinic_id_for, notify_clinic_changed
 
-admin.site.register(Clinic)
-admin.site.register(Department)
-admin.site.register(Equipments)
-admin.site.register(EquipmentDetails)
-admin.site.register(Parameters)
+
+class ClinicTreeAdmin(admin.ModelAdmin):
+    """Admin writes invalidate the cached tree of every clinic they touch."""
+
+    def save_model(self, request, obj, form, change):
+        if change:
+            # the row may be moving to another clinic; invalidate both
+            old = type(obj).objects.filter(pk=obj.pk).first()
+            if old is not None:
+                notify_clinic_changed(clinic_id_for(old))
+        super().save_model(request, obj, form, change)
+        notify_clinic_changed(clinic_id_for(obj))
+
+    def delete_model(self, request, obj):
+        clinic_id = clinic_id_for(obj)
+        super().delete_model(request, obj)
+        notify_clinic_changed(clinic_id)
+
+    def delete_queryset(self, request, queryset):
+        clinic_ids = {clinic_id_for(obj) for obj in queryset}
+        super().delete_queryset(request, queryset)
+        for clinic_id in clinic_ids:
+            notify_clinic_changed(clinic_id)
+
+
+admin.site.register(Clinic, ClinicTreeAdmin)
+admin.site.register(Department, ClinicTreeAdmin)
+admin.site.register(Equipments, ClinicTreeAdmin)
+admin.site.register(EquipmentDetails, ClinicTreeAdmin)
+admin.site.register(Parameters, ClinicTreeAdmin)
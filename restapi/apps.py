@@ -4,3 +4,9 @@ from django.apps import AppConfig
 class RestapiConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'restapi'
+
+    def ready(self):
+        # connect clinic_changed receivers
+        from . import snapshots  # noqa: F401
+        # connect the per-request DB query recorder
+        from . import profiling  # noqa: F401
@@ -0,0 +1,54 @@
+"""
+Move soft-deleted tree rows into ArchivedRow.
+
+Soft deletes (tree.delete_rows) leave rows in the live tables with
+``deleted_at`` set. ``archive_deleted`` copies those older than a cutoff
+into ArchivedRow as JSON and removes them from their table, in batches
+that each commit on their own so the job holds locks only briefly and can
+be stopped and resumed at any point. Leaves go first, so by the time a
+department is removed its subtree is already archived and the delete does
+not cascade.
+"""
+from django.db import transaction
+from django.utils import timezone
+
+from .models import ArchivedRow, Department, Equipments, EquipmentDetails, Parameters
+
+DEFAULT_BATCH_SIZE = 1000
+
+# children before parents
+ARCHIVE_ORDER = [Parameters, EquipmentDetails, Equipments, Department]
+
+
+def archive_batch(model, cutoff, batch_size=DEFAULT_BATCH_SIZE):
+    """Archive up to ``batch_size`` rows of ``model`` deleted before ``cutoff``; returns the count."""
+    with transaction.atomic():
+        rows = list(
+            model.all_objects.filter(deleted_at__lt=cutoff)
+            .order_by('pk')
+            .select_for_update(skip_locked=True)
+            .values()[:batch_size]
+        )
+        if not rows:
+            return 0
+        ArchivedRow.objects.bulk_create([
+            ArchivedRow(model=model._meta.label, row_id=row['id'], data=row, deleted_at=row['deleted_at'])
+            for row in rows
+        ])
+        model.all_objects.filter(pk__in=[row['id'] for row in rows]).delete()
+    return len(rows)
+
+
+def archive_deleted(older_than, batch_size=DEFAULT_BATCH_SIZE):
+    """Archive every row soft-deleted more than ``older_than`` (a timedelta) ago; returns counts per model."""
+    cutoff = timezone.now() - older_than
+    report = {}
+    for model in ARCHIVE_ORDER:
+        moved = 0
+        while True:
+            count = archive_batch(model, cutoff, batch_size)
+            moved += count
+            if count < batch_size:
+                break
+        report[model._meta.label] = moved
+    return report
@@ -0,0 +1,208 @@
+"""
+ASGI-native versions of the clinic read and equipment write endpoints.
+
+The DRF views in views.py are synchronous; under ASGI every request to
+them holds a worker thread for its whole duration. The views here are
+plain Django async views: lookups and reads go through the async ORM
+(``aget``, ``async for``), the cache through its async API, and only the
+transactional serializer writes hop to a thread with ``sync_to_async``.
+
+They are served under ``/api/async/`` and keep the response contracts of
+their sync counterparts: same JSON bodies, status codes, error shapes and
+ETag / Last-Modified / X-Cache headers. Request bodies are JSON only.
+"""
+import datetime
+import io
+import logging
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.http import HttpResponse
+from django.utils import timezone
+from django.utils.cache import get_conditional_response
+from django.utils.http import http_date, quote_etag
+from django.views import View
+from django.views.decorators.csrf import csrf_exempt
+from rest_framework.exceptions import NotFound, UnsupportedMediaType, ValidationError, APIException
+
+from .cache import aget_clinic_tree
+from .conditional import aclinic_fingerprint
+from .exception_handler import custom_exception_handler
+from .fastjson import FastJSONParser, FastJSONRenderer
+from .models import Clinic, Department, Equipments
+from .prefetch import planned_queryset
+from .readers import tree_reader
+from .serializers import ClinicReadSerializer, EquipmentSerializer
+from .signals import notify_clinic_changed
+from .snapshots import aget_snapshot
+
+logger = logging.getLogger(__name__)
+
+_renderer = FastJSONRenderer()
+_parser = FastJSONParser()
+
+
+def _response(data, status=200, headers=None):
+    # byte-for-byte what DRF's Response renders with the configured renderer
+    return HttpResponse(
+        _renderer.render(data), status=status, headers=headers, content_type=_renderer.media_type
+    )
+
+
+def _error(request, exc):
+    # same body and log line as the DRF views get from custom_exception_handler
+    response = custom_exception_handler(exc, {"request": request})
+    return _response(response.data, status=response.status_code)
+
+
+def _parse_json(request):
+    """request.data for a JSON body, as DRF would parse it; raises APIException."""
+    if not request.body:
+        return {}
+    if request.content_type != _parser.media_type:
+        raise UnsupportedMediaType(request.content_type)
+    return _parser.parse(io.BytesIO(request.body), _parser.media_type, {"encoding": request.encoding or settings.DEFAULT_CHARSET})
+
+
+class AsyncAPIView(View):
+
+    @classmethod
+    def as_view(cls, **initkwargs):
+        # like DRF's APIView: no CSRF check for the JSON API
+        return csrf_exempt(super().as_view(**initkwargs))
+
+
+# -------------------------------------------------------------------
+#  1. Get Clinic by ID (GET, async)
+# -------------------------------------------------------------------
+class AsyncGetClinicView(AsyncAPIView):
+
+    async def get(self, request, clinic_id):
+
+        try:
+            # condition() calls its etag/last-modified functions synchronously,
+            # so the conditional request is evaluated here instead
+            # a snapshot carries the same etag / last_modified as the fingerprint
+            snapshot = await aget_snapshot(clinic_id)
+            fingerprint = snapshot or await aclinic_fingerprint(clinic_id)
+            etag = last_modified = None
+            if fingerprint is not None:
+                etag = quote_etag(fingerprint.etag)
+                dt = fingerprint.last_modified
+                if not timezone.is_aware(dt):
+                    dt = timezone.make_aware(dt, datetime.timezone.utc)
+                last_modified = int(dt.timestamp())
+
+            response = get_conditional_response(request, etag=etag, last_modified=last_modified)
+            if response is None:
+
+                async def build():
+                    if snapshot is not None:
+                        return snapshot.data
+                    reader = tree_reader(ClinicReadSerializer)
+                    if reader is not None:
+                        rows = await reader.aread(Clinic.objects.filter(id=clinic_id))
+                        if not rows:
+                            raise Clinic.DoesNotExist
+                        return rows[0]
+                    clinic = await planned_queryset(ClinicReadSerializer).aget(id=clinic_id)
+                    return ClinicReadSerializer(clinic).data
+
+                data, hit = await aget_clinic_tree(clinic_id, fingerprint and fingerprint.etag, build)
+                response = _response(data, headers={"X-Cache": "HIT" if hit else "MISS"})
+
+            if last_modified and not response.has_header("Last-Modified"):
+                response.headers["Last-Modified"] = http_date(last_modified)
+            if etag:
+                response.headers.setdefault("ETag", etag)
+            return response
+
+        except Clinic.DoesNotExist:
+            return _error(request, NotFound("Clinic not found"))
+
+        except Exception as e:
+            logger.exception("Unhandled Async Clinic Fetch Error: %s", e)
+            return _response({"error": "Internal Server Error"}, status=500)
+
+
+@sync_to_async
+def _create_equipment(serializer, department):
+    # nested bulk INSERTs and on_commit hooks need the sync connection
+    equipment = serializer.save(dep=department)
+    notify_clinic_changed(department.clinic_id)
+    return EquipmentSerializer(equipment).data
+
+
+@sync_to_async
+def _update_equipment(serializer, department):
+    updated_equipment = serializer.save()
+    notify_clinic_changed(department.clinic_id)
+    return EquipmentSerializer(updated_equipment).data
+
+
+# -------------------------------------------------------------------
+#  2. Create Equipment under Department (POST, async)
+# -------------------------------------------------------------------
+class AsyncDepartmentEquipmentCreateView(AsyncAPIView):
+
+    async def post(self, request, department_id):
+
+        try:
+            department = await Department.objects.aget(id=department_id)
+
+            serializer = EquipmentSerializer(data=_parse_json(request))
+            serializer.is_valid(raise_exception=True)
+
+            data = await _create_equipment(serializer, department)
+            return _response(data, status=201)
+
+        except Department.DoesNotExist:
+            return _error(request, NotFound("Department not found"))
+
+        except ValidationError as ve:
+            return _response({"error": ve.detail}, status=400)
+
+        except APIException as e:
+            return _error(request, e)
+
+        except Exception as e:
+            logger.exception("Unhandled Async Equipment Create Error: %s", e)
+            return _response({"error": "Internal Server Error"}, status=500)
+
+
+# -------------------------------------------------------------------
+#  3. Update Equipment under Department (PUT, async)
+# -------------------------------------------------------------------
+class AsyncDepartmentEquipmentUpdateView(AsyncAPIView):
+
+    async def put(self, request, department_id, equipment_id):
+
+        try:
+            logger.info("Async PUT Request Received - dep_id=%s, eq_id=%s", department_id, equipment_id)
+
+            try:
+                department = await Department.objects.aget(id=department_id)
+            except Department.DoesNotExist:
+                raise NotFound("Department not found")
+
+            equipment = await Equipments.objects.filter(id=equipment_id, dep_id=department_id).afirst()
+            if not equipment:
+                raise NotFound("Equipment not found under this department")
+
+            serializer = EquipmentSerializer(equipment, data=_parse_json(request))
+            serializer.is_valid(raise_exception=True)
+
+            data = await _update_equipment(serializer, department)
+            return _response(data, status=200)
+
+        except ValidationError as ve:
+            logger.error("ValidationError: %s", ve.detail)
+            return _response({"error": ve.detail}, status=400)
+
+        except APIException as e:
+            logger.warning("%s", e)
+            return _error(request, e)
+
+        except Exception as e:
+            logger.exception("Unhandled Async Equipment Update Error: %s", e)
+            return _response({"error": "Internal Server Error"}, status=500)
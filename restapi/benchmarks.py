@@ -0,0 +1,416 @@
+"""
+Benchmark scenarios for the clinic API, run through ``manage.py benchmark``.
+
+Payloads come from a seeded generator so runs are comparable between
+commits; ``--output`` saves a result as JSON and ``--compare`` diffs a
+run against a saved one.
+"""
+import io
+import json
+import logging
+import os
+import random
+import statistics
+import tempfile
+import time
+import tracemalloc
+
+from django.db import connection
+from django.test import Client
+from django.test.utils import CaptureQueriesContext, override_settings
+from django.urls import reverse
+from rest_framework.parsers import JSONParser
+from rest_framework.renderers import JSONRenderer
+
+from . import fastjson
+from .cache import clinic_cache
+from .fastjson import FastJSONParser, FastJSONRenderer
+from .importer import import_clinics, iter_payloads
+from .loadtest import Result
+from .logqueue import JsonFormatter, QueuedHandler
+from .models import Clinic, Department
+from .prefetch import planned_queryset
+from .readers import TreeReader
+from .serializers import ClinicSerializer, ClinicReadSerializer
+
+
+SCENARIOS = {}
+
+# payload size used when neither the scenario nor the command line sets one
+DEFAULT_OPTIONS = {
+    'departments': 20,
+    'equipments': 30,
+    'details': 10,
+    'parameters': 10,
+    'seed': 0,
+}
+
+
+def scenario(name, **defaults):
+    """Register a benchmark; ``defaults`` override DEFAULT_OPTIONS for this scenario."""
+    def register(func):
+        func.defaults = {**DEFAULT_OPTIONS, **defaults}
+        SCENARIOS[name] = func
+        return func
+    return register
+
+
+def build_clinic_payload(departments=20, equipments=30, details=10, parameters=10, seed=0):
+    """Build a ClinicSerializer payload of the given size; same seed, same payload."""
+    rng = random.Random(seed)
+    return {
+        'name': f'Clinic {seed}',
+        'department': [
+            {
+                'name': f'Department {d}',
+                'is_active': rng.random() > 0.1,
+                'equipments': [
+                    {
+                        'equipment_name': f'Equipment {d}-{e}',
+                        'equipment_details': [
+                            {
+                                'equipment_num': f'EQ-{d}-{e}-{i}',
+                                'make': rng.choice(['Siemens', 'Roche', 'Abbott', 'Beckman']),
+                                'model': f'M{rng.randint(100, 999)}',
+                                'is_active': rng.random() > 0.1,
+                            }
+                            for i in range(details)
+                        ],
+                        'parameters': [
+                            {
+                                'parameter_name': f'Parameter {p}',
+                                'is_active': True,
+                                'content': {
+                                    'unit': rng.choice(['mg/dL', 'mmol/L', 'g/L']),
+                                    'min': round(rng.uniform(0, 50), 2),
+                                    'max': round(rng.uniform(50, 100), 2),
+                                    'tolerance': round(rng.uniform(0, 5), 2),
+                                },
+                            }
+                            for p in range(parameters)
+                        ],
+                    }
+                    for e in range(equipments)
+                ],
+            }
+            for d in range(departments)
+        ],
+    }
+
+
+def count_nodes(payload):
+    """Number of rows a clinic payload turns into (clinic included)."""
+    total = 1
+    for dept in payload.get('department', []):
+        total += 1
+        for equipment in dept.get('equipments', []):
+            total += 1 + len(equipment.get('equipment_details', [])) + len(equipment.get('parameters', []))
+    return total
+
+
+@scenario('clinic-create')
+def bench_clinic_create(options):
+    """Query count and wall time of ClinicSerializer.save() for one large clinic."""
+    payload = build_clinic_payload(
+        options['departments'], options['equipments'],
+        options['details'], options['parameters'], options['seed'],
+    )
+    serializer = ClinicSerializer(data=payload)
+    serializer.is_valid(raise_exception=True)
+
+    with CaptureQueriesContext(connection) as ctx:
+        start = time.perf_counter()
+        serializer.save()
+        elapsed = time.perf_counter() - start
+
+    return {
+        'nodes': count_nodes(payload),
+        'queries': len(ctx.captured_queries),
+        'seconds': round(elapsed, 4),
+    }
+
+
+@scenario('clinic-import', clinics=10000, batch_size=500, departments=2, equipments=3, details=2, parameters=2)
+def bench_clinic_import(options):
+    """Throughput of the bulk importer over an NDJSON fixture of many small clinics."""
+    fixture = io.StringIO(''.join(
+        json.dumps(build_clinic_payload(
+            options['departments'], options['equipments'],
+            options['details'], options['parameters'], options['seed'] + i,
+        )) + '\n'
+        for i in range(options['clinics'])
+    ))
+
+    with CaptureQueriesContext(connection) as ctx:
+        start = time.perf_counter()
+        report = import_clinics(iter_payloads(fixture), batch_size=options['batch_size'])
+        elapsed = time.perf_counter() - start
+
+    return {
+        'clinics': report.created,
+        'failed': len(report.errors),
+        'queries': len(ctx.captured_queries),
+        'seconds': round(elapsed, 4),
+        'clinics_per_second': round(report.created / elapsed, 1) if elapsed else None,
+    }
+
+
+@scenario('clinic-validate')
+def bench_clinic_validate(options):
+    """ClinicSerializer.is_valid() CPU time, DRF field-by-field vs compiled validation."""
+    payload = build_clinic_payload(
+        options['departments'], options['equipments'],
+        options['details'], options['parameters'], options['seed'],
+    )
+    timings = {}
+    for label, compiled in (('drf', False), ('compiled', True)):
+        with override_settings(COMPILED_VALIDATION=compiled):
+            start = time.process_time()
+            ClinicSerializer(data=payload).is_valid(raise_exception=True)
+            timings[label] = time.process_time() - start
+
+    return {
+        'nodes': count_nodes(payload),
+        'drf_seconds': round(timings['drf'], 4),
+        'compiled_seconds': round(timings['compiled'], 4),
+        'speedup': round(timings['drf'] / timings['compiled'], 1) if timings['compiled'] else None,
+    }
+
+
+def _measure(func):
+    """(result, CPU seconds, peak traced bytes) of func()."""
+    tracemalloc.start()
+    start = time.process_time()
+    try:
+        result = func()
+        elapsed = time.process_time() - start
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    return result, elapsed, peak
+
+
+@scenario('clinic-read')
+def bench_clinic_read(options):
+    """Render one large clinic: prefetch + ClinicReadSerializer vs the compiled values() reader."""
+    payload = build_clinic_payload(
+        options['departments'], options['equipments'],
+        options['details'], options['parameters'], options['seed'],
+    )
+    serializer = ClinicSerializer(data=payload)
+    serializer.is_valid(raise_exception=True)
+    clinic_id = serializer.save().id
+
+    def with_serializer():
+        clinic = planned_queryset(ClinicReadSerializer).get(id=clinic_id)
+        return ClinicReadSerializer(clinic).data
+
+    reader = TreeReader(ClinicReadSerializer)
+
+    def with_reader():
+        return reader.read(Clinic.objects.filter(id=clinic_id))[0]
+
+    serialized, serializer_cpu, serializer_peak = _measure(with_serializer)
+    compiled, reader_cpu, reader_peak = _measure(with_reader)
+    if json.dumps(serialized) != json.dumps(compiled):
+        raise AssertionError("compiled reader output differs from ClinicReadSerializer")
+
+    return {
+        'nodes': count_nodes(payload),
+        'serializer_cpu_seconds': round(serializer_cpu, 4),
+        'reader_cpu_seconds': round(reader_cpu, 4),
+        'cpu_speedup': round(serializer_cpu / reader_cpu, 1) if reader_cpu else None,
+        'serializer_peak_kib': serializer_peak // 1024,
+        'reader_peak_kib': reader_peak // 1024,
+        'memory_reduction': round(serializer_peak / reader_peak, 1) if reader_peak else None,
+    }
+
+
+def _best_of(repeat, func):
+    """Fastest wall-clock time of ``repeat`` calls of func()."""
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+
+@scenario('json', repeat=10)
+def bench_json(options):
+    """Render one large clinic tree and parse its PUT payload: DRF's stdlib JSON classes vs fastjson."""
+    payload = build_clinic_payload(
+        options['departments'], options['equipments'],
+        options['details'], options['parameters'], options['seed'],
+    )
+    serializer = ClinicSerializer(data=payload)
+    serializer.is_valid(raise_exception=True)
+    clinic_id = serializer.save().id
+    tree = ClinicReadSerializer(planned_queryset(ClinicReadSerializer).get(id=clinic_id)).data
+    body = JSONRenderer().render(payload)
+
+    renderers = {'drf': JSONRenderer(), 'fast': FastJSONRenderer()}
+    parsers = {'drf': JSONParser(), 'fast': FastJSONParser()}
+    rendered = {name: renderer.render(tree) for name, renderer in renderers.items()}
+    if rendered['drf'] != rendered['fast']:
+        raise AssertionError("FastJSONRenderer output differs from JSONRenderer")
+    if parsers['fast'].parse(io.BytesIO(body)) != parsers['drf'].parse(io.BytesIO(body)):
+        raise AssertionError("FastJSONParser result differs from JSONParser")
+
+    repeat = options['repeat']
+    render = {name: _best_of(repeat, lambda r=r: r.render(tree)) for name, r in renderers.items()}
+    parse = {name: _best_of(repeat, lambda p=p: p.parse(io.BytesIO(body))) for name, p in parsers.items()}
+    return {
+        'orjson': fastjson.orjson is not None,
+        'nodes': count_nodes(payload),
+        'rendered_bytes': len(rendered['drf']),
+        'payload_bytes': len(body),
+        'drf_render_seconds': round(render['drf'], 4),
+        'fast_render_seconds': round(render['fast'], 4),
+        'render_speedup': round(render['drf'] / render['fast'], 1) if render['fast'] else None,
+        'drf_parse_seconds': round(parse['drf'], 4),
+        'fast_parse_seconds': round(parse['fast'], 4),
+        'parse_speedup': round(parse['drf'] / parse['fast'], 1) if parse['fast'] else None,
+    }
+
+
+class _FsyncFileHandler(logging.FileHandler):
+    """FileHandler that forces every record to disk, the worst case for a slow volume."""
+
+    def flush(self):
+        super().flush()
+        if self.stream is not None:
+            os.fsync(self.stream.fileno())
+
+
+@scenario('logging', records=2000)
+def bench_logging(options):
+    """Per-call latency of logger.error(): fsync'ing FileHandler on the caller vs QueuedHandler."""
+    results = {'records': options['records']}
+    with tempfile.TemporaryDirectory() as directory:
+        for label in ('direct', 'queued'):
+            path = os.path.join(directory, f'{label}.log')
+            if label == 'direct':
+                handler = _FsyncFileHandler(path)
+            else:
+                handler = QueuedHandler({'class': f'{__name__}._FsyncFileHandler', 'filename': path})
+            handler.setFormatter(JsonFormatter())
+            logger = logging.Logger(f'benchmark.{label}')
+            logger.addHandler(handler)
+
+            latencies = []
+            start = time.perf_counter()
+            for i in range(options['records']):
+                call = time.perf_counter()
+                logger.error('record %s of %s', i, options['records'], extra={'request_id': f'bench-{i}'})
+                latencies.append(time.perf_counter() - call)
+            handler.flush()     # the queued handler has written everything once this returns
+            elapsed = time.perf_counter() - start
+            handler.close()
+
+            with open(path) as f:
+                written = sum(1 for _ in f)
+            latencies.sort()
+            results[label] = {
+                'written': written,
+                'p50_us': round(statistics.median(latencies) * 1e6, 1),
+                'p95_us': round(latencies[int(len(latencies) * 0.95) - 1] * 1e6, 1),
+                'max_us': round(latencies[-1] * 1e6, 1),
+                'seconds_until_on_disk': round(elapsed, 4),
+            }
+    return results
+
+
+def _time_requests(name, send, expected_status, count, before=None):
+    """
+    Latency, throughput and queries per request of ``count`` calls of
+    send(i), then peak traced memory of one more call. ``before(i)`` runs
+    untimed ahead of each call.
+    """
+    latencies, errors, queries = [], 0, 0
+    elapsed = 0.0
+    for i in range(count):
+        if before is not None:
+            before(i)
+        with CaptureQueriesContext(connection) as ctx:
+            start = time.perf_counter()
+            response = send(i)
+            latency = time.perf_counter() - start
+        latencies.append(latency)
+        elapsed += latency
+        queries += len(ctx.captured_queries)
+        if response.status_code != expected_status:
+            errors += 1
+
+    if before is not None:
+        before(count)
+    response, _, peak = _measure(lambda: send(count))
+    if response.status_code != expected_status:
+        raise AssertionError(f"{name}: {response.status_code} {response.content[:200]!r}")
+
+    result = Result(name, latencies, errors, elapsed).as_dict()
+    result.pop('mode')
+    result['queries_per_request'] = round(queries / count, 1) if count else None
+    result['peak_kib'] = peak // 1024
+    return result
+
+
+@scenario('endpoints', requests=20, departments=5, equipments=10, details=5, parameters=5)
+def bench_endpoints(options):
+    """
+    Each write and read endpoint through the full Django stack (middleware,
+    views, serializers) with a clinic of the configured size.
+    """
+    payload = build_clinic_payload(
+        options['departments'], options['equipments'],
+        options['details'], options['parameters'], options['seed'],
+    )
+    equipment = payload['department'][0]['equipments'][0]
+    count = options['requests']
+    client = Client(HTTP_HOST='localhost')
+
+    def post_json(url, data):
+        return client.post(url, data, content_type='application/json')
+
+    def put_json(url, data):
+        return client.put(url, data, content_type='application/json')
+
+    clinic_id = post_json(reverse('clinic-create'), payload).json()['id']
+    url = reverse('clinic-get', args=[clinic_id])
+
+    def clear_cache(i):
+        clinic_cache().clear()
+
+    results = {
+        'clinic-create': _time_requests(
+            'clinic-create', lambda i: post_json(reverse('clinic-create'), payload), 201, count),
+        'clinic-update': _time_requests(
+            'clinic-update', lambda i: put_json(reverse('clinic-update', args=[clinic_id]), payload), 200, count),
+        'clinic-get': _time_requests('clinic-get', lambda i: client.get(url), 200, count, before=clear_cache),
+        'clinic-get-cached': _time_requests('clinic-get-cached', lambda i: client.get(url), 200, count),
+    }
+
+    # the clinic PUTs above replaced its departments
+    department_id = Department.objects.filter(clinic_id=clinic_id).values_list('id', flat=True).first()
+    equipment_ids = []
+
+    def create_equipment(i):
+        response = post_json(reverse('department-equipment-create', args=[department_id]), equipment)
+        equipment_ids.append(response.json().get('id'))
+        return response
+
+    def update_equipment(i):
+        return put_json(reverse('department-equipment-update', args=[department_id, equipment_ids[i]]), equipment)
+
+    results['department-equipment-create'] = _time_requests(
+        'department-equipment-create', create_equipment, 201, count)
+    results['department-equipment-update'] = _time_requests(
+        'department-equipment-update', update_equipment, 200, count)
+
+    return {
+        'nodes': count_nodes(payload),
+        'equipment_nodes': 1 + len(equipment['equipment_details']) + len(equipment['parameters']),
+        'requests': count,
+        'endpoints': results,
+    }
@@ -0,0 +1,101 @@
+"""
+Cache for rendered clinic trees (GET /api/get_clinic/<id>/).
+
+Entries are keyed by clinic id plus the tree's ETag (conditional.py).
+The views compute the ETag from the database on every request anyway, to
+answer conditional requests, so the key always names the tree as it is
+committed right now: after a write, from any worker, the old entry is
+never looked up again and simply ages out of the backend. No
+invalidation has to reach other processes, so a per-process cache stays
+correct with several workers; it is only less effective than a shared
+one, since every worker renders and stores its own copy.
+
+The backend is whatever ``CACHES[CLINIC_CACHE_ALIAS]`` is configured as:
+the size-bounded local-memory LRU by default, Django's RedisCache (or any
+other cache backend) when configured.
+"""
+import threading
+
+from django.conf import settings
+from django.core.cache import caches
+
+from . import metrics
+
+
+class CacheStats:
+    """Process-local hit/miss counters."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def record(self, hit):
+        with self._lock:
+            if hit:
+                self.hits += 1
+            else:
+                self.misses += 1
+        # summed over worker processes at /metrics
+        metrics.observe_cache(hit)
+
+    def as_dict(self):
+        total = self.hits + self.misses
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_ratio': self.hits / total if total else 0.0,
+        }
+
+
+stats = CacheStats()
+
+
+def clinic_cache():
+    return caches[getattr(settings, 'CLINIC_CACHE_ALIAS', 'default')]
+
+
+def _tree_key(clinic_id, etag):
+    return f'clinic:{clinic_id}:tree:{etag}'
+
+
+def get_clinic_tree(clinic_id, etag, build):
+    """
+    Return the cached tree for ``clinic_id`` at ``etag``, calling
+    ``build()`` on a miss.
+
+    Returns ``(data, hit)``. ``etag`` must have been computed before
+    ``build()`` runs, so a write that commits meanwhile can only leave data
+    under an ETag that is already out of date. Without an ETag (the clinic
+    does not exist) nothing is cached.
+    """
+    if etag is None:
+        return build(), False
+    cache = clinic_cache()
+    key = _tree_key(clinic_id, etag)
+    data = cache.get(key)
+    if data is not None:
+        stats.record(hit=True)
+        return data, True
+
+    stats.record(hit=False)
+    data = build()
+    cache.set(key, data)
+    return data, False
+
+
+async def aget_clinic_tree(clinic_id, etag, abuild):
+    """Async get_clinic_tree(); ``abuild`` is a coroutine function."""
+    if etag is None:
+        return await abuild(), False
+    cache = clinic_cache()
+    key = _tree_key(clinic_id, etag)
+    data = await cache.aget(key)
+    if data is not None:
+        stats.record(hit=True)
+        return data, True
+
+    stats.record(hit=False)
+    data = await abuild()
+    await cache.aset(key, data)
+    return data, False
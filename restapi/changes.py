@@ -0,0 +1,157 @@
+"""
+Change-data-capture for clinic trees: the ChangeEvent outbox and its feed.
+
+The tree writers (tree.py, patch.py and the serializers on top of them)
+report every row they create, update or delete here, and the records are
+inserted into ChangeEvent in the same transaction as the write, so the
+outbox holds exactly the committed changes. A record carries the row's
+model, id, parent id, clinic id and new version, plus the columns that
+were written (all of them for a create, the changed ones for an update).
+A delete record stands for the row and its whole subtree.
+
+Inside ``recording()`` the records are buffered and inserted with one
+bulk_create when the block ends; outside it each writer inserts its own.
+
+The event id is the feed cursor (/api/changes?since=<id>). Ids are taken
+at insert time but become visible at commit, so concurrent writers can
+commit them out of order. Writers are not serialized to prevent that; on
+PostgreSQL each record carries its transaction's id (``txid``) and the
+feed serves records in (txid, id) order, only from transactions older
+than the oldest one still running (``pg_snapshot_xmin``). Every record a
+later read could see then sorts after the ones already served, so a
+consumer resuming after the last id it saw misses nothing. A write shows
+up in the feed once the transactions that were running when it began
+have ended. SQLite runs one writer at a time, so there txid is 0 and
+the order is the id order.
+"""
+import json
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from django.db import connections, router, transaction
+from django.db.models import Q
+from django.db.models.expressions import RawSQL
+from rest_framework.exceptions import ValidationError
+from rest_framework.utils.encoders import JSONEncoder
+
+from .models import ChangeEvent, Clinic, Department, Equipments, EquipmentDetails, Parameters
+
+# model -> FK to its parent in the tree
+_PARENT_FIELD = {
+    Department: 'clinic',
+    Equipments: 'dep',
+    EquipmentDetails: 'equipment',
+    Parameters: 'equipment',
+}
+
+_buffer = ContextVar('change_buffer', default=None)
+
+
+def _clinic_id(obj):
+    # the writers keep each row's parent cached, so this walks in memory
+    while not isinstance(obj, (Clinic, Department)):
+        obj = getattr(obj, _PARENT_FIELD[type(obj)])
+    return obj.pk if isinstance(obj, Clinic) else obj.clinic_id
+
+
+def _event(op, obj, fields):
+    model = type(obj)
+    parent_field = _PARENT_FIELD.get(model)
+    return ChangeEvent(
+        model=model._meta.model_name,
+        op=op,
+        row_id=obj.pk,
+        parent_id=getattr(obj, model._meta.get_field(parent_field).attname) if parent_field else None,
+        clinic_id=_clinic_id(obj),
+        version=obj.version,
+        data={name: getattr(obj, name) for name in fields} if fields is not None else None,
+    )
+
+
+def _append(events):
+    if not events:
+        return
+    connection = connections[router.db_for_write(ChangeEvent)]
+    if connection.vendor != 'postgresql':
+        ChangeEvent.objects.bulk_create(events)
+        return
+    # the transaction id is only the write's own inside its transaction
+    with transaction.atomic(using=connection.alias, savepoint=False):
+        with connection.cursor() as cursor:
+            cursor.execute('SELECT pg_current_xact_id()::text::bigint')
+            txid = cursor.fetchone()[0]
+        for event in events:
+            event.txid = txid
+        ChangeEvent.objects.bulk_create(events)
+
+
+def _record(events):
+    buffer = _buffer.get()
+    if buffer is None:
+        _append(events)
+    else:
+        buffer.extend(events)
+
+
+def record_created(rows, fields):
+    _record([_event(ChangeEvent.CREATE, obj, [f for f in fields if f != 'id']) for obj in rows])
+
+
+def record_updated(changes):
+    """``changes``: (row, [changed field, ...]) pairs."""
+    _record([_event(ChangeEvent.UPDATE, obj, changed) for obj, changed in changes if changed])
+
+
+def record_deleted(rows):
+    _record([_event(ChangeEvent.DELETE, obj, None) for obj in rows])
+
+
+@contextmanager
+def recording():
+    """
+    Buffer the change records of the writes inside the block and insert
+    them with one bulk_create at its end. Use it inside the write's
+    transaction; nested blocks share the outermost buffer.
+    """
+    if _buffer.get() is not None:
+        yield
+        return
+    events = []
+    token = _buffer.set(events)
+    try:
+        yield
+    finally:
+        _buffer.reset(token)
+    _append(events)
+
+
+def iter_changes(since=0, clinic_id=None, limit=None, chunk_size=1000):
+    """
+    The records after cursor ``since`` in feed order, as dicts. The cursor
+    is the id of the last record seen. The id alone does not place it in
+    (txid, id) order, so an id that was never recorded raises
+    ValidationError rather than risk skipping records.
+    """
+    queryset = ChangeEvent.objects.order_by('txid', 'id')
+    if since:
+        txid = ChangeEvent.objects.filter(id=since).values_list('txid', flat=True).first()
+        if txid is None:
+            raise ValidationError({'since': [f"No change record has id {since}."]})
+        queryset = queryset.filter(Q(txid__gt=txid) | Q(txid=txid, id__gt=since))
+    if connections[router.db_for_read(ChangeEvent)].vendor == 'postgresql':
+        queryset = queryset.filter(txid__lt=RawSQL('pg_snapshot_xmin(pg_current_snapshot())::text::bigint', ()))
+    if clinic_id is not None:
+        queryset = queryset.filter(clinic_id=clinic_id)
+    if limit is not None:
+        queryset = queryset[:limit]
+    fields = ['id', 'model', 'op', 'row_id', 'parent_id', 'clinic_id', 'version', 'data', 'created_at']
+    return queryset.values(*fields).iterator(chunk_size=chunk_size)
+
+
+def iter_ndjson(since=0, clinic_id=None, limit=None):
+    # not a generator: an unknown cursor raises here, before streaming starts
+    records = iter_changes(since, clinic_id, limit)
+    return (
+        json.dumps(record, cls=JSONEncoder, ensure_ascii=False, separators=(',', ':')) + '\n'
+        for record in records
+    )
@@ -0,0 +1,88 @@
+"""
+ETag / Last-Modified for clinic trees, computed from one aggregate query.
+
+The fingerprint combines the clinic's ``version`` and, for the clinic and
+each level below it, the row count and the newest ``updated_at``. Any insert, update or delete in the
+tree changes at least one of them, and none of it needs the tree to be
+loaded or serialized.
+"""
+import hashlib
+
+from django.db.models import Count, Max, OuterRef, Subquery
+
+from .models import Clinic, Department, Equipments, EquipmentDetails, Parameters
+
+# model -> lookup from that model up to the clinic id
+_LEVELS = [
+    (Department, 'clinic'),
+    (Equipments, 'dep__clinic'),
+    (EquipmentDetails, 'equipment__dep__clinic'),
+    (Parameters, 'equipment__dep__clinic'),
+]
+
+
+class Fingerprint:
+
+    def __init__(self, clinic_id, values):
+        self.clinic_id = clinic_id
+        self.values = values
+        timestamps = [v for v in values if hasattr(v, 'isoformat')]
+        self.last_modified = max(timestamps)
+        raw = '|'.join(str(v) for v in (clinic_id, *values))
+        self.etag = hashlib.sha1(raw.encode()).hexdigest()
+
+
+def _level_stats(model, clinic_lookup):
+    rows = model.objects.filter(**{clinic_lookup: OuterRef('pk')}).order_by().values(clinic_lookup)
+    return (
+        Subquery(rows.annotate(n=Count('pk')).values('n')),
+        Subquery(rows.annotate(m=Max('updated_at')).values('m')),
+    )
+
+
+def _fingerprint_query(clinics, *extra):
+    annotations = {}
+    for i, (model, lookup) in enumerate(_LEVELS):
+        annotations[f'count_{i}'], annotations[f'max_{i}'] = _level_stats(model, lookup)
+    return clinics.annotate(**annotations).values_list(*extra, 'updated_at', 'version', *annotations)
+
+
+def clinic_fingerprint(clinic_id):
+    """Fingerprint of a clinic's tree, or None if the clinic does not exist."""
+    row = _fingerprint_query(Clinic.objects.filter(pk=clinic_id)).first()
+    if row is None:
+        return None
+    return Fingerprint(clinic_id, row)
+
+
+def clinic_fingerprints(clinic_ids):
+    """{clinic id: Fingerprint} of the existing clinics among ``clinic_ids``, with one query."""
+    rows = _fingerprint_query(Clinic.objects.filter(pk__in=clinic_ids), 'pk')
+    return {row[0]: Fingerprint(row[0], row[1:]) for row in rows}
+
+
+async def aclinic_fingerprint(clinic_id):
+    """Async clinic_fingerprint() for the async views."""
+    row = await _fingerprint_query(Clinic.objects.filter(pk=clinic_id)).afirst()
+    if row is None:
+        return None
+    return Fingerprint(clinic_id, row)
+
+
+def _request_fingerprint(request, clinic_id):
+    # etag_func and last_modified_func are called for the same request;
+    # keep the result so the aggregate query only runs once
+    cache = request.__dict__.setdefault('_clinic_fingerprints', {})
+    if clinic_id not in cache:
+        cache[clinic_id] = clinic_fingerprint(clinic_id)
+    return cache[clinic_id]
+
+
+def clinic_etag(request, clinic_id, *args, **kwargs):
+    fingerprint = _request_fingerprint(request, clinic_id)
+    return fingerprint.etag if fingerprint else None
+
+
+def clinic_last_modified(request, clinic_id, *args, **kwargs):
+    fingerprint = _request_fingerprint(request, clinic_id)
+    return fingerprint.last_modified if fingerprint else None
@@ -0,0 +1,46 @@
+"""
+Connection reuse statistics for the configured databases.
+
+With ``OPTIONS["pool"]`` set (settings_production, DB_POOL=true) the
+PostgreSQL backend owns a psycopg_pool.ConnectionPool per process; its
+counters tell how long requests waited for a connection. Pools are
+per process, so every worker reports its own numbers.
+"""
+from django.db import connections
+
+
+def connection_stats(alias='default'):
+    connection = connections[alias]
+    settings_dict = connection.settings_dict
+    info = {
+        'alias': alias,
+        'vendor': connection.vendor,
+        'pooled': False,
+        'conn_max_age': settings_dict.get('CONN_MAX_AGE', 0),
+        'health_checks': settings_dict.get('CONN_HEALTH_CHECKS', False),
+        'server_side_cursors': not settings_dict.get('DISABLE_SERVER_SIDE_CURSORS', False),
+    }
+    # the postgresql backend only has a pool when OPTIONS["pool"] is configured
+    pool = getattr(connection, 'pool', None)
+    if pool is None:
+        return info
+
+    # cumulative since the pool started; keys are absent while still zero
+    stats = pool.get_stats()
+    requests = stats.get('requests_num', 0)
+    info.update({
+        'pooled': True,
+        'pool': stats,
+        'pool_size': stats.get('pool_size', 0),
+        'pool_available': stats.get('pool_available', 0),
+        'requests_waiting': stats.get('requests_waiting', 0),
+        'requests': requests,
+        'wait_ms_total': stats.get('requests_wait_ms', 0),
+        'wait_ms_avg': round(stats.get('requests_wait_ms', 0) / requests, 3) if requests else 0.0,
+        'timeouts': stats.get('requests_errors', 0),
+    })
+    return info
+
+
+def all_connection_stats():
+    return [connection_stats(alias) for alias in connections]
@@ -2,7 +2,6 @@ from rest_framework.views import exception_handler
 from rest_framework.response import Response
 from rest_framework import status
 from django.utils.http import http_date
-from datetime import datetime
 import logging
 
 logger = logging.getLogger(__name__)
@@ -12,23 +11,18 @@ def custom_exception_handler(exc, context):
     
     # Extract Request Details
     request_id = getattr(request, "request_id", "unknown")
-    ip = request.META.get("REMOTE_ADDR", "unknown")
+    ip = request.META.get("REMOTE_ADDR", "unknown") if request else "unknown"
     path = request.path if request else "unknown"
     
     # Call DRF default handler
     response = exception_handler(exc, context)
 
-    # Create custom log message
-    log_message = (
-        f"[ERROR][{datetime.utcnow()}]"
-        f"[ReqID: {request_id}]"
-        f"[IP: {ip}]\n"
-        f"Path: {path}\n"
-        f"Error: {str(exc)}"
+    # One structured record; the JSON formatter adds the time
+    logger.error(
+        "%s %s failed: %s", request.method if request else "-", path, exc,
+        extra={"ip": ip, "request_id": request_id},
     )
 
-    logger.error(log_message)
-
     # If handled (400, 404)
     if response is not None:
         response.data["error"] = response.data.get("detail", "Error occurred")
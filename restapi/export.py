@@ -0,0 +1,34 @@
+"""
+Streaming NDJSON export of every clinic tree, one clinic per line.
+
+Clinics are read with a server-side cursor (``.iterator(chunk_size=...)``)
+and their subtrees are prefetched one chunk at a time, so memory use
+depends on the chunk size, not on the number of clinics.
+"""
+import json
+
+from rest_framework.utils.encoders import JSONEncoder
+
+from .models import Clinic
+from .prefetch import planned_queryset
+from .readers import tree_reader
+from .serializers import ClinicReadSerializer
+
+DEFAULT_CHUNK_SIZE = 200
+
+
+def iter_clinic_trees(chunk_size=DEFAULT_CHUNK_SIZE):
+    clinics = Clinic.objects.order_by('id')
+    reader = tree_reader(ClinicReadSerializer)
+    if reader is not None:
+        yield from reader.iter_read(clinics, chunk_size)
+        return
+
+    queryset = planned_queryset(ClinicReadSerializer, clinics)
+    for clinic in queryset.iterator(chunk_size=chunk_size):
+        yield ClinicReadSerializer(clinic).data
+
+
+def iter_ndjson(chunk_size=DEFAULT_CHUNK_SIZE):
+    for data in iter_clinic_trees(chunk_size):
+        yield json.dumps(data, cls=JSONEncoder, ensure_ascii=False, separators=(',', ':')) + '\n'
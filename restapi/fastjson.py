@@ -0,0 +1,85 @@
+"""
+orjson-backed JSON renderer and parser for the REST API.
+
+FastJSONRenderer and FastJSONParser are drop-in replacements for DRF's
+JSONRenderer / JSONParser (see REST_FRAMEWORK in settings.py). orjson
+encodes and decodes in native code. The output is the same bytes DRF's
+stdlib path writes:
+
+- compact separators, UTF-8 with no ASCII escaping, and U+2028/U+2029
+  escaped
+- datetimes, dates, times, Decimals, bytes and other types orjson does
+  not handle the same way are handed to DRF's JSONEncoder.default
+
+Float formatting is the one difference. A float that needs an exponent
+renders as ``1e16`` where the stdlib writes ``1e+16``; the value is the
+same. NaN and Infinity become null instead of raising.
+
+Anything orjson refuses falls back to the stdlib classes: non-string
+dict keys, integers wider than 64 bits, non-UTF-8 request bodies and
+indented output (``Accept: application/json; indent=4``, the browsable
+API). A parse error is reported by the stdlib parser, so the error
+messages do not change. Without orjson installed, both classes simply
+are DRF's.
+"""
+import io
+
+from django.conf import settings
+from rest_framework.parsers import JSONParser
+from rest_framework.renderers import JSONRenderer
+from rest_framework.utils.encoders import JSONEncoder
+
+try:
+    import orjson
+except ImportError:     # optional: everything falls back to the stdlib
+    orjson = None
+
+_UTF8 = {'utf-8', 'utf8'}
+_default = JSONEncoder().default
+
+
+def _orjson_dumps(data):
+    """Compact JSON bytes from orjson, or None where the stdlib has to render."""
+    if orjson is None:
+        return None
+    try:
+        # datetimes and dataclasses go through DRF's encoder, like with the stdlib
+        ret = orjson.dumps(
+            data, default=_default,
+            option=orjson.OPT_PASSTHROUGH_DATETIME | orjson.OPT_PASSTHROUGH_DATACLASS,
+        )
+    except orjson.JSONEncodeError:
+        return None
+    if b'\xe2\x80\xa8' in ret or b'\xe2\x80\xa9' in ret:
+        ret = ret.replace(b'\xe2\x80\xa8', b'\\u2028').replace(b'\xe2\x80\xa9', b'\\u2029')
+    return ret
+
+
+class FastJSONRenderer(JSONRenderer):
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if data is None:
+            return b''
+        if (not self.ensure_ascii and self.compact
+                and self.get_indent(accepted_media_type, renderer_context or {}) is None):
+            ret = _orjson_dumps(data)
+            if ret is not None:
+                return ret
+        return super().render(data, accepted_media_type, renderer_context)
+
+
+class FastJSONParser(JSONParser):
+    renderer_class = FastJSONRenderer
+
+    def parse(self, stream, media_type=None, parser_context=None):
+        parser_context = parser_context or {}
+        encoding = parser_context.get('encoding') or settings.DEFAULT_CHARSET
+        if orjson is None or encoding.lower() not in _UTF8 or not self.strict:
+            return super().parse(stream, media_type, parser_context)
+        body = stream.read()
+        try:
+            return orjson.loads(body)
+        except orjson.JSONDecodeError:
+            # the stdlib decides: it accepts a few things orjson does not
+            # (e.g. integers wider than 64 bits) and words the error as before
+            return super().parse(io.BytesIO(body), media_type, parser_context)
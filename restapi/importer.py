@@ -0,0 +1,220 @@
+"""
+Bulk clinic import from NDJSON or a JSON array.
+
+Payloads have the same shape ClinicSerializer accepts. They are read
+incrementally from a stream and validated in batches. Each batch is
+written with one bulk_create per model and committed on its own, so a
+bad record or a failed batch never rolls back earlier batches.
+"""
+import codecs
+import itertools
+import json
+import re
+
+from django.db import transaction
+
+from .changes import record_created, recording
+from .models import Clinic
+from .serializers import ClinicSerializer
+from .signals import notify_clinic_changed
+from .tree import DEPARTMENTS, bulk_insert, create_children
+
+DEFAULT_BATCH_SIZE = 500
+_READ_SIZE = 64 * 1024
+
+
+class ImportReport:
+
+    def __init__(self):
+        self.received = 0
+        self.created = 0
+        self.errors = []
+
+    def add_error(self, index, errors):
+        self.errors.append({'index': index, 'errors': errors})
+
+    def as_dict(self):
+        return {
+            'received': self.received,
+            'created': self.created,
+            'failed': len(self.errors),
+            'errors': self.errors,
+        }
+
+
+def _chunks(stream):
+    # an incremental decoder keeps a multi-byte character split across two
+    # reads until its remaining bytes arrive
+    decoder = codecs.getincrementaldecoder('utf-8')()
+    while True:
+        chunk = stream.read(_READ_SIZE)
+        if not chunk:
+            tail = decoder.decode(b'', final=True)
+            if tail:
+                yield tail
+            return
+        if isinstance(chunk, bytes):
+            chunk = decoder.decode(chunk)
+        if chunk:
+            yield chunk
+
+
+def iter_payloads(stream):
+    """
+    Yield ``(payload, error)`` for every record of an NDJSON or JSON-array
+    stream; exactly one of the two is None. The format is picked from the
+    first non-blank character.
+
+    A malformed record is reported on its own and reading carries on with
+    the next one: the next line for NDJSON, the next top-level ``,`` for a
+    JSON array.
+    """
+    chunks = _chunks(stream)
+    buffer = ''
+    for chunk in chunks:
+        buffer += chunk
+        if buffer.strip():
+            break
+    buffer = buffer.lstrip()
+    if not buffer:
+        return
+
+    if buffer[0] == '[':
+        yield from _array_elements(itertools.chain([buffer[1:]], chunks))
+    else:
+        yield from _lines(itertools.chain([buffer], chunks))
+
+
+def _lines(chunks):
+    # NDJSON: one payload per line; a line split across chunks is joined once
+    parts = []
+    for chunk in chunks:
+        lines = chunk.split('\n')
+        if len(lines) > 1:
+            lines[0] = ''.join(parts) + lines[0]
+            parts = []
+            yield from _parse_lines(lines[:-1])
+        parts.append(lines[-1])
+    yield from _parse_lines([''.join(parts)])
+
+
+# outside strings: a whole string (skipped in one step), a bracket, a comma,
+# or the opening quote of a string that goes on in the next chunk; inside
+# such a string: its closing quote or an escape
+_STRUCTURE = re.compile(r'"[^"\\]*(?:\\.[^"\\]*)*"|[][{},"]')
+_IN_STRING = re.compile(r'["\\]')
+
+
+def _array_elements(chunks):
+    """
+    Split the elements of a JSON array (the text after its ``[``) on the
+    commas at depth 0 and parse each one on its own. The scan carries its
+    state (depth, inside a string, pending escape) from chunk to chunk, so
+    every character is looked at once however large an element is.
+    """
+    parts = []
+    depth = 0
+    in_string = escaped = False
+    for text in chunks:
+        start = pos = 0
+        if escaped:
+            pos, escaped = 1, False
+        while True:
+            if in_string:
+                match = _IN_STRING.search(text, pos)
+                if match is None:
+                    break
+                if match.group() == '\\':
+                    if match.end() == len(text):
+                        escaped = True
+                        break
+                    pos = match.end() + 1
+                else:
+                    in_string, pos = False, match.end()
+                continue
+
+            match = _STRUCTURE.search(text, pos)
+            if match is None:
+                break
+            char, pos = match.group(), match.end()
+            if char[0] == '"':
+                in_string = len(char) == 1
+            elif char in '[{':
+                depth += 1
+            elif char == '}' or (char == ']' and depth):
+                depth = max(depth - 1, 0)
+            elif depth == 0:
+                # a ',' between elements or the closing ']' of the array
+                element = ''.join(parts) + text[start:match.start()]
+                parts, start = [], pos
+                if element.strip():
+                    yield _parse(element)
+                if char == ']':
+                    return
+        parts.append(text[start:])
+    yield None, 'Unexpected end of JSON array.'
+
+
+def _parse(text):
+    try:
+        return json.loads(text), None
+    except json.JSONDecodeError as exc:
+        return None, f'JSON parse error - {exc}'
+
+
+def _parse_lines(lines):
+    for line in lines:
+        if line.strip():
+            yield _parse(line)
+
+
+def _write_batch(batch):
+    """Create the clinics in ``batch`` (list of validated_data) with one bulk INSERT per model."""
+    with transaction.atomic(), recording():
+        clinics = bulk_insert(Clinic, [
+            Clinic(**{k: v for k, v in data.items() if k not in ('department', 'version')}) for data in batch
+        ])
+        record_created(clinics, ['name'])
+        create_children(DEPARTMENTS, [
+            (clinic, data.get('department') or []) for clinic, data in zip(clinics, batch)
+        ])
+        for clinic in clinics:
+            notify_clinic_changed(clinic.id)
+    return clinics
+
+
+def import_clinics(records, batch_size=DEFAULT_BATCH_SIZE):
+    """
+    Import ``(payload, error)`` records (see iter_payloads) and return an
+    ImportReport. Record indexes in the report are 0-based positions in the
+    input.
+    """
+    report = ImportReport()
+    batch, indexes = [], []
+
+    def flush():
+        if not batch:
+            return
+        try:
+            report.created += len(_write_batch(batch))
+        except Exception as exc:
+            for index in indexes:
+                report.add_error(index, {'non_field_errors': [f'Batch write failed: {exc}']})
+        batch.clear()
+        indexes.clear()
+
+    for index, (payload, error) in enumerate(records):
+        report.received += 1
+        if error is not None:
+            report.add_error(index, {'non_field_errors': [error]})
+            continue
+        serializer = ClinicSerializer(data=payload)
+        if not serializer.is_valid():
+            report.add_error(index, serializer.errors)
+            continue
+        batch.append(serializer.validated_data)
+        indexes.append(index)
+        if len(batch) >= batch_size:
+            flush()
+    flush()
+    return report
@@ -0,0 +1,195 @@
+"""
+Database-backed job queue for writes too big to run inside a request.
+
+A view validates the payload, calls ``enqueue()`` and answers 202 with
+the job id; /api/jobs/<id> reports progress. Jobs are rows of the Job
+table, so there is no broker to run: worker threads in each web process
+(``JOB_WORKERS``, started on the first enqueue) and any number of
+``manage.py run_jobs`` processes all claim from the same table.
+
+Jobs of one clinic run one at a time and in the order they were queued:
+a job is only claimed when no other job of its clinic is running and no
+older one is still queued. Two writes to the same tree therefore never
+wait on each other's row locks, which is what would deadlock them. A job
+whose rows a request holds locked does not wait either: it goes back in
+the queue and is claimed again on a later poll.
+
+A job stays ``running`` if the process running it dies. The worker pool
+requeues jobs running for longer than ``JOB_STALE_AFTER`` seconds when it
+starts and then every JOB_STALE_AFTER seconds, so that has to be longer
+than any job takes.
+"""
+import logging
+import os
+import threading
+import time
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.exceptions import ObjectDoesNotExist
+from django.db import close_old_connections, transaction
+from django.db.models import Exists, OuterRef
+from django.utils import timezone
+from rest_framework.exceptions import ValidationError
+
+from .concurrency import Conflict, Locked, lock_rows
+from .models import Clinic, Job
+from .serializers import ClinicSerializer
+from .signals import notify_clinic_changed
+
+logger = logging.getLogger(__name__)
+
+
+def _clinic_update(job):
+    clinic = lock_rows(Clinic.objects.filter(pk=job.clinic_id)).get(job.clinic_id)
+    if clinic is None:
+        raise Clinic.DoesNotExist(f"Clinic {job.clinic_id} does not exist.")
+    ClinicSerializer().update(clinic, job.payload)
+    notify_clinic_changed(clinic.pk)
+    return {'id': clinic.pk, 'name': clinic.name}
+
+
+# Job.kind -> handler(job) returning the job's JSON result; runs in a transaction
+HANDLERS = {
+    'clinic-update': _clinic_update,
+}
+
+
+def enqueue(kind, clinic_id, payload):
+    """Queue a job; workers are woken once the surrounding transaction commits."""
+    if kind not in HANDLERS:
+        raise ValueError(f"Unknown job kind {kind!r}")
+    job = Job.objects.create(kind=kind, clinic_id=clinic_id, payload=payload)
+    transaction.on_commit(pool.notify)
+    return job
+
+
+def claim():
+    """Mark the next runnable job as running and return it, or None."""
+    busy = Job.objects.filter(clinic_id=OuterRef('clinic_id'), status=Job.RUNNING)
+    older = Job.objects.filter(clinic_id=OuterRef('clinic_id'), status=Job.QUEUED, pk__lt=OuterRef('pk'))
+    candidates = (
+        Job.objects.filter(status=Job.QUEUED)
+        .filter(~Exists(busy), ~Exists(older))
+        .order_by('pk')
+    )
+    with transaction.atomic():
+        job = candidates.select_for_update(skip_locked=True).first()
+        if job is None:
+            return None
+        # conditional, so two workers on a backend without row locks
+        # (SQLite) cannot both take the job
+        now = timezone.now()
+        if not Job.objects.filter(pk=job.pk, status=Job.QUEUED).update(status=Job.RUNNING, started_at=now):
+            return None
+    job.status, job.started_at = Job.RUNNING, now
+    return job
+
+
+def run_job(job):
+    """
+    Run a claimed job and record its outcome. A job that finds its rows
+    locked is put back in the queue instead (its status is ``queued`` again).
+    """
+    try:
+        with transaction.atomic():
+            job.result = HANDLERS[job.kind](job)
+        job.status = Job.SUCCEEDED
+    except Locked:
+        job.status, job.started_at = Job.QUEUED, None
+        job.save(update_fields=['status', 'started_at'])
+        return job
+    except ValidationError as ve:
+        job.status, job.error = Job.FAILED, ve.detail
+    except Conflict as e:
+        job.status, job.error = Job.FAILED, {'detail': str(e.detail)}
+    except ObjectDoesNotExist as e:
+        job.status, job.error = Job.FAILED, {'detail': str(e)}
+    except Exception as e:
+        logger.exception("Job %s (%s) failed: %s", job.pk, job.kind, e)
+        job.status, job.error = Job.FAILED, {'detail': 'Internal Server Error'}
+    job.finished_at = timezone.now()
+    job.save(update_fields=['status', 'result', 'error', 'finished_at'])
+    return job
+
+
+def run_pending(limit=None):
+    """Run runnable jobs in this thread until none is left (or ``limit`` ran); returns the count."""
+    count = 0
+    while limit is None or count < limit:
+        job = claim()
+        if job is None or run_job(job).status == Job.QUEUED:
+            break
+        count += 1
+    return count
+
+
+def requeue_stale(older_than):
+    """Put jobs left running by a worker that died more than ``older_than`` ago back in the queue."""
+    return Job.objects.filter(status=Job.RUNNING, started_at__lt=timezone.now() - older_than).update(
+        status=Job.QUEUED, started_at=None,
+    )
+
+
+class WorkerPool:
+    """
+    Threads of this process that run queued jobs; polled every
+    JOB_POLL_INTERVAL seconds. They also requeue stale jobs (see above).
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._threads = []
+        self._pid = None
+        self._next_requeue = 0.0
+
+    def start(self, size):
+        with self._lock:
+            if self._pid == os.getpid():
+                return
+            self._pid = os.getpid()
+            self._threads = [
+                threading.Thread(target=self._work, name=f'job-worker-{i}', daemon=True)
+                for i in range(size)
+            ]
+            for thread in self._threads:
+                thread.start()
+
+    def notify(self):
+        size = getattr(settings, 'JOB_WORKERS', 2)
+        if size:
+            self.start(size)
+            self._wakeup.set()
+
+    def requeue_stale(self):
+        """requeue_stale() if JOB_STALE_AFTER has passed since the last time; one thread of the pool runs it."""
+        stale_after = getattr(settings, 'JOB_STALE_AFTER', 600)
+        if not stale_after:
+            return 0
+        with self._lock:
+            now = time.monotonic()
+            if now < self._next_requeue:
+                return 0
+            self._next_requeue = now + stale_after
+        count = requeue_stale(timedelta(seconds=stale_after))
+        if count:
+            logger.warning("Requeued %d jobs running for more than %ss", count, stale_after)
+        return count
+
+    def _work(self):
+        interval = getattr(settings, 'JOB_POLL_INTERVAL', 1.0)
+        while True:
+            close_old_connections()
+            try:
+                self.requeue_stale()
+                job = claim()
+                if job is not None and run_job(job).status != Job.QUEUED:
+                    continue
+            except Exception as e:
+                logger.exception("Job worker error: %s", e)
+            self._wakeup.wait(interval)
+            self._wakeup.clear()
+
+
+pool = WorkerPool()
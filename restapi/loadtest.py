@@ -0,0 +1,152 @@
+"""
+In-process load generator for comparing the WSGI and ASGI request paths.
+
+Requests are fed straight to Django's WSGIHandler (from a pool of worker
+threads, like a threaded WSGI server) or ASGIHandler (from concurrent
+tasks on one event loop, like an ASGI server), so the numbers measure the
+framework, the views and the database, not a network stack. Run through
+``manage.py loadtest``.
+"""
+import asyncio
+import io
+import statistics
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from asgiref.sync import sync_to_async
+from django.core.handlers.asgi import ASGIHandler
+from django.core.handlers.wsgi import WSGIHandler
+from django.db import connections
+
+HOST = 'localhost'
+
+
+class Result:
+
+    def __init__(self, name, latencies, errors, elapsed):
+        self.name = name
+        self.latencies = latencies
+        self.errors = errors
+        self.elapsed = elapsed
+
+    def as_dict(self):
+        latencies = sorted(self.latencies)
+        count = len(latencies)
+        return {
+            'mode': self.name,
+            'requests': count,
+            'errors': self.errors,
+            'seconds': round(self.elapsed, 4),
+            'requests_per_second': round(count / self.elapsed, 1) if self.elapsed else 0.0,
+            'p50_ms': round(statistics.median(latencies) * 1000, 2) if count else None,
+            'p95_ms': round(latencies[int(count * 0.95) - 1] * 1000, 2) if count else None,
+        }
+
+
+def run_wsgi(name, paths, concurrency):
+    """GET every path through WSGIHandler from ``concurrency`` threads."""
+    handler = WSGIHandler()
+    pending = iter(paths)
+    lock = threading.Lock()
+    latencies, errors = [], [0]
+
+    def worker():
+        try:
+            while True:
+                with lock:
+                    path = next(pending, None)
+                if path is None:
+                    return
+                environ = {
+                    'REQUEST_METHOD': 'GET',
+                    'PATH_INFO': path,
+                    'QUERY_STRING': '',
+                    'SERVER_NAME': HOST,
+                    'SERVER_PORT': '80',
+                    'SERVER_PROTOCOL': 'HTTP/1.1',
+                    'HTTP_HOST': HOST,
+                    'REMOTE_ADDR': '127.0.0.1',
+                    'wsgi.input': io.BytesIO(b''),
+                    'wsgi.url_scheme': 'http',
+                }
+                status = []
+                start = time.perf_counter()
+                response = handler(environ, lambda line, headers, exc_info=None: status.append(int(line[:3])))
+                b''.join(response)
+                response.close()
+                with lock:
+                    latencies.append(time.perf_counter() - start)
+                    if status[0] >= 400:
+                        errors[0] += 1
+        finally:
+            connections.close_all()
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(concurrency) as pool:
+        for future in [pool.submit(worker) for _ in range(concurrency)]:
+            future.result()
+    return Result(name, latencies, errors[0], time.perf_counter() - start)
+
+
+async def _asgi_get(handler, path):
+    done = asyncio.Event()
+    status = []
+    sent_request = False
+
+    async def receive():
+        nonlocal sent_request
+        if not sent_request:
+            sent_request = True
+            return {'type': 'http.request', 'body': b'', 'more_body': False}
+        # Django listens for a disconnect while the view runs
+        await done.wait()
+        return {'type': 'http.disconnect'}
+
+    async def send(message):
+        if message['type'] == 'http.response.start':
+            status.append(message['status'])
+        elif message['type'] == 'http.response.body' and not message.get('more_body'):
+            done.set()
+
+    scope = {
+        'type': 'http',
+        'asgi': {'version': '3.0'},
+        'http_version': '1.1',
+        'method': 'GET',
+        'scheme': 'http',
+        'path': path,
+        'raw_path': path.encode(),
+        'query_string': b'',
+        'headers': [(b'host', HOST.encode())],
+        'client': ('127.0.0.1', 0),
+        'server': (HOST, 80),
+    }
+    await handler(scope, receive, send)
+    done.set()
+    return status[0] if status else 500
+
+
+def run_asgi(name, paths, concurrency):
+    """GET every path through ASGIHandler from ``concurrency`` concurrent tasks."""
+    latencies, errors = [], [0]
+
+    async def main():
+        handler = ASGIHandler()
+        pending = iter(paths)
+
+        async def worker():
+            for path in pending:
+                start = time.perf_counter()
+                status = await _asgi_get(handler, path)
+                latencies.append(time.perf_counter() - start)
+                if status >= 400:
+                    errors[0] += 1
+
+        await asyncio.gather(*(worker() for _ in range(concurrency)))
+        # the thread the async ORM ran on keeps its connection otherwise
+        await sync_to_async(connections.close_all)()
+
+    start = time.perf_counter()
+    asyncio.run(main())
+    return Result(name, latencies, errors[0], time.perf_counter() - start)
@@ -0,0 +1,183 @@
+"""
+Logging off the request thread.
+
+``QueuedHandler`` is what the LOGGING config points loggers at. emit()
+only snapshots the record and puts it on a bounded in-memory queue. A
+QueueListener thread does the JSON formatting, traceback rendering and
+file I/O, so a slow disk or an fsync never adds to request latency. When
+the queue is full, records are dropped instead of blocking the request,
+and counted in ``log_records_dropped_total`` at /metrics.
+
+With several worker processes the files are rotated outside the app
+(WatchedFileHandler + logrotate, see LOG_ROTATION in settings.py):
+processes that each rotate a shared file race on the rename and keep
+writing to the moved file through stale handles.
+
+Records carry the request_id RequestIDMiddleware binds for the current
+request (also under ASGI and in sync_to_async threads, as it is a
+context variable).
+"""
+import contextvars
+import copy
+import json
+import logging
+import logging.handlers
+import os
+import queue
+import threading
+import time
+from datetime import date, datetime, timezone
+from decimal import Decimal
+from uuid import UUID
+
+from django.utils.module_loading import import_string
+
+from . import metrics
+
+_request_id = contextvars.ContextVar('log_request_id', default=None)
+
+# attributes every LogRecord has; anything else came in through ``extra``
+_RECORD_ATTRS = frozenset(vars(logging.LogRecord('', 0, '', 0, '', None, None))) | {'message', 'asctime'}
+
+# message argument types a caller cannot change after the logging call
+_IMMUTABLE_ARGS = frozenset({str, bytes, int, float, bool, type(None), Decimal, datetime, date, UUID})
+
+
+def _immutable(args):
+    """True if a record's message arguments can be formatted later, in another thread."""
+    # a single mapping argument is passed as the dict itself, which can change
+    return isinstance(args, tuple) and all(type(arg) in _IMMUTABLE_ARGS for arg in args)
+
+
+def bind_request_id(request_id):
+    """Tag records logged by the current request; returns a token for unbind_request_id()."""
+    return _request_id.set(request_id)
+
+
+def unbind_request_id(token):
+    _request_id.reset(token)
+
+
+class JsonFormatter(logging.Formatter):
+    """One JSON object per line: time, level, logger, location, message, request_id, extras."""
+
+    def format(self, record):
+        entry = {
+            'time': datetime.fromtimestamp(record.created, timezone.utc).isoformat(timespec='milliseconds'),
+            'level': record.levelname,
+            'logger': record.name,
+            'module': record.module,
+            'line': record.lineno,
+            'message': record.getMessage(),
+            'request_id': getattr(record, 'request_id', None),
+        }
+        for name, value in vars(record).items():
+            if name not in _RECORD_ATTRS and name not in entry:
+                entry[name] = value
+        if record.exc_info and not record.exc_text:
+            record.exc_text = self.formatException(record.exc_info)
+        if record.exc_text:
+            entry['exception'] = record.exc_text
+        if record.stack_info:
+            entry['stack'] = self.formatStack(record.stack_info)
+        return json.dumps(entry, default=str)
+
+
+class SizeAndTimeRotatingFileHandler(logging.handlers.RotatingFileHandler):
+    """
+    RotatingFileHandler that also rolls over every ``interval`` seconds
+    (0 = size only). Backups are numbered .1, .2, ... as with size rotation.
+    Only for a single process writing the file (LOG_ROTATION=internal).
+    """
+
+    def __init__(self, filename, maxBytes=0, backupCount=0, interval=0, **kwargs):
+        super().__init__(filename, maxBytes=maxBytes, backupCount=backupCount, **kwargs)
+        self.interval = interval
+        self.rollover_at = time.time() + interval if interval else None
+
+    def shouldRollover(self, record):
+        if self.rollover_at is not None and time.time() >= self.rollover_at:
+            return True
+        return super().shouldRollover(record)
+
+    def doRollover(self):
+        super().doRollover()
+        if self.interval:
+            self.rollover_at = time.time() + self.interval
+
+
+class _Listener(logging.handlers.QueueListener):
+
+    def enqueue_sentinel(self):
+        # the stdlib uses put_nowait(), which fails on a full bounded queue
+        self.queue.put(self._sentinel)
+
+
+class QueuedHandler(logging.handlers.QueueHandler):
+    """
+    Queue records for a listener thread that passes them to ``handler``.
+
+    ``handler`` describes the target like a LOGGING handler entry: a
+    ``class`` path plus its keyword arguments. The formatter set on this
+    handler is used by the target, i.e. in the listener thread.
+    """
+
+    def __init__(self, handler, queue_size=10000):
+        spec = dict(handler)
+        self.target = import_string(spec.pop('class'))(**spec)
+        super().__init__(queue.Queue(queue_size))
+        self.dropped = 0
+        self._pid = None
+        self._listener = None
+        self._start_lock = threading.Lock()
+        self._start()
+
+    def _start(self):
+        with self._start_lock:
+            if self._pid != os.getpid():
+                # a forked worker does not inherit the parent's listener thread
+                self._listener = _Listener(self.queue, self.target, respect_handler_level=True)
+                self._listener.start()
+                self._pid = os.getpid()
+
+    def setFormatter(self, fmt):
+        super().setFormatter(fmt)
+        self.target.setFormatter(fmt)
+
+    def prepare(self, record):
+        # Leave formatting and the traceback to the listener. Only message
+        # arguments that may change once the caller moves on (lists, model
+        # instances, ...) are rendered into the message here.
+        record = copy.copy(record)
+        if record.args and not _immutable(record.args):
+            record.msg = record.getMessage()
+            record.args = None
+        if not hasattr(record, 'request_id'):
+            record.request_id = _request_id.get()
+        return record
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+            metrics.LOG_RECORDS_DROPPED.inc(handler=self.name or 'unnamed')
+
+    def emit(self, record):
+        if self._pid != os.getpid():
+            self._start()
+        super().emit(record)
+
+    def flush(self):
+        """Block until every queued record has been written."""
+        if self._listener is not None and self._listener._thread is not None:
+            self.queue.join()
+        self.target.flush()
+
+    def close(self):
+        with self._start_lock:
+            if self._listener is not None and self._listener._thread is not None:
+                self._listener.stop()
+            self._listener = None
+        self.target.close()
+        super().close()
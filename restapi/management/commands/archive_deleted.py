@@ -0,0 +1,20 @@
+import json
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand
+
+from restapi.archive import DEFAULT_BATCH_SIZE, archive_deleted
+
+
+class Command(BaseCommand):
+    help = "Move rows soft-deleted more than --days ago into the ArchivedRow table, in batches"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--days', type=float, default=30,
+                            help="Archive rows deleted at least this many days ago (0: all of them)")
+        parser.add_argument('--batch-size', type=int, default=DEFAULT_BATCH_SIZE,
+                            help="Rows archived per transaction")
+
+    def handle(self, *args, **options):
+        report = archive_deleted(timedelta(days=options['days']), options['batch_size'])
+        self.stdout.write(json.dumps(report, indent=2))
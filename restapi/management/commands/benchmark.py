@@ -0,0 +1,113 @@
+import json
+import platform
+import subprocess
+from datetime import datetime, timezone
+
+import django
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+
+from restapi.benchmarks import SCENARIOS
+
+
+def _git_commit():
+    try:
+        return subprocess.run(
+            ['git', 'rev-parse', '--short', 'HEAD'], cwd=settings.BASE_DIR,
+            capture_output=True, text=True, check=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def _numbers(value, prefix=''):
+    """Flatten the numeric leaves of a result into {'a.b.c': number}."""
+    if isinstance(value, dict):
+        flat = {}
+        for key, item in value.items():
+            flat.update(_numbers(item, f'{prefix}{key}.'))
+        return flat
+    if isinstance(value, (int, float)) and not isinstance(value, bool):
+        return {prefix[:-1]: value}
+    return {}
+
+
+class Command(BaseCommand):
+    help = (
+        "Run a benchmark scenario against the configured database (changes are rolled back), "
+        "or against a throwaway test database with --throwaway-db"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('scenario', choices=sorted(SCENARIOS))
+        # unset options fall back to the scenario's own defaults
+        parser.add_argument('--departments', type=int)
+        parser.add_argument('--equipments', type=int)
+        parser.add_argument('--details', type=int)
+        parser.add_argument('--parameters', type=int)
+        parser.add_argument('--clinics', type=int)
+        parser.add_argument('--batch-size', type=int)
+        parser.add_argument('--seed', type=int)
+        parser.add_argument('--records', type=int)
+        parser.add_argument('--requests', type=int)
+        parser.add_argument('--repeat', type=int)
+        parser.add_argument('--output', help="Also write the result to this JSON file")
+        parser.add_argument('--compare', help="A result file from an earlier run to compare against")
+        parser.add_argument('--throwaway-db', action='store_true',
+                            help="Create a fresh test database, run with commits, and drop it afterwards")
+
+    def handle(self, *args, **options):
+        func = SCENARIOS.get(options['scenario'])
+        if func is None:
+            raise CommandError(f"Unknown scenario {options['scenario']!r}")
+        params = {
+            **func.defaults,
+            **{k: v for k, v in options.items() if k in func.defaults and v is not None},
+        }
+
+        if options['throwaway_db']:
+            old_name = connection.settings_dict['NAME']
+            connection.creation.create_test_db(verbosity=0, autoclobber=True)
+            try:
+                result = func(params)
+            finally:
+                connection.creation.destroy_test_db(old_name, verbosity=0)
+        else:
+            with transaction.atomic():
+                result = func(params)
+                transaction.set_rollback(True)
+
+        report = {
+            'scenario': options['scenario'],
+            'meta': {
+                'commit': _git_commit(),
+                'time': datetime.now(timezone.utc).isoformat(timespec='seconds'),
+                'database': connection.vendor,
+                'python': platform.python_version(),
+                'django': django.get_version(),
+                'options': params,
+            },
+            **result,
+        }
+        self.stdout.write(json.dumps(report, indent=2))
+
+        if options['output']:
+            with open(options['output'], 'w') as f:
+                json.dump(report, f, indent=2)
+
+        if options['compare']:
+            with open(options['compare']) as f:
+                baseline = json.load(f)
+            if baseline.get('scenario') != report['scenario']:
+                raise CommandError(f"{options['compare']} is a {baseline.get('scenario')!r} result")
+            self.compare(_numbers({k: v for k, v in baseline.items() if k != 'meta'}),
+                         _numbers({k: v for k, v in report.items() if k != 'meta'}),
+                         baseline.get('meta', {}).get('commit'))
+
+    def compare(self, before, after, commit):
+        self.stdout.write(f"\nChange against {commit or 'baseline'} (current / baseline):")
+        for key in sorted(before.keys() & after.keys()):
+            old, new = before[key], after[key]
+            ratio = f'x{new / old:.2f}' if old else 'n/a'
+            self.stdout.write(f"  {key}: {old} -> {new} ({ratio})")
@@ -0,0 +1,105 @@
+import re
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+
+from restapi.benchmarks import build_clinic_payload
+from restapi.importer import import_clinics
+from restapi.models import Clinic, Department, Equipments, EquipmentDetails, Parameters
+
+# a full pass over one of our tables in the plan text; SQLite reports a
+# walk over a (covering) index as "SCAN <table> USING ... INDEX", which is fine
+FULL_SCAN = {
+    'postgresql': re.compile(r'Seq Scan on "?(restapi_\w+)'),
+    'sqlite': re.compile(r'\bSCAN "?(restapi_\w+)\b(?!"? USING (?:COVERING )?INDEX)'),
+}
+
+
+def hot_queries(sample):
+    """(label, queryset) for the lookups the write and read paths run per request."""
+    clinic, department, equipment, detail, parameter = sample
+    clinic_ids = [clinic.pk]
+    dep_ids = [department.pk]
+    equipment_ids = [equipment.pk]
+    return [
+        # single-row lookups scoped to their parent (PUT views, nested updates)
+        ('department by (id, clinic)', Department.objects.filter(id=department.pk, clinic_id=clinic.pk)),
+        ('equipment by (id, dep)', Equipments.objects.filter(id=equipment.pk, dep_id=department.pk)),
+        ('detail by (id, equipment)', EquipmentDetails.objects.filter(id=detail.pk, equipment_id=equipment.pk)),
+        ('parameter by (id, equipment)', Parameters.objects.filter(id=parameter.pk, equipment_id=equipment.pk)),
+        # level loads of sync_children / the compiled reader
+        ('departments of clinics', Department.objects.filter(clinic_id__in=clinic_ids).order_by('pk')),
+        ('equipments of departments', Equipments.objects.filter(dep_id__in=dep_ids).order_by('pk')),
+        ('details of equipments', EquipmentDetails.objects.filter(equipment_id__in=equipment_ids).order_by('pk')),
+        ('parameters of equipments', Parameters.objects.filter(equipment_id__in=equipment_ids).order_by('pk')),
+        # active-only filters of the clinic listing
+        ('active departments of clinic', Department.objects.filter(clinic_id=clinic.pk, is_active=True)),
+        ('active details of equipments',
+         EquipmentDetails.objects.filter(equipment_id__in=equipment_ids, is_active=True)),
+        ('active parameters of equipments',
+         Parameters.objects.filter(equipment_id__in=equipment_ids, is_active=True)),
+    ]
+
+
+class Command(BaseCommand):
+    help = (
+        "Seed a large dataset, EXPLAIN the hot clinic-tree queries and fail if any "
+        "of them scans a whole table (the seeded rows are rolled back)"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--clinics', type=int, default=500)
+        parser.add_argument('--departments', type=int, default=4)
+        parser.add_argument('--equipments', type=int, default=5)
+        parser.add_argument('--details', type=int, default=4)
+        parser.add_argument('--parameters', type=int, default=4)
+        parser.add_argument('--verbose-plans', action='store_true', help="Print every plan, not just failures")
+
+    def handle(self, *args, **options):
+        pattern = FULL_SCAN.get(connection.vendor)
+        if pattern is None:
+            raise CommandError(f"Plan checks are implemented for PostgreSQL and SQLite, not {connection.vendor}")
+
+        failures = []
+        with transaction.atomic():
+            self._seed(options)
+            sample = self._sample()
+            for label, queryset in hot_queries(sample):
+                plan = queryset.explain()
+                scanned = sorted(set(pattern.findall(plan)))
+                if scanned:
+                    failures.append(label)
+                    self.stdout.write(self.style.ERROR(f"FULL SCAN  {label}: {', '.join(scanned)}"))
+                else:
+                    self.stdout.write(self.style.SUCCESS(f"ok         {label}"))
+                if scanned or options['verbose_plans']:
+                    self.stdout.write(f"{plan}\n")
+            transaction.set_rollback(True)
+
+        if failures:
+            raise CommandError(f"{len(failures)} hot quer{'y' if len(failures) == 1 else 'ies'} scan a whole table")
+
+    def _seed(self, options):
+        records = (
+            (build_clinic_payload(
+                options['departments'], options['equipments'],
+                options['details'], options['parameters'], seed=i,
+            ), None)
+            for i in range(options['clinics'])
+        )
+        report = import_clinics(records)
+        self.stdout.write(f"seeded {report.created} clinics")
+        # planner statistics for the freshly inserted rows
+        with connection.cursor() as cursor:
+            cursor.execute('ANALYZE')
+
+    @staticmethod
+    def _sample():
+        clinic = Clinic.objects.order_by('pk')[Clinic.objects.count() // 2]
+        department = Department.objects.filter(clinic=clinic).order_by('pk').first()
+        equipment = Equipments.objects.filter(dep=department).order_by('pk').first()
+        detail = EquipmentDetails.objects.filter(equipment=equipment).order_by('pk').first()
+        parameter = Parameters.objects.filter(equipment=equipment).order_by('pk').first()
+        if None in (department, equipment, detail, parameter):
+            raise CommandError("Seeded clinics need at least one department, equipment, detail and parameter")
+        return clinic, department, equipment, detail, parameter
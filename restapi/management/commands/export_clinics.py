@@ -0,0 +1,26 @@
+import sys
+
+from django.core.management.base import BaseCommand
+
+from restapi.export import DEFAULT_CHUNK_SIZE, iter_ndjson
+
+
+class Command(BaseCommand):
+    help = "Export every clinic tree as NDJSON (one clinic per line)"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--output', '-o', help="File to write to (default: stdout)")
+        parser.add_argument('--chunk-size', type=int, default=DEFAULT_CHUNK_SIZE,
+                            help="Clinics fetched and prefetched per batch")
+
+    def handle(self, *args, **options):
+        out = open(options['output'], 'w', encoding='utf-8') if options['output'] else sys.stdout
+        try:
+            count = 0
+            for line in iter_ndjson(options['chunk_size']):
+                out.write(line)
+                count += 1
+        finally:
+            if out is not sys.stdout:
+                out.close()
+        self.stderr.write(f"Exported {count} clinics")
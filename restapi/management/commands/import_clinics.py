@@ -0,0 +1,40 @@
+import json
+import sys
+import time
+
+from django.core.management.base import BaseCommand
+
+from restapi.importer import DEFAULT_BATCH_SIZE, import_clinics, iter_payloads
+
+
+class Command(BaseCommand):
+    help = "Import clinics from an NDJSON or JSON-array file ('-' for stdin)"
+
+    def add_arguments(self, parser):
+        parser.add_argument('path')
+        parser.add_argument('--batch-size', type=int, default=DEFAULT_BATCH_SIZE,
+                            help="Clinics validated, inserted and committed together")
+        parser.add_argument('--report', help="Write the per-record error report (JSON) to this file")
+
+    def handle(self, *args, **options):
+        stream = sys.stdin if options['path'] == '-' else open(options['path'], encoding='utf-8')
+        try:
+            start = time.perf_counter()
+            report = import_clinics(iter_payloads(stream), batch_size=options['batch_size'])
+            elapsed = time.perf_counter() - start
+        finally:
+            if stream is not sys.stdin:
+                stream.close()
+
+        if options['report']:
+            with open(options['report'], 'w', encoding='utf-8') as f:
+                json.dump(report.as_dict(), f, indent=2)
+        else:
+            for error in report.errors:
+                self.stderr.write(json.dumps(error))
+
+        rate = report.created / elapsed if elapsed else 0
+        self.stdout.write(
+            f"Imported {report.created}/{report.received} clinics "
+            f"({len(report.errors)} failed) in {elapsed:.2f}s, {rate:.1f} clinics/s"
+        )
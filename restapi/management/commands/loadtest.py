@@ -0,0 +1,77 @@
+import json
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.test.utils import override_settings
+from django.urls import reverse
+
+from restapi.benchmarks import build_clinic_payload
+from restapi.importer import import_clinics
+from restapi.loadtest import run_asgi, run_wsgi
+from restapi.models import Clinic
+
+# mode -> (URL name, handler)
+MODES = {
+    'sync-wsgi': ('clinic-get', run_wsgi),
+    'sync-asgi': ('clinic-get', run_asgi),
+    'async-asgi': ('async-clinic-get', run_asgi),
+}
+
+
+class Command(BaseCommand):
+    help = (
+        "Compare GET clinic throughput: the sync view under WSGI and ASGI and the "
+        "async view under ASGI. Seeds clinics (committed) and deletes them afterwards."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--requests', type=int, default=2000)
+        parser.add_argument('--concurrency', type=int, default=32)
+        parser.add_argument('--clinics', type=int, default=50)
+        parser.add_argument('--departments', type=int, default=3)
+        parser.add_argument('--equipments', type=int, default=4)
+        parser.add_argument('--details', type=int, default=3)
+        parser.add_argument('--parameters', type=int, default=3)
+        parser.add_argument('--mode', action='append', choices=sorted(MODES),
+                            help="Run only these modes (repeatable); default: all")
+        parser.add_argument('--cache', action='store_true',
+                            help="Serve trees from the clinic cache (default: every request reads the DB)")
+
+    def handle(self, *args, **options):
+        records = (
+            (build_clinic_payload(
+                options['departments'], options['equipments'],
+                options['details'], options['parameters'], seed=i,
+            ), None)
+            for i in range(options['clinics'])
+        )
+        before = set(Clinic.objects.values_list('pk', flat=True))
+        import_clinics(records)
+        clinic_ids = sorted(set(Clinic.objects.values_list('pk', flat=True)) - before)
+
+        caching = {}
+        if not options['cache']:
+            caching = {
+                'CACHES': {**settings.CACHES, 'loadtest': {'BACKEND': 'django.core.cache.backends.dummy.DummyCache'}},
+                'CLINIC_CACHE_ALIAS': 'loadtest',
+            }
+
+        results = []
+        try:
+            with override_settings(**caching):
+                for mode in options['mode'] or MODES:
+                    url_name, run = MODES[mode]
+                    paths = [
+                        reverse(url_name, args=[clinic_ids[i % len(clinic_ids)]])
+                        for i in range(options['requests'])
+                    ]
+                    results.append(run(mode, paths, options['concurrency']).as_dict())
+        finally:
+            Clinic.objects.filter(pk__in=clinic_ids).delete()
+
+        self.stdout.write(json.dumps({
+            'concurrency': options['concurrency'],
+            'clinics': len(clinic_ids),
+            'cache': options['cache'],
+            'results': results,
+        }, indent=2))
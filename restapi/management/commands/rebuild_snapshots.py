@@ -0,0 +1,22 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from restapi.snapshots import DEFAULT_BATCH_SIZE, rebuild_all
+
+
+class Command(BaseCommand):
+    help = "Rebuild the ClinicSnapshot of every clinic (or of --clinic ids), in parallel batches"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--clinic', type=int, nargs='+', dest='clinic_ids',
+                            help="Only these clinic ids")
+        parser.add_argument('--batch-size', type=int, default=DEFAULT_BATCH_SIZE,
+                            help="Clinics rendered and written per transaction")
+        parser.add_argument('--workers', type=int, default=4,
+                            help="Batches rebuilt at the same time, each on its own connection")
+
+    def handle(self, *args, **options):
+        started = time.perf_counter()
+        count = rebuild_all(options['batch_size'], options['workers'], options['clinic_ids'])
+        self.stdout.write(f"Rebuilt {count} snapshots in {time.perf_counter() - started:.1f}s")
@@ -0,0 +1,34 @@
+import time
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand
+from django.db import close_old_connections
+
+from restapi.jobs import requeue_stale, run_pending
+
+
+class Command(BaseCommand):
+    help = "Run queued background jobs (?async=true writes) from the Job table"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--once', action='store_true', help="Exit when the queue is empty")
+        parser.add_argument('--poll-interval', type=float, default=1.0)
+        parser.add_argument('--requeue-after', type=float,
+                            help="First requeue jobs that have been running for more than this many "
+                                 "seconds (their worker died)")
+
+    def handle(self, *args, **options):
+        if options['requeue_after'] is not None:
+            count = requeue_stale(timedelta(seconds=options['requeue_after']))
+            self.stderr.write(f"Requeued {count} stale jobs")
+
+        total = 0
+        while True:
+            close_old_connections()
+            ran = run_pending()
+            total += ran
+            if options['once'] and not ran:
+                break
+            if not ran:
+                time.sleep(options['poll_interval'])
+        self.stderr.write(f"Ran {total} jobs")
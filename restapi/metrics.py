@@ -0,0 +1,328 @@
+"""
+In-process metrics registry, exposed at /metrics in the Prometheus text
+exposition format.
+
+Every sample (a counter, or one bucket / sum / count of a histogram for
+one set of labels) is a float slot. A process keeps its slots either in
+a dict, or, when ``METRICS_MULTIPROC_DIR`` is set, in its own mmap'ed
+file ``metrics_<pid>.db`` in that directory. /metrics then sums the
+slots of every file, so whichever gunicorn worker answers reports the
+totals of all workers. Clear the directory when the server (re)starts.
+
+Updating a slot is a dict lookup and one float add under a per-process
+lock, so worker threads hold it for well under a microsecond.
+"""
+import bisect
+import glob
+import json
+import math
+import mmap
+import os
+import struct
+import threading
+
+from django.conf import settings
+
+_HEADER = struct.Struct('i4x')      # bytes used, padding
+_KEY_LEN = struct.Struct('i')
+_VALUE = struct.Struct('d')
+_INITIAL_SIZE = 1 << 20
+
+
+def _key(name, labels):
+    return json.dumps([name, sorted(labels.items())])
+
+
+class MemoryValues:
+    """Slots of a single process, in memory."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._values = {}
+
+    def add(self, key, amount):
+        with self._lock:
+            self._values[key] = self._values.get(key, 0.0) + amount
+
+    def items(self):
+        with self._lock:
+            return list(self._values.items())
+
+
+class MmapValues:
+    """
+    Slots of one process in a file other processes can read.
+
+    Layout: a header holding the number of bytes in use, then entries of
+    ``key length, utf-8 key, padding to 8 bytes, float64 value``. A new
+    entry is written completely before the header is moved past it, so
+    readers never see half an entry.
+    """
+
+    def __init__(self, path):
+        self._lock = threading.Lock()
+        self._path = path
+        self._file = open(path, 'a+b')
+        if os.fstat(self._file.fileno()).st_size == 0:
+            self._file.truncate(_INITIAL_SIZE)
+        self._map = mmap.mmap(self._file.fileno(), 0)
+        self._positions = {}
+        self._used = _HEADER.unpack_from(self._map, 0)[0] or _HEADER.size
+        for key, _, position in _entries(self._map, self._used):
+            self._positions[key] = position
+
+    def _grow(self, needed):
+        size = len(self._map)
+        while size < needed:
+            size *= 2
+        self._map.close()
+        self._file.truncate(size)
+        self._map = mmap.mmap(self._file.fileno(), 0)
+
+    def _allocate(self, key):
+        encoded = key.encode()
+        padded = _KEY_LEN.size + len(encoded)
+        padded += -padded % 8
+        end = self._used + padded + _VALUE.size
+        if end > len(self._map):
+            self._grow(end)
+        _KEY_LEN.pack_into(self._map, self._used, len(encoded))
+        self._map[self._used + _KEY_LEN.size:self._used + _KEY_LEN.size + len(encoded)] = encoded
+        position = self._used + padded
+        _VALUE.pack_into(self._map, position, 0.0)
+        self._used = end
+        _HEADER.pack_into(self._map, 0, self._used)
+        self._positions[key] = position
+        return position
+
+    def add(self, key, amount):
+        with self._lock:
+            position = self._positions.get(key)
+            if position is None:
+                position = self._allocate(key)
+            value = _VALUE.unpack_from(self._map, position)[0]
+            _VALUE.pack_into(self._map, position, value + amount)
+
+    def items(self):
+        with self._lock:
+            return [(key, value) for key, value, _ in _entries(self._map, self._used)]
+
+
+def _entries(buffer, used):
+    offset = _HEADER.size
+    while offset < used:
+        length = _KEY_LEN.unpack_from(buffer, offset)[0]
+        key = bytes(buffer[offset + _KEY_LEN.size:offset + _KEY_LEN.size + length]).decode()
+        padded = _KEY_LEN.size + length
+        padded += -padded % 8
+        position = offset + padded
+        yield key, _VALUE.unpack_from(buffer, position)[0], position
+        offset = position + _VALUE.size
+
+
+def _read_file(path):
+    with open(path, 'rb') as f:
+        data = f.read()
+    if len(data) < _HEADER.size:
+        return []
+    used = _HEADER.unpack_from(data, 0)[0]
+    return [(key, value) for key, value, _ in _entries(data, used)]
+
+
+class _Store:
+    """The current process's slots; reopened after a fork so every worker has its own file."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._pid = None
+        self._values = None
+
+    def directory(self):
+        return getattr(settings, 'METRICS_MULTIPROC_DIR', None)
+
+    def values(self):
+        pid = os.getpid()
+        if self._pid != pid:
+            with self._lock:
+                if self._pid != pid:
+                    directory = self.directory()
+                    if directory:
+                        self._values = MmapValues(os.path.join(directory, f'metrics_{pid}.db'))
+                    else:
+                        self._values = MemoryValues()
+                    self._pid = pid
+        return self._values
+
+    def add(self, key, amount):
+        self.values().add(key, amount)
+
+    def collect(self):
+        """Sum of every process's slots (just this one without a directory)."""
+        directory = self.directory()
+        if not directory:
+            return dict(self.values().items())
+        totals = {}
+        for path in glob.glob(os.path.join(directory, 'metrics_*.db')):
+            for key, value in _read_file(path):
+                totals[key] = totals.get(key, 0.0) + value
+        return totals
+
+    def reset(self):
+        self._pid = None
+        self._values = None
+
+
+store = _Store()
+REGISTRY = []
+
+
+def _format_labels(labels):
+    if not labels:
+        return ''
+    escaped = (
+        (name, str(value).replace('\\', r'\\').replace('"', r'\"').replace('\n', r'\n'))
+        for name, value in labels
+    )
+    return '{' + ','.join(f'{name}="{value}"' for name, value in escaped) + '}'
+
+
+def _format_value(value):
+    if value == math.inf:
+        return '+Inf'
+    if float(value).is_integer():
+        return str(int(value))
+    return repr(float(value))
+
+
+class Counter:
+
+    type = 'counter'
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        REGISTRY.append(self)
+
+    def inc(self, amount=1, **labels):
+        store.add(_key(self.name, labels), amount)
+
+    def samples(self, values):
+        for (name, labels), value in sorted(values.items()):
+            yield name, labels, value
+
+
+class Histogram:
+
+    type = 'histogram'
+
+    def __init__(self, name, documentation, buckets, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.buckets = tuple(sorted(buckets)) + (math.inf,)
+        self.labelnames = tuple(labelnames)
+        REGISTRY.append(self)
+
+    def observe(self, value, **labels):
+        # buckets are stored non-cumulative, one slot write per observation
+        le = self.buckets[bisect.bisect_left(self.buckets, value)]
+        store.add(_key(f'{self.name}_bucket', {**labels, 'le': _format_value(le)}), 1)
+        store.add(_key(f'{self.name}_sum', labels), value)
+        store.add(_key(f'{self.name}_count', labels), 1)
+
+    def samples(self, values):
+        series = {}
+        for (name, labels), value in values.items():
+            base = tuple((k, v) for k, v in labels if k != 'le')
+            entry = series.setdefault(base, {'buckets': {}, 'sum': 0.0, 'count': 0.0})
+            if name.endswith('_bucket'):
+                entry['buckets'][dict(labels)['le']] = value
+            elif name.endswith('_sum'):
+                entry['sum'] = value
+            else:
+                entry['count'] = value
+        for labels, entry in sorted(series.items()):
+            cumulative = 0.0
+            for le in self.buckets:
+                cumulative += entry['buckets'].get(_format_value(le), 0.0)
+                yield f'{self.name}_bucket', labels + (('le', _format_value(le)),), cumulative
+            yield f'{self.name}_sum', labels, entry['sum']
+            yield f'{self.name}_count', labels, entry['count']
+
+
+def _by_metric(totals):
+    names = {}
+    for key, value in totals.items():
+        name, labels = json.loads(key)
+        names.setdefault(name, {})[(name, tuple(tuple(pair) for pair in labels))] = value
+    grouped = {}
+    for metric in REGISTRY:
+        sample_names = [metric.name] if metric.type == 'counter' else [
+            f'{metric.name}_bucket', f'{metric.name}_sum', f'{metric.name}_count'
+        ]
+        grouped[metric] = {k: v for name in sample_names for k, v in names.get(name, {}).items()}
+    return grouped
+
+
+def render():
+    """All registered metrics, summed over processes, in text exposition format."""
+    grouped = _by_metric(store.collect())
+    lines = []
+    for metric in REGISTRY:
+        lines.append(f'# HELP {metric.name} {metric.documentation}')
+        lines.append(f'# TYPE {metric.name} {metric.type}')
+        for name, labels, value in metric.samples(grouped[metric]):
+            lines.append(f'{name}{_format_labels(labels)} {_format_value(value)}')
+
+    # derived from the summed counters, so the ratio is correct across workers
+    cache = {dict(labels).get('result'): value for (_, labels), value in grouped[CACHE_REQUESTS].items()}
+    total = cache.get('hit', 0.0) + cache.get('miss', 0.0)
+    lines.append('# HELP clinic_cache_hit_ratio Share of clinic tree reads served from the cache.')
+    lines.append('# TYPE clinic_cache_hit_ratio gauge')
+    lines.append(f'clinic_cache_hit_ratio {_format_value(cache.get("hit", 0.0) / total if total else 0.0)}')
+    return '\n'.join(lines) + '\n'
+
+
+REQUEST_DURATION = Histogram(
+    'api_request_duration_seconds', 'Wall time of API requests.',
+    buckets=(0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10),
+    labelnames=('route', 'method'),
+)
+REQUEST_QUERIES = Histogram(
+    'api_request_db_queries', 'Database queries per API request.',
+    buckets=(1, 2, 3, 5, 8, 13, 21, 34, 55, 89, 144, 233),
+    labelnames=('route', 'method'),
+)
+PAYLOAD_NODES = Histogram(
+    'api_request_payload_nodes', 'Rows described by a write payload (the top-level object included).',
+    buckets=(1, 5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000, 10000),
+    labelnames=('route', 'method'),
+)
+REQUESTS = Counter(
+    'api_requests_total', 'API requests by response status.',
+    labelnames=('route', 'method', 'status'),
+)
+CACHE_REQUESTS = Counter(
+    'clinic_cache_requests_total', 'Clinic tree cache lookups.',
+    labelnames=('result',),
+)
+LOG_RECORDS_DROPPED = Counter(
+    'log_records_dropped_total', 'Log records dropped because the handler queue was full.',
+    labelnames=('handler',),
+)
+
+
+def observe_request(request, response, profile):
+    """Record a finished request; the route label is the URL pattern name."""
+    match = getattr(request, 'resolver_match', None)
+    route = match.url_name if match is not None and match.url_name else 'unmatched'
+    labels = {'route': route, 'method': request.method}
+    REQUEST_DURATION.observe(profile.wall, **labels)
+    REQUEST_QUERIES.observe(profile.db_queries, **labels)
+    if profile.payload_nodes is not None:
+        PAYLOAD_NODES.observe(profile.payload_nodes, **labels)
+    REQUESTS.inc(**labels, status=str(response.status_code))
+
+
+def observe_cache(hit):
+    CACHE_REQUESTS.inc(result='hit' if hit else 'miss')
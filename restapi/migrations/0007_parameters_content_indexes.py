@@ -0,0 +1,41 @@
+from django.db import migrations
+
+# PostgreSQL only: SQLite has neither GIN nor jsonb operators, and local
+# SQLite runs query content through JSON1 without indexes.
+INDEXES = [
+    # containment (@>) and jsonpath existence (@?) for /api/parameters/search
+    ('restapi_param_content_gin', 'USING gin ("content" jsonb_path_ops)'),
+    # numeric range filters on the common QC limit keys
+    ('restapi_param_content_min', '(("content" -> \'min\'))'),
+    ('restapi_param_content_max', '(("content" -> \'max\'))'),
+    ('restapi_param_content_tolerance', '(("content" -> \'tolerance\'))'),
+]
+
+
+def create_indexes(apps, schema_editor):
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    for name, definition in INDEXES:
+        schema_editor.execute(
+            f'CREATE INDEX CONCURRENTLY IF NOT EXISTS "{name}" ON "restapi_parameters" {definition}'
+        )
+
+
+def drop_indexes(apps, schema_editor):
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    for name, _ in INDEXES:
+        schema_editor.execute(f'DROP INDEX CONCURRENTLY IF EXISTS "{name}"')
+
+
+class Migration(migrations.Migration):
+    # CONCURRENTLY cannot run inside a transaction; the table stays writable meanwhile
+    atomic = False
+
+    dependencies = [
+        ('restapi', '0006_clinic_updated_at_department_updated_at_and_more'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_indexes, drop_indexes),
+    ]
@@ -0,0 +1,63 @@
+# Generated by Django 5.2.18 on 2026-10-18 18:27
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('restapi', '0007_parameters_content_indexes'),
+    ]
+
+    operations = [
+        # composite indexes first: each replaces the plain FK index dropped below
+        migrations.AddIndex(
+            model_name='department',
+            index=models.Index(fields=['clinic', 'id'], name='dept_clinic_id_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='department',
+            index=models.Index(condition=models.Q(('is_active', True)), fields=['clinic'], name='dept_clinic_active_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='equipmentdetails',
+            index=models.Index(fields=['equipment', 'id'], name='eqdetail_equipment_id_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='equipmentdetails',
+            index=models.Index(condition=models.Q(('is_active', True)), fields=['equipment'], name='eqdetail_equip_active_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='equipments',
+            index=models.Index(fields=['dep', 'id'], name='equip_dep_id_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='parameters',
+            index=models.Index(fields=['equipment', 'id'], name='param_equipment_id_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='parameters',
+            index=models.Index(condition=models.Q(('is_active', True)), fields=['equipment'], name='param_equip_active_idx'),
+        ),
+        migrations.AlterField(
+            model_name='department',
+            name='clinic',
+            field=models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.CASCADE, to='restapi.clinic'),
+        ),
+        migrations.AlterField(
+            model_name='equipmentdetails',
+            name='equipment',
+            field=models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.CASCADE, to='restapi.equipments'),
+        ),
+        migrations.AlterField(
+            model_name='equipments',
+            name='dep',
+            field=models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.CASCADE, to='restapi.department'),
+        ),
+        migrations.AlterField(
+            model_name='parameters',
+            name='equipment',
+            field=models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.CASCADE, to='restapi.equipments'),
+        ),
+    ]
@@ -0,0 +1,65 @@
+# Generated by Django 5.2.18 on 2026-10-18 18:43
+
+import django.core.serializers.json
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('restapi', '0008_composite_and_partial_indexes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ArchivedRow',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('model', models.CharField(max_length=100)),
+                ('row_id', models.BigIntegerField()),
+                ('data', models.JSONField(encoder=django.core.serializers.json.DjangoJSONEncoder)),
+                ('deleted_at', models.DateTimeField()),
+                ('archived_at', models.DateTimeField(auto_now_add=True)),
+            ],
+        ),
+        migrations.AddField(
+            model_name='department',
+            name='deleted_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='equipmentdetails',
+            name='deleted_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='equipments',
+            name='deleted_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='parameters',
+            name='deleted_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AddIndex(
+            model_name='department',
+            index=models.Index(condition=models.Q(('deleted_at__isnull', False)), fields=['deleted_at'], name='dept_deleted_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='equipmentdetails',
+            index=models.Index(condition=models.Q(('deleted_at__isnull', False)), fields=['deleted_at'], name='eqdetail_deleted_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='equipments',
+            index=models.Index(condition=models.Q(('deleted_at__isnull', False)), fields=['deleted_at'], name='equip_deleted_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='parameters',
+            index=models.Index(condition=models.Q(('deleted_at__isnull', False)), fields=['deleted_at'], name='param_deleted_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='archivedrow',
+            index=models.Index(fields=['model', 'row_id'], name='archived_model_row_idx'),
+        ),
+    ]
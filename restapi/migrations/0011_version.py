@@ -0,0 +1,38 @@
+# Generated by Django 5.2.18 on 2026-10-18 18:49
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('restapi', '0010_job'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='clinic',
+            name='version',
+            field=models.PositiveIntegerField(default=1),
+        ),
+        migrations.AddField(
+            model_name='department',
+            name='version',
+            field=models.PositiveIntegerField(default=1),
+        ),
+        migrations.AddField(
+            model_name='equipmentdetails',
+            name='version',
+            field=models.PositiveIntegerField(default=1),
+        ),
+        migrations.AddField(
+            model_name='equipments',
+            name='version',
+            field=models.PositiveIntegerField(default=1),
+        ),
+        migrations.AddField(
+            model_name='parameters',
+            name='version',
+            field=models.PositiveIntegerField(default=1),
+        ),
+    ]
@@ -0,0 +1,31 @@
+# Generated by Django 5.2.18 on 2026-10-18 18:52
+
+import django.core.serializers.json
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('restapi', '0011_version'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ChangeEvent',
+            fields=[
+                ('id', models.BigAutoField(primary_key=True, serialize=False)),
+                ('model', models.CharField(max_length=50)),
+                ('op', models.CharField(choices=[('create', 'create'), ('update', 'update'), ('delete', 'delete')], max_length=10)),
+                ('row_id', models.BigIntegerField()),
+                ('parent_id', models.BigIntegerField(null=True)),
+                ('clinic_id', models.BigIntegerField()),
+                ('version', models.PositiveIntegerField()),
+                ('data', models.JSONField(encoder=django.core.serializers.json.DjangoJSONEncoder, null=True)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+            ],
+            options={
+                'indexes': [models.Index(fields=['clinic_id', 'id'], name='change_clinic_id_idx')],
+            },
+        ),
+    ]
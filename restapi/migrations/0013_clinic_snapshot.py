@@ -0,0 +1,25 @@
+# Generated by Django 5.2.18 on 2026-10-18 18:55
+
+import django.core.serializers.json
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('restapi', '0012_change_event'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ClinicSnapshot',
+            fields=[
+                ('clinic', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, serialize=False, to='restapi.clinic')),
+                ('data', models.JSONField(encoder=django.core.serializers.json.DjangoJSONEncoder, null=True)),
+                ('etag', models.CharField(blank=True, max_length=40)),
+                ('last_modified', models.DateTimeField(null=True)),
+                ('built_at', models.DateTimeField(null=True)),
+            ],
+        ),
+    ]
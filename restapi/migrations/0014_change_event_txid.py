@@ -0,0 +1,30 @@
+# Generated by Django 5.2.18 on 2026-10-18 19:20
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('restapi', '0013_clinic_snapshot'),
+    ]
+
+    operations = [
+        migrations.RemoveIndex(
+            model_name='changeevent',
+            name='change_clinic_id_idx',
+        ),
+        migrations.AddField(
+            model_name='changeevent',
+            name='txid',
+            field=models.BigIntegerField(default=0),
+        ),
+        migrations.AddIndex(
+            model_name='changeevent',
+            index=models.Index(fields=['txid', 'id'], name='change_txid_id_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='changeevent',
+            index=models.Index(fields=['clinic_id', 'txid', 'id'], name='change_clinic_txid_idx'),
+        ),
+    ]
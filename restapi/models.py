@@ -1,9 +1,24 @@
+from django.core.serializers.json import DjangoJSONEncoder
 from django.db import models
 
 
+class LiveManager(models.Manager):
+    """
+    Rows that have not been soft-deleted. The default manager of the tree
+    models, so reverse relations (department_set, ...) skip deleted rows
+    too; ``all_objects`` still sees everything.
+    """
+
+    def get_queryset(self):
+        return super().get_queryset().filter(deleted_at__isnull=True)
+
+
 class Clinic(models.Model):
     #id = models.IntegerField(primary_key=True)   # MANUAL INTEGER PRIMARY KEY
     name = models.CharField(max_length=200)
+    updated_at = models.DateTimeField(auto_now=True)
+    # bumped by every write; a write naming an older version gets 409 (see concurrency.py)
+    version = models.PositiveIntegerField(default=1)
 
     def __str__(self):
         return self.name
@@ -13,8 +28,27 @@ class Department(models.Model):
     #id = models.IntegerField(primary_key=True)   # MANUAL INTEGER PRIMARY KEY
     name = models.CharField(max_length=200)
     is_active = models.BooleanField(default=True)
-    clinic = models.ForeignKey(Clinic, on_delete=models.CASCADE)
+    # indexed through Meta.indexes, (clinic, id) also serves lookups by clinic alone
+    clinic = models.ForeignKey(Clinic, on_delete=models.CASCADE, db_index=False)
     created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+    # bumped by every write; a write naming an older version gets 409 (see concurrency.py)
+    version = models.PositiveIntegerField(default=1)
+    # set by a soft delete; archive_deleted later moves the row to ArchivedRow
+    deleted_at = models.DateTimeField(null=True, blank=True)
+
+    objects = LiveManager()
+    all_objects = models.Manager()
+
+    class Meta:
+        indexes = [
+            # (id, clinic_id) lookups and per-clinic level loads ordered by id
+            models.Index(fields=['clinic', 'id'], name='dept_clinic_id_idx'),
+            # active-only reads (?department_active=true)
+            models.Index(fields=['clinic'], condition=models.Q(is_active=True), name='dept_clinic_active_idx'),
+            # soft-deleted rows waiting for archive_deleted
+            models.Index(fields=['deleted_at'], condition=models.Q(deleted_at__isnull=False), name='dept_deleted_idx'),
+        ]
 
     def __str__(self):
         return self.name
@@ -23,8 +57,23 @@ class Department(models.Model):
 class Equipments(models.Model):
     #id = models.IntegerField(primary_key=True)   # MANUAL INTEGER PRIMARY KEY
     equipment_name = models.CharField(max_length=200)
-    dep = models.ForeignKey(Department, on_delete=models.CASCADE)
+    dep = models.ForeignKey(Department, on_delete=models.CASCADE, db_index=False)
     created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+    # bumped by every write; a write naming an older version gets 409 (see concurrency.py)
+    version = models.PositiveIntegerField(default=1)
+    # set by a soft delete; archive_deleted later moves the row to ArchivedRow
+    deleted_at = models.DateTimeField(null=True, blank=True)
+
+    objects = LiveManager()
+    all_objects = models.Manager()
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['dep', 'id'], name='equip_dep_id_idx'),
+            # soft-deleted rows waiting for archive_deleted
+            models.Index(fields=['deleted_at'], condition=models.Q(deleted_at__isnull=False), name='equip_deleted_idx'),
+        ]
 
     def __str__(self):
         return self.equipment_name
@@ -37,7 +86,24 @@ class EquipmentDetails(models.Model):
     model = models.CharField(max_length=100)
     is_active = models.BooleanField(default=True)
     created_at = models.DateTimeField(auto_now_add=True)
-    equipment = models.ForeignKey(Equipments, on_delete=models.CASCADE)
+    updated_at = models.DateTimeField(auto_now=True)
+    equipment = models.ForeignKey(Equipments, on_delete=models.CASCADE, db_index=False)
+    # bumped by every write; a write naming an older version gets 409 (see concurrency.py)
+    version = models.PositiveIntegerField(default=1)
+    # set by a soft delete; archive_deleted later moves the row to ArchivedRow
+    deleted_at = models.DateTimeField(null=True, blank=True)
+
+    objects = LiveManager()
+    all_objects = models.Manager()
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['equipment', 'id'], name='eqdetail_equipment_id_idx'),
+            # active-only reads (?detail_active=true)
+            models.Index(fields=['equipment'], condition=models.Q(is_active=True), name='eqdetail_equip_active_idx'),
+            # soft-deleted rows waiting for archive_deleted
+            models.Index(fields=['deleted_at'], condition=models.Q(deleted_at__isnull=False), name='eqdetail_deleted_idx'),
+        ]
 
     def __str__(self):
         return self.equipment_num
@@ -46,10 +112,122 @@ class EquipmentDetails(models.Model):
 class Parameters(models.Model):
     #id = models.IntegerField(primary_key=True)   # MANUAL INTEGER PRIMARY KEY
     parameter_name = models.CharField(max_length=200)
-    equipment = models.ForeignKey(Equipments, on_delete=models.CASCADE)
+    equipment = models.ForeignKey(Equipments, on_delete=models.CASCADE, db_index=False)
     is_active = models.BooleanField(default=True)
     content = models.JSONField()                 # Stored as JSONB in PostgreSQL
     created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+    # bumped by every write; a write naming an older version gets 409 (see concurrency.py)
+    version = models.PositiveIntegerField(default=1)
+    # set by a soft delete; archive_deleted later moves the row to ArchivedRow
+    deleted_at = models.DateTimeField(null=True, blank=True)
+
+    objects = LiveManager()
+    all_objects = models.Manager()
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['equipment', 'id'], name='param_equipment_id_idx'),
+            models.Index(fields=['equipment'], condition=models.Q(is_active=True), name='param_equip_active_idx'),
+            # soft-deleted rows waiting for archive_deleted
+            models.Index(fields=['deleted_at'], condition=models.Q(deleted_at__isnull=False), name='param_deleted_idx'),
+        ]
 
     def __str__(self):
         return self.parameter_name
+
+
+class ArchivedRow(models.Model):
+    """A soft-deleted tree row moved out of its table by archive_deleted."""
+    model = models.CharField(max_length=100)       # e.g. "restapi.Department"
+    row_id = models.BigIntegerField()
+    data = models.JSONField(encoder=DjangoJSONEncoder)   # the row's columns
+    deleted_at = models.DateTimeField()
+    archived_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['model', 'row_id'], name='archived_model_row_idx'),
+        ]
+
+    def __str__(self):
+        return f'{self.model} {self.row_id}'
+
+
+class Job(models.Model):
+    """A write queued by an ?async=true request, run by restapi.jobs workers."""
+    QUEUED = 'queued'
+    RUNNING = 'running'
+    SUCCEEDED = 'succeeded'
+    FAILED = 'failed'
+    STATUS_CHOICES = [(s, s) for s in (QUEUED, RUNNING, SUCCEEDED, FAILED)]
+
+    kind = models.CharField(max_length=50)               # key of restapi.jobs.HANDLERS
+    clinic_id = models.BigIntegerField()                 # jobs of one clinic run one at a time, in order
+    payload = models.JSONField(encoder=DjangoJSONEncoder)   # validated data
+    status = models.CharField(max_length=20, choices=STATUS_CHOICES, default=QUEUED)
+    result = models.JSONField(null=True, blank=True)
+    error = models.JSONField(null=True, blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    started_at = models.DateTimeField(null=True, blank=True)
+    finished_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        indexes = [
+            # claiming: the oldest queued job, and whether its clinic is busy
+            models.Index(fields=['id'], condition=models.Q(status='queued'), name='job_queued_idx'),
+            models.Index(fields=['clinic_id', 'status'], name='job_clinic_status_idx'),
+        ]
+
+    def __str__(self):
+        return f'{self.kind} #{self.pk} ({self.status})'
+
+
+class ChangeEvent(models.Model):
+    """
+    Append-only outbox of tree writes, served by /api/changes?since=<id>.
+    Written in the same transaction as the change (see changes.py).
+    """
+    CREATE = 'create'
+    UPDATE = 'update'
+    DELETE = 'delete'
+    OP_CHOICES = [(op, op) for op in (CREATE, UPDATE, DELETE)]
+
+    # the id is the feed cursor
+    id = models.BigAutoField(primary_key=True)
+    # writing transaction's id on PostgreSQL (0 elsewhere); the feed is in (txid, id) order
+    txid = models.BigIntegerField(default=0)
+    model = models.CharField(max_length=50)              # model_name, e.g. "department"
+    op = models.CharField(max_length=10, choices=OP_CHOICES)
+    row_id = models.BigIntegerField()
+    parent_id = models.BigIntegerField(null=True)        # FK to the row's parent; None for a clinic
+    clinic_id = models.BigIntegerField()
+    version = models.PositiveIntegerField()              # the row's version after the write
+    data = models.JSONField(null=True, encoder=DjangoJSONEncoder)   # columns written; None for deletes
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['txid', 'id'], name='change_txid_id_idx'),
+            # ?clinic= feeds
+            models.Index(fields=['clinic_id', 'txid', 'id'], name='change_clinic_txid_idx'),
+        ]
+
+    def __str__(self):
+        return f'#{self.pk} {self.op} {self.model} {self.row_id}'
+
+
+class ClinicSnapshot(models.Model):
+    """
+    A clinic's rendered ClinicReadSerializer tree, kept current after every
+    write to it when CLINIC_SNAPSHOTS is on (see snapshots.py).
+    """
+    clinic = models.OneToOneField(Clinic, on_delete=models.CASCADE, primary_key=True)
+    data = models.JSONField(null=True, encoder=DjangoJSONEncoder)   # None until first built
+    # the tree's fingerprint (conditional.py) when it was rendered
+    etag = models.CharField(max_length=40, blank=True)
+    last_modified = models.DateTimeField(null=True)
+    built_at = models.DateTimeField(null=True)
+
+    def __str__(self):
+        return f'snapshot of clinic {self.clinic_id}'
@@ -0,0 +1,22 @@
+from rest_framework.pagination import CursorPagination
+
+
+class ClinicCursorPagination(CursorPagination):
+    """
+    Keyset pagination on the clinic primary key.
+
+    Each page is ``WHERE id > <cursor> ORDER BY id LIMIT n``, so fetching
+    page 1000 costs the same as fetching page 1.
+    """
+    ordering = 'id'
+    page_size = 50
+    page_size_query_param = 'limit'
+    max_page_size = 500
+
+
+class ParameterCursorPagination(CursorPagination):
+    """Keyset pagination on the parameter primary key, for search results."""
+    ordering = 'id'
+    page_size = 50
+    page_size_query_param = 'limit'
+    max_page_size = 500
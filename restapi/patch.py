@@ -0,0 +1,261 @@
+"""
+Partial updates (PATCH) of a clinic or an equipment subtree.
+
+A PATCH body is either a sparse nested payload (``application/json``)::
+
+    {"department": [{"id": 12, "equipments": [{"id": 40,
+        "parameters": [{"id": 7, "content": {"min": 1}}]}]}]}
+
+where an item with an ``id`` patches that existing row (only the fields
+it carries) and an item without one is created with its subtree, or a
+JSON Patch (``application/json-patch+json``) whose paths address rows by
+id instead of list position::
+
+    [{"op": "replace", "path": "/department/12/equipments/40/parameters/7/content", "value": {...}},
+     {"op": "add", "path": "/department/12/equipments/-", "value": {...}},
+     {"op": "remove", "path": "/department/12/equipments/41"}]
+
+Nothing is deleted unless a JSON Patch ``remove`` names the row; rows that
+are not mentioned are not read or written. Per level of the tree the
+patch costs one SELECT of the addressed rows (by primary key), at most
+one bulk UPDATE of the columns that changed, the bulk INSERTs of new
+subtrees and at most one delete_rows() (soft by default, see tree.py).
+Like a PUT, the patched root is checked against the version the client
+sent (or the one the request read) and the addressed rows are locked
+NOWAIT (see concurrency.py); the root itself is only written, and its
+version bumped, if the payload changes its fields or carries its version.
+"""
+from functools import lru_cache
+
+from django.utils import timezone
+from rest_framework.exceptions import NotFound, ValidationError
+from rest_framework.serializers import ListSerializer
+
+from .changes import record_updated, recording
+from .concurrency import check_version, lock_rows
+from .fastjson import FastJSONParser
+from .profiling import count_payload_nodes, current_profile
+from .tree import create_children, delete_rows, update_row
+
+JSON_PATCH_MEDIA_TYPE = 'application/json-patch+json'
+
+# marks an item to delete; not a string, so no JSON payload can produce it
+REMOVE = object()
+
+
+class JSONPatchParser(FastJSONParser):
+    media_type = JSON_PATCH_MEDIA_TYPE
+
+
+class PatchResult:
+
+    def __init__(self):
+        self.updated = 0
+        self.created = 0
+        self.deleted = 0
+
+    def as_dict(self):
+        return {'updated': self.updated, 'created': self.created, 'deleted': self.deleted}
+
+
+def is_json_patch(request):
+    return request.content_type.split(';')[0].strip() == JSON_PATCH_MEDIA_TYPE
+
+
+@lru_cache(maxsize=None)
+def _nested(serializer_class):
+    """Payload key -> child serializer class, for the writable nested lists of serializer_class."""
+    return {
+        name: type(field.child)
+        for name, field in serializer_class().fields.items()
+        if isinstance(field, ListSerializer) and not field.read_only
+    }
+
+
+def _unescape(segment):
+    return segment.replace('~1', '/').replace('~0', '~')
+
+
+def _row_id(segment, pointer):
+    try:
+        return int(segment)
+    except ValueError:
+        raise ValidationError({'path': pointer, 'errors': ["Rows are addressed by integer id."]})
+
+
+def from_json_patch(serializer_class, operations):
+    """
+    Turn JSON Patch operations into a sparse payload for patch_tree().
+    Operations on the same field are applied in order (the last one
+    wins); removing a row also drops any other operation on it.
+    """
+    if not isinstance(operations, list):
+        raise ValidationError({'errors': ["A JSON Patch document must be a list of operations."]})
+
+    root = {}
+    for op in operations:
+        if not isinstance(op, dict) or op.get('op') not in ('add', 'replace', 'remove') \
+                or not isinstance(op.get('path'), str) or not op['path'].startswith('/'):
+            raise ValidationError({'operation': op, 'errors': ["Supported operations are add, replace and remove."]})
+        pointer = op['path']
+        segments = [_unescape(s) for s in pointer[1:].split('/')]
+
+        node, children = root, _nested(serializer_class)
+        while len(segments) > 1 and segments[0] in children:
+            key, segment = segments[0], segments[1]
+            items = node.setdefault(key, [])
+            if segment == '-' and len(segments) == 2:
+                if op['op'] != 'add' or not isinstance(op.get('value'), dict):
+                    raise ValidationError({'path': pointer, 'errors': ["Use add with an object to append a row."]})
+                items.append(op['value'])
+                node = None
+                break
+            row_id = _row_id(segment, pointer)
+            item = next((i for i in items if i.get('id') == row_id), None)
+            if item is None:
+                item = {'id': row_id}
+                items.append(item)
+            if len(segments) == 2:
+                if op['op'] != 'remove':
+                    raise ValidationError({'path': pointer, 'errors': ["Rows can only be removed; patch their fields."]})
+                item.clear()
+                item.update({'id': row_id, REMOVE: True})
+                node = None
+                break
+            node, children = item, _nested(children[key])
+            segments = segments[2:]
+
+        if node is None:
+            continue
+        if node.get(REMOVE):
+            continue
+        if len(segments) != 1 or segments[0] in children:
+            raise ValidationError({'path': pointer, 'errors': ["Path must end at a field or a row."]})
+        if op['op'] == 'remove':
+            raise ValidationError({'path': pointer, 'errors': ["Fields cannot be removed."]})
+        if 'value' not in op:
+            raise ValidationError({'path': pointer, 'errors': ["Missing value."]})
+        node[segments[0]] = op['value']
+    return root
+
+
+def _validate(serializer_class, data, partial, pointer):
+    try:
+        return serializer_class(data=data, partial=partial).run_validation(data)
+    except ValidationError as ve:
+        raise ValidationError({'path': pointer or '/', 'errors': ve.detail})
+
+
+def _split(serializer_class, data, pointer):
+    """Validate the row's own fields (partially) and return them with the raw nested lists."""
+    if not isinstance(data, dict):
+        raise ValidationError({'path': pointer or '/', 'errors': ["Expected an object."]})
+    children = _nested(serializer_class)
+    own = {k: v for k, v in data.items() if k not in children and k is not REMOVE}
+    nested = {}
+    for key in children:
+        if key in data:
+            if not isinstance(data[key], list):
+                raise ValidationError({'path': f'{pointer}/{key}', 'errors': ["Expected a list."]})
+            nested[key] = data[key]
+    return _validate(serializer_class, own, True, pointer), nested
+
+
+def patch_tree(instance, serializer_class, level_children, data, result=None):
+    """
+    Apply a sparse payload to ``instance``, whose rows below are described
+    by ``level_children`` (the (key, Level) pairs of tree.py), and return a
+    PatchResult with the rows written. Run it in a transaction.
+    """
+    result = result or PatchResult()
+    profile = current_profile()
+    if profile is not None:
+        profile.payload_nodes = count_payload_nodes(serializer_class(), data)
+    fields, nested = _split(serializer_class, data, '')
+    version = fields.pop('version', None)
+    with recording():
+        if update_row(instance, fields, [f for f in fields if f != 'id'], version):
+            result.updated += 1
+
+        children = _nested(serializer_class)
+        for key, level in level_children:
+            if key in nested:
+                _patch_level(level, children[key], [(instance, nested[key], f'/{key}')], result)
+    return result
+
+
+def _patch_level(level, serializer_class, pending, result):
+    """
+    ``pending``: (parent, [item, ...], pointer of the list) triples; all of
+    them belong to the same level, so it is handled with one query per
+    kind of write.
+    """
+    parent_attname = level.parent_attname
+    ids = {item['id'] for _, items, _ in pending for item in items
+           if isinstance(item, dict) and type(item.get('id')) is int}
+    existing = lock_rows(level.model.objects.filter(pk__in=ids)) if ids else {}
+    children = _nested(serializer_class)
+
+    to_create, to_delete = [], []
+    # row id -> (row, [changed field, ...]); an id repeated in the payload
+    # patches the same row, so its changes are merged and written once
+    changes, changed_fields = {}, set()
+    below = {key: [] for key, _ in level.children}
+    for parent, items, pointer in pending:
+        new_items = []
+        for item in items:
+            if not isinstance(item, dict) or 'id' not in item:
+                new_items.append(_validate(serializer_class, item, False, f'{pointer}/-'))
+                continue
+            row_pointer = f'{pointer}/{item["id"]}'
+            if type(item['id']) is not int:
+                raise ValidationError({'path': row_pointer, 'errors': ["id must be an integer."]})
+            obj = existing.get(item['id'])
+            if obj is None or getattr(obj, parent_attname) != parent.pk:
+                raise NotFound(f"{row_pointer} does not exist")
+            setattr(obj, level.parent_field, parent)    # cached for the change records
+            if item.get(REMOVE):
+                check_version(obj, item.get('version'))
+                if obj not in to_delete:
+                    to_delete.append(obj)
+                continue
+            fields, nested = _split(serializer_class, item, row_pointer)
+            check_version(obj, fields.get('version'))
+            changed = [name for name in level.update_fields if name in fields
+                       and getattr(obj, name) != fields[name]]
+            for name in changed:
+                setattr(obj, name, fields[name])
+            if changed:
+                merged = changes.setdefault(obj.pk, (obj, []))[1]
+                merged.extend(name for name in changed if name not in merged)
+                changed_fields.update(changed)
+            for key, _ in level.children:
+                if key in nested:
+                    below[key].append((obj, nested[key], f'{row_pointer}/{key}'))
+        if new_items:
+            to_create.append((parent, new_items))
+
+    if changes:
+        changes = list(changes.values())
+        # bulk_update skips pre_save, so auto_now has to be applied by hand
+        now = timezone.now()
+        for obj, _ in changes:
+            obj.updated_at = now
+            obj.version += 1
+        level.model.objects.bulk_update(
+            [obj for obj, _ in changes], sorted(changed_fields) + ['updated_at', 'version']
+        )
+        record_updated(changes)
+        result.updated += len(changes)
+
+    if to_delete:
+        # only the rows named by a JSON Patch remove, with their subtrees
+        delete_rows(level, to_delete)
+        result.deleted += len(to_delete)
+
+    if to_create:
+        result.created += len(create_children(level, to_create))
+
+    for key, child in level.children:
+        if below[key]:
+            _patch_level(child, children[key], below[key], result)
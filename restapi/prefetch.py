@@ -0,0 +1,62 @@
+"""
+Prefetch planning for the nested read serializers.
+
+The plan is derived from the serializer classes themselves: every nested
+``many=True`` field becomes a Prefetch whose queryset is limited with
+``.only()`` to the columns that serializer declares (plus the FK used to
+attach rows to their parent). Reading a tree therefore costs one query per
+level no matter how many rows it has.
+"""
+from django.db.models import Prefetch
+from rest_framework import serializers
+
+
+def _split_fields(serializer):
+    """Return (model columns, nested ListSerializer fields) declared by a serializer."""
+    columns, nested = [], []
+    for field in serializer.fields.values():
+        if isinstance(field, serializers.ListSerializer):
+            nested.append(field)
+        elif field.source != '*':
+            columns.append(field.source.split('.')[0])
+    return columns, nested
+
+
+def reverse_fk_name(model, accessor):
+    for rel in model._meta.related_objects:
+        if rel.get_accessor_name() == accessor:
+            return rel.field.name
+    raise ValueError(f"{model.__name__} has no reverse relation {accessor!r}")
+
+
+def prefetch_plan(serializer, filters=None):
+    """
+    Build the list of Prefetch objects needed to render ``serializer`` without extra queries.
+
+    ``filters`` maps a model to a Q object restricting which of its rows are
+    prefetched (e.g. only active departments).
+    """
+    filters = filters or {}
+    model = serializer.Meta.model
+    _, nested = _split_fields(serializer)
+    plan = []
+    for field in nested:
+        child = field.child
+        child_model = child.Meta.model
+        columns, _ = _split_fields(child)
+        fk_name = reverse_fk_name(model, field.source)
+        queryset = child_model.objects.only(*columns, fk_name).order_by('pk')
+        if child_model in filters:
+            queryset = queryset.filter(filters[child_model])
+        queryset = queryset.prefetch_related(*prefetch_plan(child, filters))
+        plan.append(Prefetch(field.source, queryset=queryset))
+    return plan
+
+
+def planned_queryset(serializer_class, queryset=None, filters=None):
+    """``queryset`` (all rows by default) trimmed and prefetched for ``serializer_class``."""
+    serializer = serializer_class()
+    if queryset is None:
+        queryset = serializer.Meta.model.objects.all()
+    columns, _ = _split_fields(serializer)
+    return queryset.only(*columns).prefetch_related(*prefetch_plan(serializer, filters))
@@ -0,0 +1,172 @@
+"""
+Per-request performance profile, filled in while the request runs.
+
+RequestIDMiddleware starts a RequestProfile and stores it in a context
+variable. A permanent execute_wrapper on every DB connection adds each
+query's count and time to it. Serializers with TimedSerializerMixin, or
+code wrapped in ``span(name)``, add named timings. The result is sent
+back as a ``Server-Timing`` header and logged as one structured record
+keyed by request_id.
+
+Context variables follow a request into sync_to_async threads, so this
+works the same under WSGI and ASGI.
+"""
+import contextvars
+import logging
+import time
+from contextlib import contextmanager
+
+from django.conf import settings
+from django.db.backends.signals import connection_created
+from django.dispatch import receiver
+from rest_framework.serializers import ListSerializer
+
+logger = logging.getLogger(__name__)
+
+_current = contextvars.ContextVar('request_profile', default=None)
+
+
+class RequestProfile:
+
+    def __init__(self, request_id):
+        self.request_id = request_id
+        self.started = time.perf_counter()
+        self.wall = None
+        self.db_queries = 0
+        self.db_time = 0.0
+        self.spans = {}         # name -> seconds, in first-recorded order
+        self.payload_nodes = None   # rows described by the write payload, if any
+
+    def add(self, name, seconds):
+        self.spans[name] = self.spans.get(name, 0.0) + seconds
+
+    def finish(self):
+        self.wall = time.perf_counter() - self.started
+
+    def server_timing(self):
+        metrics = [
+            f'total;dur={self.wall * 1000:.1f}',
+            f'db;dur={self.db_time * 1000:.1f};desc="{self.db_queries} queries"',
+        ]
+        metrics += [f'{name};dur={seconds * 1000:.1f}' for name, seconds in self.spans.items()]
+        return ', '.join(metrics)
+
+    def as_dict(self):
+        return {
+            'request_id': self.request_id,
+            'wall_ms': round(self.wall * 1000, 2),
+            'db_queries': self.db_queries,
+            'db_ms': round(self.db_time * 1000, 2),
+            'payload_nodes': self.payload_nodes,
+            **{f'{name}_ms': round(seconds * 1000, 2) for name, seconds in self.spans.items()},
+        }
+
+
+def enabled():
+    return getattr(settings, 'REQUEST_PROFILING', True)
+
+
+def current_profile():
+    return _current.get()
+
+
+def start(request_id):
+    """Begin profiling the current request; returns a token for stop()."""
+    profile = RequestProfile(request_id)
+    return profile, _current.set(profile)
+
+
+def discard(token):
+    """Stop profiling without a response (the view raised)."""
+    _current.reset(token)
+
+
+def stop(profile, token, request, response):
+    """Finish ``profile``, annotate ``response`` and log the record."""
+    _current.reset(token)
+    profile.finish()
+
+    if getattr(settings, 'SERVER_TIMING_HEADER', True):
+        response['Server-Timing'] = profile.server_timing()
+
+    record = {
+        **profile.as_dict(),
+        'method': request.method,
+        'path': request.path,
+        'status': response.status_code,
+        'request_bytes': int(request.META.get('CONTENT_LENGTH') or 0),
+        # streamed bodies are produced after the view returns
+        'response_bytes': None if response.streaming else len(response.content),
+    }
+    logger.info('request %s %s %s', request.method, request.path, response.status_code, extra={'profile': record})
+    return response
+
+
+@contextmanager
+def span(name):
+    """Add the time spent in the block to the current request's ``name`` timing."""
+    profile = _current.get()
+    if profile is None:
+        yield
+        return
+    start_time = time.perf_counter()
+    try:
+        yield
+    finally:
+        profile.add(name, time.perf_counter() - start_time)
+
+
+def _record_query(execute, sql, params, many, context):
+    profile = _current.get()
+    if profile is None:
+        return execute(sql, params, many, context)
+    start_time = time.perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        profile.db_queries += 1
+        profile.db_time += time.perf_counter() - start_time
+
+
+@receiver(connection_created)
+def _install_query_recorder(sender, connection, **kwargs):
+    # connection_created fires on every (re)connect of the same wrapper
+    if _record_query not in connection.execute_wrappers:
+        connection.execute_wrappers.append(_record_query)
+
+
+def count_payload_nodes(serializer, data):
+    """Rows ``data`` describes for ``serializer``: itself plus every nested list item, recursively."""
+    if not isinstance(data, dict):
+        return 0
+    total = 1
+    for name, field in serializer.fields.items():
+        items = data.get(name)
+        if isinstance(field, ListSerializer) and not field.read_only and isinstance(items, list):
+            total += sum(count_payload_nodes(field.child, item) for item in items)
+    return total
+
+
+class TimedSerializerMixin:
+    """
+    Record validation, save and representation time of a top-level
+    serializer under the request's ``serializer`` timing, and the size
+    of the payload it validates. Nested serializers are covered by their
+    parent's timing.
+    """
+
+    def is_valid(self, *args, **kwargs):
+        profile = _current.get()
+        if profile is not None and hasattr(self, 'initial_data'):
+            profile.payload_nodes = count_payload_nodes(self, self.initial_data)
+        with span('serializer'):
+            return super().is_valid(*args, **kwargs)
+
+    def save(self, **kwargs):
+        with span('serializer'):
+            return super().save(**kwargs)
+
+    @property
+    def data(self):
+        with span('serializer'):
+            return super().data
@@ -0,0 +1,185 @@
+"""
+Compiled read path: render the nested read serializers' output straight
+from ``.values()`` rows.
+
+Each level of the tree is fetched with one ``.values()`` query restricted
+to the columns its read serializer declares, children are grouped under
+their parent by FK in plain dicts, and the result has exactly the shape
+``ClinicReadSerializer(...).data`` has, without instantiating a model or
+running a Field per value.
+
+Only serializers made of plain scalar fields (whose representation of a
+database value is the value itself) and nested ``many=True`` serializers
+can be compiled; ``tree_reader`` returns None for anything else and
+callers fall back to the serializer.
+"""
+from collections import defaultdict
+
+from django.conf import settings
+from rest_framework import serializers
+
+from .prefetch import reverse_fk_name
+from .profiling import span
+
+# fields whose to_representation() of a values() column is the value itself
+_PASSTHROUGH = (
+    serializers.IntegerField,
+    serializers.CharField,
+    serializers.BooleanField,
+    serializers.JSONField,
+)
+_BIGINT = getattr(serializers, 'BigIntegerField', None)
+
+
+def _is_passthrough(field):
+    if '.' in field.source or field.source == '*':
+        return False
+    if type(field) in _PASSTHROUGH:
+        return not getattr(field, 'binary', False)
+    if _BIGINT is not None and type(field) is _BIGINT:
+        # BigIntegerField may render as a string (COERCE_BIGINT_TO_STRING)
+        return field.to_representation(1) == 1
+    return False
+
+
+class Unsupported(Exception):
+    pass
+
+
+class _Level:
+
+    def __init__(self, serializer):
+        self.model = serializer.Meta.model
+        self.output = []        # (key, column or None for nested), in serializer order
+        self.columns = []
+        self.children = []      # (key, fk attname, _Level)
+        for field in serializer.fields.values():
+            if isinstance(field, serializers.ListSerializer):
+                if type(field) is not serializers.ListSerializer:
+                    raise Unsupported(field)
+                child = _Level(field.child)
+                fk_name = reverse_fk_name(self.model, field.source)
+                fk_attname = child.model._meta.get_field(fk_name).attname
+                self.children.append((field.field_name, fk_attname, child))
+                self.output.append((field.field_name, None))
+            elif _is_passthrough(field):
+                self.columns.append(field.source)
+                self.output.append((field.field_name, field.source))
+            else:
+                raise Unsupported(field)
+        if 'id' not in self.columns:
+            self.columns.append('id')
+        self.id_index = self.columns.index('id')
+        # output key -> position in a values_list() row (None: filled in later)
+        self.positions = [
+            (key, self.columns.index(column) if column is not None else None)
+            for key, column in self.output
+        ]
+
+    def build(self, row):
+        """Output dict for a values_list() row; nested keys hold None until attached."""
+        return {key: row[i] if i is not None else None for key, i in self.positions}
+
+    def _rows(self, fk_attname, parent_ids, filters):
+        queryset = self.model.objects.filter(**{f'{fk_attname}__in': parent_ids})
+        if self.model in filters:
+            queryset = queryset.filter(filters[self.model])
+        return queryset.order_by('pk').values_list(*self.columns, fk_attname)
+
+    def _add(self, row, grouped, by_id):
+        out = self.build(row)
+        grouped[row[-1]].append(out)
+        by_id[row[self.id_index]] = out
+
+    def fetch(self, fk_attname, parent_ids, filters):
+        """Rendered rows of this level for ``parent_ids``, grouped by parent id."""
+        grouped = defaultdict(list)
+        by_id = {}
+        # plain iteration, not iterator(): on PostgreSQL that would open a
+        # server-side cursor (extra round trips) for every level of every GET
+        for row in self._rows(fk_attname, parent_ids, filters):
+            self._add(row, grouped, by_id)
+        self.attach(by_id, filters)
+        return grouped
+
+    async def afetch(self, fk_attname, parent_ids, filters):
+        grouped = defaultdict(list)
+        by_id = {}
+        # not aiterator(): for values_list() it runs the query in the event loop thread
+        async for row in self._rows(fk_attname, parent_ids, filters):
+            self._add(row, grouped, by_id)
+        await self.aattach(by_id, filters)
+        return grouped
+
+    def attach(self, by_id, filters):
+        """Fill the nested lists of already-rendered rows (``{id: output dict}``)."""
+        ids = list(by_id)
+        for key, fk_attname, child in self.children:
+            grouped = child.fetch(fk_attname, ids, filters) if ids else {}
+            for pk, out in by_id.items():
+                out[key] = grouped.get(pk, [])
+
+    async def aattach(self, by_id, filters):
+        ids = list(by_id)
+        for key, fk_attname, child in self.children:
+            grouped = await child.afetch(fk_attname, ids, filters) if ids else {}
+            for pk, out in by_id.items():
+                out[key] = grouped.get(pk, [])
+
+
+class TreeReader:
+
+    def __init__(self, serializer_class):
+        self.root = _Level(serializer_class())
+
+    def values(self, queryset):
+        """The root queryset as values() rows carrying the columns render() needs."""
+        return queryset.values(*self.root.columns)
+
+    def _roots(self, rows):
+        columns = self.root.columns
+        result = [self.root.build([row[c] for c in columns]) for row in rows]
+        return result, {row['id']: out for row, out in zip(rows, result)}
+
+    def render(self, rows, filters=None):
+        """Output dicts for root ``rows`` (from values()), children fetched one level at a time."""
+        with span('render'):
+            result, by_id = self._roots(list(rows))
+            self.root.attach(by_id, filters or {})
+        return result
+
+    def read(self, queryset, filters=None):
+        return self.render(self.values(queryset), filters)
+
+    async def aread(self, queryset, filters=None):
+        """Async read(): the same queries through the async ORM."""
+        with span('render'):
+            result, by_id = self._roots([row async for row in self.values(queryset)])
+            await self.root.aattach(by_id, filters or {})
+        return result
+
+    def iter_read(self, queryset, chunk_size, filters=None):
+        """Stream rendered roots; rows come from a server-side cursor, children per chunk."""
+        chunk = []
+        for row in self.values(queryset).iterator(chunk_size=chunk_size):
+            chunk.append(row)
+            if len(chunk) >= chunk_size:
+                yield from self.render(chunk, filters)
+                chunk = []
+        if chunk:
+            yield from self.render(chunk, filters)
+
+
+_readers = {}
+
+
+def tree_reader(serializer_class):
+    """Compiled reader for ``serializer_class``, or None when disabled or unsupported."""
+    if not getattr(settings, 'COMPILED_READS', True):
+        return None
+    if serializer_class not in _readers:
+        try:
+            _readers[serializer_class] = TreeReader(serializer_class)
+        except Unsupported:
+            _readers[serializer_class] = None
+    return _readers[serializer_class]
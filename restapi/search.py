@@ -0,0 +1,156 @@
+"""
+Queries on ``Parameters.content`` pushed down to SQL.
+
+Three kinds of condition are supported, each compiled per backend:
+
+* containment: ``content @> '{...}'`` on PostgreSQL, served by the GIN
+  ``jsonb_path_ops`` index. SQLite has no containment operator, so the
+  object is flattened into one JSON1 equality per leaf (``JSON_EXTRACT``);
+  there lists are compared as a whole rather than as subsets.
+* key exists: ``content @? '$."key"'`` on PostgreSQL (``jsonb_path_ops``
+  supports ``@?`` but not ``?``), ``JSON_TYPE(...) IS NOT NULL`` elsewhere.
+* numeric range on a top-level key: ``content -> 'key'`` compared as jsonb,
+  served by the expression indexes from migration 0007, and restricted to
+  numeric values so strings, booleans or objects never match.
+"""
+import json
+import math
+
+from django.db import NotSupportedError, connections
+from django.db.models import BooleanField, F, Func
+from django.db.models.fields.json import HasKey, KeyTransform, compile_json_path
+from rest_framework.exceptions import ValidationError
+
+# values accepted as a range bound, same as JSON numbers
+_NUMBER = (int, float)
+
+
+class KeyExists(Func):
+    """``key`` is present at the top level of a JSON column (its value may be null)."""
+    output_field = BooleanField()
+
+    def __init__(self, expression, key):
+        super().__init__(expression)
+        self.key = key
+
+    def as_sql(self, compiler, connection, **extra_context):
+        return compiler.compile(HasKey(self.source_expressions[0], self.key))
+
+    def as_postgresql(self, compiler, connection, **extra_context):
+        lhs, params = compiler.compile(self.source_expressions[0])
+        return f"({lhs} @? %s::jsonpath)", (*params, compile_json_path([self.key]))
+
+
+class KeyIsNumber(Func):
+    """The value under top-level ``key`` is a JSON number."""
+    output_field = BooleanField()
+
+    def __init__(self, expression, key):
+        super().__init__(expression)
+        self.key = key
+
+    def as_sql(self, compiler, connection, **extra_context):
+        raise NotSupportedError("JSON type checks are implemented for PostgreSQL and SQLite only.")
+
+    def as_postgresql(self, compiler, connection, **extra_context):
+        lhs, params = compiler.compile(self.source_expressions[0])
+        return f"(jsonb_typeof({lhs} -> %s) = 'number')", (*params, self.key)
+
+    def as_sqlite(self, compiler, connection, **extra_context):
+        lhs, params = compiler.compile(self.source_expressions[0])
+        return f"(JSON_TYPE({lhs}, %s) IN ('integer', 'real'))", (*params, compile_json_path([self.key]))
+
+
+def _filter_key(queryset, expression, lookup, value):
+    # lookups on a KeyTransform are resolved by name, so go through an alias
+    name = f"_content_{len(queryset.query.annotations)}"
+    return queryset.alias(**{name: expression}).filter(**{f"{name}__{lookup}": value})
+
+
+def _key(field, path):
+    expression = F(field)
+    for key in path:
+        expression = KeyTransform(key, expression)
+    return expression
+
+
+def _filter_leaves(queryset, field, value, path):
+    # one exact match per leaf of a (nested) object
+    for key, item in value.items():
+        if isinstance(item, dict) and item:
+            queryset = _filter_leaves(queryset, field, item, path + [key])
+        elif isinstance(item, dict):
+            # {"key": {}}: only require the key to exist
+            queryset = _filter_key(queryset, _key(field, path + [key]), "isnull", False)
+        else:
+            queryset = _filter_key(queryset, _key(field, path + [key]), "exact", item)
+    return queryset
+
+
+def contains(queryset, field, value):
+    """Rows whose JSON column contains the object ``value``."""
+    if connections[queryset.db].features.supports_json_field_contains:
+        return queryset.filter(**{f"{field}__contains": value})
+    return _filter_leaves(queryset, field, value, [])
+
+
+def has_key(queryset, field, key):
+    return queryset.filter(KeyExists(F(field), key))
+
+
+def key_range(queryset, field, key, low=None, high=None):
+    """Rows whose top-level ``key`` holds a number within [low, high] (either bound optional)."""
+    queryset = queryset.filter(KeyIsNumber(F(field), key))
+    if low is not None:
+        queryset = _filter_key(queryset, _key(field, [key]), "gte", low)
+    if high is not None:
+        queryset = _filter_key(queryset, _key(field, [key]), "lte", high)
+    return queryset
+
+
+def _bound(raw, name):
+    if raw == "":
+        return None
+    try:
+        value = json.loads(raw)
+    except ValueError:
+        value = None
+    if type(value) not in _NUMBER or not math.isfinite(value):
+        raise ValidationError({"range": [f"{name} bound must be a number, got {raw!r}."]})
+    return value
+
+
+def search(queryset, params, field="content"):
+    """
+    Filter ``queryset`` by ``?contains=&has_key=&range=`` query parameters.
+
+    ``contains`` is a JSON object, ``has_key`` a key name and ``range``
+    ``<key>,<min>,<max>`` with either bound left empty. Every parameter can
+    be repeated and all conditions must hold. Raises ValidationError.
+    """
+    if not any(params.getlist(name) for name in ("contains", "has_key", "range")):
+        raise ValidationError({"query": ["Give at least one of contains, has_key or range."]})
+
+    for raw in params.getlist("contains"):
+        try:
+            value = json.loads(raw)
+        except ValueError:
+            raise ValidationError({"contains": ["Must be a JSON object."]})
+        if not isinstance(value, dict):
+            raise ValidationError({"contains": ["Must be a JSON object."]})
+        queryset = contains(queryset, field, value)
+
+    for key in params.getlist("has_key"):
+        if not key:
+            raise ValidationError({"has_key": ["Must not be empty."]})
+        queryset = has_key(queryset, field, key)
+
+    for raw in params.getlist("range"):
+        parts = raw.rsplit(",", 2)
+        if len(parts) != 3 or not parts[0]:
+            raise ValidationError({"range": ["Use <key>,<min>,<max>; either bound may be empty."]})
+        key, low, high = parts[0], _bound(parts[1], "min"), _bound(parts[2], "max")
+        if low is None and high is None:
+            raise ValidationError({"range": ["At least one bound is required."]})
+        queryset = key_range(queryset, field, key, low, high)
+    return queryset
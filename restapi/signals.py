@@ -0,0 +1,31 @@
+from django.db import transaction
+from django.dispatch import Signal
+
+# Sent after the transaction that changed anything in a clinic's tree commits.
+# Receivers get ``clinic_id``.
+clinic_changed = Signal()
+
+
+def notify_clinic_changed(clinic_id):
+    """Fire clinic_changed for ``clinic_id`` once the current transaction commits."""
+    if clinic_id is None:
+        return
+    transaction.on_commit(lambda: clinic_changed.send(sender=None, clinic_id=clinic_id))
+
+
+def clinic_id_for(obj):
+    """Id of the clinic whose tree ``obj`` (any model of the tree) belongs to."""
+    from .models import Clinic, Department, Equipments
+
+    if isinstance(obj, Clinic):
+        return obj.pk
+    if isinstance(obj, Department):
+        return obj.clinic_id
+    if isinstance(obj, Equipments):
+        return Department.objects.filter(pk=obj.dep_id).values_list('clinic_id', flat=True).first()
+    # EquipmentDetails / Parameters
+    return (
+        Equipments.objects.filter(pk=obj.equipment_id)
+        .values_list('dep__clinic_id', flat=True)
+        .first()
+    )
@@ -0,0 +1,146 @@
+"""
+Materialized clinic trees for single-row reads (CLINIC_SNAPSHOTS).
+
+ClinicSnapshot stores each clinic's rendered ClinicReadSerializer tree
+together with the tree's ETag / Last-Modified. When snapshots are on, GET
+/api/get_clinic/<id>/ answers from that one row, conditional requests
+included, instead of running the fingerprint aggregate and the per-level
+reads.
+
+Snapshots are rebuilt after a write commits, from the ``clinic_changed``
+signal, and only for the clinic that changed. Until the rebuild has run
+a reader may get the previous tree, with the previous ETag. A clinic
+without a snapshot (or with snapshots off) is read from the tables as
+before. ``manage.py rebuild_snapshots`` backfills them in parallel
+batches.
+
+A rebuild locks the snapshot rows it is about to write before it reads
+the trees. Two rebuilds of one clinic therefore run one after the other,
+and the later one reads data at least as new as the earlier, so an older
+tree can never overwrite a newer one.
+"""
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from itertools import islice
+
+from django.conf import settings
+from django.db import connections, router, transaction
+from django.dispatch import receiver
+from django.utils import timezone
+
+from .conditional import clinic_etag, clinic_fingerprints, clinic_last_modified
+from .models import Clinic, ClinicSnapshot
+from .prefetch import planned_queryset
+from .readers import tree_reader
+from .serializers import ClinicReadSerializer
+from .signals import clinic_changed
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_BATCH_SIZE = 200
+
+
+def enabled():
+    return getattr(settings, 'CLINIC_SNAPSHOTS', False)
+
+
+def _render(clinic_ids):
+    clinics = Clinic.objects.filter(pk__in=clinic_ids)
+    reader = tree_reader(ClinicReadSerializer)
+    if reader is not None:
+        rows = reader.read(clinics)
+    else:
+        rows = ClinicReadSerializer(planned_queryset(ClinicReadSerializer, clinics), many=True).data
+    return {row['id']: row for row in rows}
+
+
+def rebuild(clinic_ids):
+    """Render and store the snapshots of ``clinic_ids``; returns how many were written."""
+    with transaction.atomic():
+        ids = list(Clinic.objects.filter(pk__in=clinic_ids).order_by('pk').values_list('pk', flat=True))
+        if not ids:
+            return 0
+        # create missing rows first so that every snapshot of the batch can be locked
+        ClinicSnapshot.objects.bulk_create([ClinicSnapshot(clinic_id=pk) for pk in ids], ignore_conflicts=True)
+        list(ClinicSnapshot.objects.select_for_update().filter(pk__in=ids).order_by('pk').values_list('pk'))
+
+        fingerprints = clinic_fingerprints(ids)
+        trees = _render(ids)
+        now = timezone.now()
+        snapshots = [
+            ClinicSnapshot(
+                clinic_id=pk, data=trees[pk], etag=fingerprints[pk].etag,
+                last_modified=fingerprints[pk].last_modified, built_at=now,
+            )
+            for pk in ids if pk in trees and pk in fingerprints
+        ]
+        ClinicSnapshot.objects.bulk_update(snapshots, ['data', 'etag', 'last_modified', 'built_at'])
+    return len(snapshots)
+
+
+def _rebuild_in_thread(clinic_ids):
+    try:
+        return rebuild(clinic_ids)
+    finally:
+        connections.close_all()
+
+
+def rebuild_all(batch_size=DEFAULT_BATCH_SIZE, workers=4, clinic_ids=None):
+    """
+    Rebuild the snapshots of every clinic (or of ``clinic_ids``) in batches
+    of ``batch_size``, ``workers`` batches at a time, each batch on its own
+    thread and connection and in its own transaction. Returns the count.
+    """
+    queryset = Clinic.objects.order_by('pk')
+    if clinic_ids is not None:
+        queryset = queryset.filter(pk__in=clinic_ids)
+    ids = queryset.values_list('pk', flat=True).iterator(chunk_size=batch_size)
+    batches = iter(lambda: list(islice(ids, batch_size)), [])
+    # SQLite has a single writer: parallel batches would only fail on its lock
+    if workers <= 1 or connections[router.db_for_write(ClinicSnapshot)].vendor == 'sqlite':
+        return sum(rebuild(batch) for batch in batches)
+    with ThreadPoolExecutor(workers) as pool:
+        return sum(pool.map(_rebuild_in_thread, batches))
+
+
+def get_snapshot(clinic_id):
+    """The built snapshot of ``clinic_id``, or None (also when snapshots are off)."""
+    if not enabled():
+        return None
+    return ClinicSnapshot.objects.filter(pk=clinic_id, data__isnull=False).first()
+
+
+async def aget_snapshot(clinic_id):
+    if not enabled():
+        return None
+    return await ClinicSnapshot.objects.filter(pk=clinic_id, data__isnull=False).afirst()
+
+
+def request_snapshot(request, clinic_id):
+    # the condition() functions and the view share one lookup per request
+    cache = request.__dict__.setdefault('_clinic_snapshots', {})
+    if clinic_id not in cache:
+        cache[clinic_id] = get_snapshot(clinic_id)
+    return cache[clinic_id]
+
+
+def snapshot_etag(request, clinic_id, *args, **kwargs):
+    snapshot = request_snapshot(request, clinic_id)
+    return snapshot.etag if snapshot is not None else clinic_etag(request, clinic_id)
+
+
+def snapshot_last_modified(request, clinic_id, *args, **kwargs):
+    snapshot = request_snapshot(request, clinic_id)
+    return snapshot.last_modified if snapshot is not None else clinic_last_modified(request, clinic_id)
+
+
+@receiver(clinic_changed)
+def _rebuild_on_change(sender, clinic_id, **kwargs):
+    if not enabled():
+        return
+    try:
+        rebuild([clinic_id])
+    except Exception as e:
+        # the write has committed already; never serve the stale tree instead
+        logger.exception("Snapshot rebuild of clinic %s failed: %s", clinic_id, e)
+        ClinicSnapshot.objects.filter(pk=clinic_id).delete()
@@ -1,3 +1,1503 @@
-from django.test import TestCase
+import copy
+import io
+import json
+import logging
+import logging.handlers
+import os
+import re
+import tempfile
+import unittest
+import uuid
+from datetime import date, datetime, timedelta, timezone as dt_timezone
+from decimal import Decimal
+from unittest import mock
 
-# Create your tests here.
+from django.conf import settings
+from django.core.management import call_command
+from django.db import OperationalError, connection, transaction
+from asgiref.sync import sync_to_async
+from django.test import TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+from rest_framework.exceptions import ParseError
+from rest_framework.parsers import JSONParser
+from rest_framework.renderers import JSONRenderer
+
+from .benchmarks import SCENARIOS, build_clinic_payload
+from . import concurrency, fastjson, importer, jobs, logqueue, metrics
+from .cache import clinic_cache
+from .changes import recording
+from .export import iter_ndjson as export_ndjson
+from .importer import import_clinics, iter_payloads
+from .models import (
+    ArchivedRow, ChangeEvent, Clinic, ClinicSnapshot, Department, EquipmentDetails, Equipments, Job, Parameters,
+)
+from .readers import tree_reader
+from .serializers import (
+    ClinicSerializer,
+    ClinicReadSerializer,
+    ClinicDepartmentsReadSerializer,
+    ClinicSummaryReadSerializer,
+    EquipmentSerializer,
+)
+from .tree import DEPARTMENTS, sync_children
+from .validation import compiled_validator
+
+
+def create_clinic(departments=2, equipments=2, details=2, parameters=2, seed=0):
+    serializer = ClinicSerializer(
+        data=build_clinic_payload(departments, equipments, details, parameters, seed)
+    )
+    serializer.is_valid(raise_exception=True)
+    return serializer.save()
+
+
+TREE_TABLES = [model._meta.db_table for model in (Clinic, Department, Equipments, EquipmentDetails, Parameters)]
+
+
+def tree_writes(queries, verb):
+    """Number of ``verb`` ('INSERT' or 'UPDATE') statements run against each tree table."""
+    counts = dict.fromkeys(TREE_TABLES, 0)
+    for query in queries:
+        match = re.match(r'(?:INSERT INTO|UPDATE) "(\w+)"', query['sql'])
+        if match and query['sql'].startswith(verb) and match.group(1) in counts:
+            counts[match.group(1)] += 1
+    return counts
+
+
+class CreateTreeTests(TestCase):
+
+    def test_one_insert_per_level(self):
+        for size in ((1, 1, 1, 1), (4, 5, 3, 3)):
+            with self.subTest(size), CaptureQueriesContext(connection) as ctx:
+                clinic = create_clinic(*size)
+            self.assertEqual(tree_writes(ctx.captured_queries, 'INSERT'), dict.fromkeys(TREE_TABLES, 1))
+            self.assertEqual(tree_writes(ctx.captured_queries, 'UPDATE'), dict.fromkeys(TREE_TABLES, 0))
+
+        # the last level got the primary keys of the one above for its FKs
+        departments, equipments, _, parameters = size
+        self.assertEqual(Department.objects.filter(clinic=clinic).count(), departments)
+        self.assertEqual(
+            Parameters.objects.filter(equipment__dep__clinic=clinic).count(), departments * equipments * parameters
+        )
+        self.assertEqual(
+            EquipmentDetails.objects.filter(equipment__dep__clinic=clinic).values('equipment').distinct().count(),
+            departments * equipments,
+        )
+
+
+class SyncChildrenTests(TestCase):
+
+    def setUp(self):
+        clinic_cache().clear()
+
+    def tree(self, clinic):
+        return self.client.get(reverse('clinic-get', args=[clinic.id])).json()
+
+    def sync(self, clinic, departments):
+        with CaptureQueriesContext(connection) as ctx, transaction.atomic(), recording():
+            sync_children(DEPARTMENTS, [(clinic, departments)])
+        # without the savepoint pair of the test's atomic block
+        return [q for q in ctx.captured_queries if not q['sql'].startswith(('SAVEPOINT', 'RELEASE'))]
+
+    def test_unchanged_payload_only_reads_each_level(self):
+        for size in ((1, 1, 1, 1), (3, 4, 2, 2)):
+            with self.subTest(size):
+                clinic = create_clinic(*size)
+                queries = self.sync(clinic, self.tree(clinic)['department'])
+                # one SELECT per level, whatever the tree size
+                self.assertEqual(len(queries), 4)
+                self.assertTrue(all(q['sql'].startswith('SELECT') for q in queries))
+
+    def test_changed_added_and_dropped_rows(self):
+        clinic = create_clinic(3, 1, 1, 1)
+        departments = self.tree(clinic)['department']
+        changed, untouched, dropped = departments
+        changed['name'] = 'Renamed'
+        added = {'name': 'Added', 'is_active': True, 'equipments': [{'equipment_name': 'New'}]}
+
+        queries = self.sync(clinic, [changed, untouched, added])
+        self.assertEqual(tree_writes(queries, 'INSERT'), {
+            **dict.fromkeys(TREE_TABLES, 0), Department._meta.db_table: 1, Equipments._meta.db_table: 1,
+        })
+        # one bulk UPDATE for the changed row, one soft-delete UPDATE per level of the dropped subtree
+        self.assertEqual(tree_writes(queries, 'UPDATE'), {
+            **dict.fromkeys(TREE_TABLES, 1), Clinic._meta.db_table: 0, Department._meta.db_table: 2,
+        })
+
+        rows = {d.id: d for d in Department.all_objects.filter(clinic=clinic)}
+        self.assertEqual((rows[changed['id']].name, rows[changed['id']].version), ('Renamed', 2))
+        self.assertEqual(rows[untouched['id']].version, 1)
+        self.assertIsNotNone(rows[dropped['id']].deleted_at)
+        self.assertEqual(Equipments.objects.get(dep__name='Added').equipment_name, 'New')
+        self.assertEqual(
+            list(ChangeEvent.objects.filter(model='department').exclude(op='create').values_list('op', 'row_id')),
+            [('update', changed['id']), ('delete', dropped['id'])],
+        )
+
+    def test_repeated_id_last_occurrence_wins(self):
+        clinic = create_clinic(1, 1, 1, 1)
+        department = self.tree(clinic)['department'][0]
+        self.sync(clinic, [{**department, 'name': 'first'}, {**department, 'name': 'second'}])
+
+        row = Department.objects.get(clinic=clinic)
+        self.assertEqual((row.id, row.name, row.version), (department['id'], 'second', 2))
+
+    def test_queries_per_level_do_not_grow_with_changes(self):
+        counts = []
+        for size in ((1, 1, 1, 1), (3, 4, 2, 2)):
+            clinic = create_clinic(*size, seed=len(counts))
+            departments = self.tree(clinic)['department']
+            for department in departments:
+                department['name'] += ' (renamed)'
+                for equipment in department['equipments']:
+                    equipment['equipment_name'] += ' (renamed)'
+                    for parameter in equipment['parameters']:
+                        parameter['is_active'] = not parameter['is_active']
+            counts.append(len(self.sync(clinic, departments)))
+        self.assertEqual(counts[0], counts[1])
+
+
+class GetClinicQueryCountTests(TestCase):
+
+    def setUp(self):
+        clinic_cache().clear()
+
+    def test_query_count_does_not_grow_with_tree_size(self):
+        small = create_clinic(1, 1, 1, 1)
+        large = create_clinic(6, 8, 5, 5, seed=1)
+
+        for clinic in (small, large):
+            # ETag aggregate + clinic + one query per nested level
+            with self.assertNumQueries(6):
+                response = self.client.get(reverse('clinic-get', args=[clinic.id]))
+            self.assertEqual(response.status_code, 200)
+
+        self.assertEqual(len(response.data['department']), 6)
+        equipment = response.data['department'][0]['equipments'][0]
+        self.assertEqual(len(equipment['equipment_details']), 5)
+        self.assertEqual(len(equipment['parameters']), 5)
+
+    def test_missing_clinic_is_404(self):
+        response = self.client.get(reverse('clinic-get', args=[999]))
+        self.assertEqual(response.status_code, 404)
+
+
+class ClinicCacheTests(TestCase):
+
+    def setUp(self):
+        clinic_cache().clear()
+
+    def test_put_invalidates_cached_tree(self):
+        clinic = create_clinic(1, 1, 1, 1)
+        url = reverse('clinic-get', args=[clinic.id])
+
+        self.assertEqual(self.client.get(url)['X-Cache'], 'MISS')
+        # only the ETag aggregate
+        with self.assertNumQueries(1):
+            response = self.client.get(url)
+        self.assertEqual(response['X-Cache'], 'HIT')
+
+        payload = response.json()
+        payload['name'] = 'Renamed'
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.put(
+                reverse('clinic-update', args=[clinic.id]), payload, content_type='application/json'
+            )
+        self.assertEqual(response.status_code, 200)
+
+        response = self.client.get(url)
+        self.assertEqual(response['X-Cache'], 'MISS')
+        self.assertEqual(response.json()['name'], 'Renamed')
+
+    def test_write_from_another_process_is_never_served_stale(self):
+        clinic = create_clinic(1, 1, 1, 1)
+        url = reverse('clinic-get', args=[clinic.id])
+        self.client.get(url)
+
+        # another worker's write: this process gets no clinic_changed signal
+        Parameters.objects.filter(equipment__dep__clinic=clinic).update(
+            content={'unit': 'g/L'}, updated_at=timezone.now() + timedelta(seconds=1)
+        )
+        response = self.client.get(url)
+        self.assertEqual(response['X-Cache'], 'MISS')
+        self.assertEqual(response.json()['department'][0]['equipments'][0]['parameters'][0]['content'], {'unit': 'g/L'})
+
+
+class ConditionalRequestTests(TestCase):
+
+    def setUp(self):
+        clinic_cache().clear()
+        self.clinic = create_clinic(1, 1, 1, 1)
+        self.url = reverse('clinic-get', args=[self.clinic.id])
+
+    def test_if_none_match_returns_304(self):
+        etag = self.client.get(self.url)['ETag']
+
+        with self.assertNumQueries(1):
+            response = self.client.get(self.url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response.content, b'')
+
+    def test_etag_changes_when_a_nested_row_changes(self):
+        response = self.client.get(self.url)
+        etag, payload = response['ETag'], response.json()
+
+        payload['department'][0]['equipments'][0]['parameters'][0]['content'] = {'unit': 'g/L'}
+        self.client.put(
+            reverse('clinic-update', args=[self.clinic.id]), payload, content_type='application/json'
+        )
+        response = self.client.get(self.url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response['ETag'], etag)
+
+    def test_put_with_stale_if_match_is_412(self):
+        response = self.client.get(self.url)
+        etag, payload = response['ETag'], response.json()
+        update_url = reverse('clinic-update', args=[self.clinic.id])
+
+        payload['department'].pop()
+        response = self.client.put(update_url, payload, content_type='application/json', HTTP_IF_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+
+        response = self.client.put(update_url, payload, content_type='application/json', HTTP_IF_MATCH=etag)
+        self.assertEqual(response.status_code, 412)
+
+
+class CompiledValidationParityTests(TestCase):
+    """The compiled validator and the DRF path must agree on every payload."""
+
+    def validate(self, serializer_class, payload, compiled):
+        with override_settings(COMPILED_VALIDATION=compiled):
+            serializer = serializer_class(data=copy.deepcopy(payload))
+            valid = serializer.is_valid()
+            return valid, serializer.validated_data if valid else serializer.errors
+
+    def assertParity(self, payload, serializer_class=ClinicSerializer):
+        fast = self.validate(serializer_class, payload, compiled=True)
+        slow = self.validate(serializer_class, payload, compiled=False)
+        self.assertEqual(fast, slow)
+        # same keys in the same order, same error codes
+        self.assertEqual(json.dumps(fast[1]), json.dumps(slow[1]))
+        return fast
+
+    def mutations(self):
+        base = build_clinic_payload(2, 2, 2, 2)
+
+        def variant(edit):
+            payload = copy.deepcopy(base)
+            edit(payload)
+            return payload
+
+        department = lambda p: p['department'][0]
+        equipment = lambda p: p['department'][0]['equipments'][0]
+        detail = lambda p: equipment(p)['equipment_details'][0]
+        parameter = lambda p: equipment(p)['parameters'][0]
+
+        return {
+            'valid': base,
+            'unknown keys': variant(lambda p: department(p).update(color='red', created_at='x')),
+            'ids': variant(lambda p: (department(p).update(id=5), detail(p).update(id=7))),
+            'string id': variant(lambda p: detail(p).update(id='7')),
+            'bool id': variant(lambda p: detail(p).update(id=True)),
+            'float id': variant(lambda p: detail(p).update(id=7.0)),
+            'padded name': variant(lambda p: p.update(name='  Clinic  ')),
+            'numeric name': variant(lambda p: equipment(p).update(equipment_name=42)),
+            'blank name': variant(lambda p: department(p).update(name='   ')),
+            'missing name': variant(lambda p: department(p).pop('name')),
+            'null name': variant(lambda p: detail(p).update(make=None)),
+            'long name': variant(lambda p: detail(p).update(model='x' * 101)),
+            'null character': variant(lambda p: parameter(p).update(parameter_name='a\x00b')),
+            'surrogate': variant(lambda p: parameter(p).update(parameter_name='a\ud800b')),
+            'unicode name': variant(lambda p: parameter(p).update(parameter_name='Glukoza µmol/L')),
+            'string bool': variant(lambda p: detail(p).update(is_active='true')),
+            'bad bool': variant(lambda p: detail(p).update(is_active='maybe')),
+            'null content': variant(lambda p: parameter(p).update(content=None)),
+            'missing content': variant(lambda p: parameter(p).pop('content')),
+            'scalar content': variant(lambda p: parameter(p).update(content=3.5)),
+            'unserializable content': variant(lambda p: parameter(p).update(content={'a': {1, 2}})),
+            'departments not a list': variant(lambda p: p.update(department={'name': 'x'})),
+            'null departments': variant(lambda p: p.update(department=None)),
+            'empty departments': variant(lambda p: p.update(department=[])),
+            'item not a dict': variant(lambda p: equipment(p)['parameters'].append('x')),
+            'null item': variant(lambda p: equipment(p)['equipment_details'].append(None)),
+            'several errors': variant(lambda p: (
+                p.update(name=''), detail(p).pop('make'), parameter(p).update(content=None),
+            )),
+        }
+
+    def test_clinic_payloads(self):
+        for name, payload in self.mutations().items():
+            with self.subTest(name):
+                self.assertParity(payload)
+
+    def test_equipment_payloads(self):
+        for name, payload in self.mutations().items():
+            if not isinstance(payload['department'], list) or not payload['department']:
+                continue
+            with self.subTest(name):
+                self.assertParity(payload['department'][0]['equipments'][0], EquipmentSerializer)
+
+    def test_not_a_dict(self):
+        for payload in (None, [], 'clinic', 3):
+            with self.subTest(payload):
+                self.assertParity(payload)
+
+    def test_valid_payload_takes_the_compiled_path(self):
+        payload = build_clinic_payload(3, 3, 3, 3)
+        check = compiled_validator(ClinicSerializer)
+        self.assertIsNotNone(check)
+        valid, validated = self.validate(ClinicSerializer, payload, compiled=False)
+        self.assertTrue(valid)
+        self.assertEqual(check(copy.deepcopy(payload)), validated)
+
+
+class CompiledReadParityTests(TestCase):
+
+    def setUp(self):
+        clinic_cache().clear()
+
+    def test_read_serializers_compile(self):
+        for serializer_class in (ClinicReadSerializer, ClinicDepartmentsReadSerializer,
+                                 ClinicSummaryReadSerializer):
+            self.assertIsNotNone(tree_reader(serializer_class), serializer_class.__name__)
+
+    def test_get_clinic_matches_read_serializer(self):
+        clinic = create_clinic(3, 2, 2, 2)
+        url = reverse('clinic-get', args=[clinic.id])
+
+        compiled = self.client.get(url).content
+        clinic_cache().clear()
+        with override_settings(COMPILED_READS=False):
+            serialized = self.client.get(url).content
+        self.assertEqual(compiled, serialized)
+
+    def test_clinic_list_matches_read_serializer(self):
+        for seed in range(3):
+            create_clinic(2, 2, 1, 1, seed=seed)
+        url = reverse('clinic-list') + '?depth=full&limit=2&detail_active=true'
+
+        compiled = self.client.get(url).content
+        with override_settings(COMPILED_READS=False):
+            serialized = self.client.get(url).content
+        self.assertEqual(compiled, serialized)
+
+
+class ClinicListTests(TestCase):
+
+    def setUp(self):
+        self.clinics = [create_clinic(2, 1, 2, 1, seed=seed) for seed in range(5)]
+        self.url = reverse('clinic-list')
+
+    def list(self, url=None, **params):
+        response = self.client.get(url or self.url, params)
+        self.assertEqual(response.status_code, 200, response.data)
+        return response.json()
+
+    def test_cursor_pages_walk_every_clinic_once_in_id_order(self):
+        first = self.list(limit=2)
+        self.assertIsNone(first['previous'])
+        self.assertEqual([c['id'] for c in first['results']], [c.id for c in self.clinics[:2]])
+
+        ids, page = [], first
+        while True:
+            ids.extend(c['id'] for c in page['results'])
+            if page['next'] is None:
+                break
+            # a clinic created meanwhile does not shift the pages
+            if len(ids) == 2:
+                self.clinics.append(create_clinic(1, 1, 1, 1, seed=9))
+            page = self.list(page['next'])
+        self.assertEqual(ids, [c.id for c in self.clinics])
+
+        second = self.list(first['next'])
+        self.assertEqual(self.list(second['previous'])['results'], first['results'])
+
+    def test_depth(self):
+        clinic = self.list(limit=1, depth='clinic')['results'][0]
+        self.assertEqual(set(clinic), {'id', 'name'})
+
+        clinic = self.list(limit=1, depth='departments')['results'][0]
+        self.assertEqual(set(clinic['department'][0]), {'id', 'name', 'is_active'})
+
+        clinic = self.list(limit=1, depth='full')['results'][0]
+        equipment = clinic['department'][0]['equipments'][0]
+        self.assertEqual((len(equipment['equipment_details']), len(equipment['parameters'])), (2, 1))
+
+    def test_active_filters_keep_matching_rows_and_clinics(self):
+        # the generated payloads deactivate rows at random
+        Department.objects.update(is_active=True)
+        EquipmentDetails.objects.update(is_active=True)
+        department = Department.objects.filter(clinic=self.clinics[1]).order_by('id').first()
+        Department.objects.filter(pk=department.pk).update(is_active=False)
+        detail = EquipmentDetails.objects.filter(equipment__dep__clinic=self.clinics[3]).order_by('id').first()
+        EquipmentDetails.objects.filter(pk=detail.pk).update(is_active=False)
+
+        page = self.list(depth='departments', department_active='false')
+        self.assertEqual([c['id'] for c in page['results']], [self.clinics[1].id])
+        self.assertEqual([d['id'] for d in page['results'][0]['department']], [department.id])
+
+        page = self.list(depth='full', detail_active='false')
+        self.assertEqual([c['id'] for c in page['results']], [self.clinics[3].id])
+        details = [
+            d['id'] for dep in page['results'][0]['department']
+            for e in dep['equipments'] for d in e['equipment_details']
+        ]
+        self.assertEqual(details, [detail.id])
+
+    def test_invalid_params(self):
+        for params, field in (({'depth': 'deep'}, 'depth'), ({'department_active': 'maybe'}, 'department_active'),
+                              ({'detail_active': '2'}, 'detail_active')):
+            with self.subTest(params):
+                response = self.client.get(self.url, params)
+                self.assertEqual(response.status_code, 400)
+                self.assertIn(field, response.data['error'])
+
+        self.assertEqual(self.client.get(self.url, {'cursor': 'not-a-cursor'}).status_code, 404)
+        # limits above max_page_size are capped rather than rejected
+        self.assertEqual(len(self.list(limit=10000)['results']), 5)
+
+
+def without_ids(tree):
+    """A read tree with the database-assigned ``id`` / ``version`` keys removed at every level."""
+    if isinstance(tree, list):
+        return [without_ids(item) for item in tree]
+    if isinstance(tree, dict):
+        return {k: without_ids(v) for k, v in tree.items() if k not in ('id', 'version')}
+    return tree
+
+
+class ClinicExportTests(TestCase):
+
+    def setUp(self):
+        for seed in range(5):
+            create_clinic(2, 2, 1, 1, seed=seed)
+
+    def export(self, **params):
+        response = self.client.get(reverse('clinic-export'), params)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['Content-Type'], 'application/x-ndjson')
+        return b''.join(response.streaming_content)
+
+    def test_export_round_trips_through_the_importer(self):
+        body = self.export(chunk_size=2)
+        trees = [json.loads(line) for line in body.splitlines()]
+        self.assertEqual([t['id'] for t in trees], sorted(Clinic.objects.values_list('id', flat=True)))
+
+        Clinic.objects.all().delete()
+        report = import_clinics(iter_payloads(io.BytesIO(body)), batch_size=2)
+        self.assertEqual(report.as_dict(), {'received': 5, 'created': 5, 'failed': 0, 'errors': []})
+        self.assertEqual([without_ids(json.loads(line)) for line in self.export().splitlines()], without_ids(trees))
+
+    def test_export_reads_one_chunk_at_a_time(self):
+        parameters = f'FROM "{Parameters._meta.db_table}"'
+        with CaptureQueriesContext(connection) as ctx:
+            lines = export_ndjson(chunk_size=2)
+            next(lines)
+            # only the first chunk's subtrees have been loaded so far
+            self.assertEqual(sum(parameters in q['sql'] for q in ctx.captured_queries), 1)
+            self.assertEqual(len(list(lines)), 4)
+        # one query per level per chunk of 2 clinics: 3 chunks for 5 clinics
+        self.assertEqual(sum(parameters in q['sql'] for q in ctx.captured_queries), 3)
+
+    def test_invalid_chunk_size_is_400(self):
+        response = self.client.get(reverse('clinic-export'), {'chunk_size': 0})
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('chunk_size', response.data['error'])
+
+    def test_command_writes_a_file(self):
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'clinics.ndjson')
+            err = io.StringIO()
+            call_command('export_clinics', output=path, chunk_size=2, stderr=err)
+            with open(path, 'rb') as f:
+                self.assertEqual(f.read(), self.export())
+        self.assertIn('Exported 5 clinics', err.getvalue())
+
+
+class ClinicImportTests(TestCase):
+
+    def setUp(self):
+        self.payloads = [build_clinic_payload(1, 1, 1, 1, seed=seed) for seed in range(3)]
+
+    def records(self, body):
+        return list(iter_payloads(io.BytesIO(body)))
+
+    def test_ndjson_and_array_streams(self):
+        ndjson = '\n\n'.join(json.dumps(p) for p in self.payloads).encode()
+        array = b' \n' + json.dumps(self.payloads, indent=2).encode()
+        for body in (ndjson, array):
+            with self.subTest(body[:2]):
+                self.assertEqual(self.records(body), [(p, None) for p in self.payloads])
+        self.assertEqual(self.records(b'  \n'), [])
+        self.assertEqual(self.records(b'[]'), [])
+
+    def test_multibyte_character_across_read_boundary(self):
+        prefix = b'{"name": "'
+        body = prefix + 'Zürich Ärztehaus'.encode() + b'"}\n'
+        # the two bytes of the "ü" land in different reads
+        with mock.patch.object(importer, '_READ_SIZE', len(prefix) + 2):
+            self.assertEqual(self.records(body), [({'name': 'Zürich Ärztehaus'}, None)])
+
+    def test_malformed_array_element_is_reported_and_skipped(self):
+        body = b'[{"name": "a"}, {"name": bad}, {"name": "c, [d]"}, {"name": "e"'
+        with mock.patch.object(importer, '_READ_SIZE', 5):
+            records = self.records(body)
+        self.assertEqual([payload for payload, _ in records], [{'name': 'a'}, None, {'name': 'c, [d]'}, None])
+        self.assertTrue(records[1][1].startswith('JSON parse error'))
+        self.assertEqual(records[3][1], 'Unexpected end of JSON array.')
+
+    def test_report_and_batches(self):
+        payloads = [*self.payloads, {'name': ''}, {'name': 'boom'}, build_clinic_payload(1, 1, 1, 1, seed=5)]
+        records = [(payloads[0], None), (None, 'JSON parse error - x'), *[(p, None) for p in payloads[1:]]]
+        write_batch = importer._write_batch
+
+        def failing(batch):
+            if any(data['name'] == 'boom' for data in batch):
+                raise OperationalError('disk full')
+            return write_batch(batch)
+
+        with mock.patch.object(importer, '_write_batch', side_effect=failing):
+            report = import_clinics(records, batch_size=2).as_dict()
+
+        # batches: [0, 2] written, [3, 5] failed, [6] written
+        self.assertEqual((report['received'], report['created'], report['failed']), (7, 3, 4))
+        self.assertEqual([e['index'] for e in report['errors']], [1, 4, 3, 5])
+        self.assertIn('name', report['errors'][1]['errors'])
+        # a failed batch is reported record by record, and only it is rolled back
+        for error in report['errors'][2:]:
+            self.assertEqual(error['errors'], {'non_field_errors': ['Batch write failed: disk full']})
+        self.assertEqual(
+            sorted(Clinic.objects.values_list('name', flat=True)), ['Clinic 0', 'Clinic 1', 'Clinic 5']
+        )
+
+    def test_bulk_endpoint(self):
+        body = '\n'.join(json.dumps(p) for p in self.payloads) + '\n{"name": "Zürich"}\nnot json\n'
+        url = reverse('clinic-bulk-import')
+        response = self.client.post(f'{url}?batch_size=2', body.encode(), content_type='application/x-ndjson')
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual((response.data['received'], response.data['created'], response.data['failed']), (5, 4, 1))
+        self.assertEqual(response.data['errors'][0]['index'], 4)
+        self.assertEqual(Clinic.objects.get(name='Zürich').department_set.count(), 0)
+        self.assertEqual(Parameters.objects.count(), 3)
+
+        response = self.client.post(f'{url}?batch_size=0', body.encode(), content_type='application/x-ndjson')
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('batch_size', response.data['error'])
+
+
+class ParameterSearchTests(TestCase):
+
+    def setUp(self):
+        clinic = create_clinic(1, 1, 0, 0)
+        equipment = clinic.department_set.get().equipments_set.get()
+        contents = {
+            'glucose': {'unit': 'mg/dL', 'tolerance': 2.5, 'limits': {'low': 70}},
+            'sodium': {'unit': 'mmol/L', 'tolerance': 1},
+            'urea': {'unit': 'mg/dL', 'tolerance': 'n/a'},
+            'flag': {'tolerance': True, 'note': None},
+        }
+        for name, content in contents.items():
+            Parameters.objects.create(equipment=equipment, parameter_name=name, content=content)
+
+    def search(self, **params):
+        response = self.client.get(reverse('parameter-search'), params)
+        self.assertEqual(response.status_code, 200, response.data)
+        return sorted(item['parameter_name'] for item in response.data['results'])
+
+    def test_contains(self):
+        self.assertEqual(self.search(contains='{"unit": "mg/dL"}'), ['glucose', 'urea'])
+        self.assertEqual(self.search(contains='{"limits": {"low": 70}}'), ['glucose'])
+        self.assertEqual(self.search(contains='{"unit": "mg/dL", "tolerance": 1}'), [])
+
+    def test_has_key(self):
+        self.assertEqual(self.search(has_key='limits'), ['glucose'])
+        # a key holding JSON null still exists
+        self.assertEqual(self.search(has_key='note'), ['flag'])
+
+    def test_range_matches_numbers_only(self):
+        self.assertEqual(self.search(range='tolerance,1,'), ['glucose', 'sodium'])
+        self.assertEqual(self.search(range='tolerance,,2'), ['sodium'])
+        self.assertEqual(self.search(range='tolerance,1,2', contains='{"unit": "mmol/L"}'), ['sodium'])
+
+    def test_invalid_queries(self):
+        for params in ({}, {'contains': '[1]'}, {'contains': '{'}, {'range': 'tolerance'},
+                       {'range': 'tolerance,,'}, {'range': 'tolerance,low,'}, {'has_key': ''}):
+            response = self.client.get(reverse('parameter-search'), params)
+            self.assertEqual(response.status_code, 400, params)
+
+    @unittest.skipUnless(connection.vendor == 'postgresql', 'GIN and jsonb expression indexes are PostgreSQL only')
+    def test_search_uses_content_indexes(self):
+        from .search import contains, has_key, key_range
+
+        with connection.cursor() as cursor:
+            cursor.execute('SET LOCAL enable_seqscan = off')
+        queryset = Parameters.objects.all()
+        for index, filtered in [
+            ('restapi_param_content_gin', contains(queryset, 'content', {'unit': 'mg/dL'})),
+            ('restapi_param_content_gin', has_key(queryset, 'content', 'limits')),
+            ('restapi_param_content_tolerance', key_range(queryset, 'content', 'tolerance', 1, 2)),
+        ]:
+            self.assertIn(index, filtered.explain())
+
+
+class HotQueryPlanTests(TestCase):
+
+    def test_hot_queries_use_indexes(self):
+        out = io.StringIO()
+        # raises CommandError on any full table scan
+        call_command('explain_hot_queries', clinics=20, departments=2, equipments=2,
+                     details=2, parameters=2, stdout=out)
+        self.assertNotIn('FULL SCAN', out.getvalue())
+
+    def test_sqlite_index_scans_are_not_full_scans(self):
+        from .management.commands.explain_hot_queries import FULL_SCAN
+
+        pattern = FULL_SCAN['sqlite']
+        self.assertEqual(pattern.findall('SCAN restapi_department'), ['restapi_department'])
+        self.assertEqual(pattern.findall('SCAN "restapi_parameters"'), ['restapi_parameters'])
+        for plan in ('SCAN restapi_department USING COVERING INDEX dept_clinic_id_idx',
+                     'SCAN "restapi_equipments" USING INDEX equip_dep_id_idx',
+                     'SEARCH restapi_department USING INDEX dept_clinic_id_idx (clinic_id=?)'):
+            self.assertEqual(pattern.findall(plan), [], plan)
+
+
+class AsyncViewParityTests(TestCase):
+
+    def setUp(self):
+        clinic_cache().clear()
+        self.clinic = create_clinic(2, 2, 2, 2)
+        self.department = self.clinic.department_set.order_by('id').first()
+        self.equipment = self.department.equipments_set.order_by('id').first()
+
+    def assertSameResponse(self, sync_response, async_response, headers=()):
+        self.assertEqual(async_response.status_code, sync_response.status_code)
+        body = json.loads(async_response.content)
+        expected = json.loads(sync_response.content)
+        # request ids are per request, and each of the two writes bumps the version
+        for key in ('request_id', 'version'):
+            body.pop(key, None), expected.pop(key, None)
+        self.assertEqual(body, expected)
+        for header in headers:
+            self.assertEqual(async_response.get(header), sync_response.get(header), header)
+
+    async def test_get_clinic(self):
+        for clinic_id in (self.clinic.id, 999):
+            # async first: a MISS goes through the async reader
+            async_response = await self.async_client.get(reverse('async-clinic-get', args=[clinic_id]))
+            await sync_to_async(clinic_cache().clear)()
+            sync_response = await sync_to_async(self.client.get)(reverse('clinic-get', args=[clinic_id]))
+            self.assertSameResponse(sync_response, async_response, ['ETag', 'Last-Modified', 'X-Cache'])
+
+        url = reverse('async-clinic-get', args=[self.clinic.id])
+        await self.async_client.get(url)
+        response = await self.async_client.get(url)
+        self.assertEqual(response['X-Cache'], 'HIT')
+        response = await self.async_client.get(url, headers={'If-None-Match': response['ETag']})
+        self.assertEqual(response.status_code, 304)
+
+    async def test_equipment_create_and_update(self):
+        payload = build_clinic_payload(1, 1, 2, 2, seed=3)['department'][0]['equipments'][0]
+
+        sync_response = await sync_to_async(self.client.post)(
+            reverse('department-equipment-create', args=[self.department.id]), payload,
+            content_type='application/json'
+        )
+        async_response = await self.async_client.post(
+            reverse('async-department-equipment-create', args=[self.department.id]), payload,
+            content_type='application/json'
+        )
+        self.assertEqual(async_response.status_code, 201)
+        created = json.loads(async_response.content)
+        expected = json.loads(sync_response.content)
+        self.assertNotEqual(created.pop('id'), expected.pop('id'))
+        created.pop('created_at'), expected.pop('created_at')
+        self.assertEqual(created, expected)
+
+        payload['equipment_name'] = 'Renamed'
+        payload['parameters'] = payload['parameters'][:1]
+        for args in ([self.department.id, self.equipment.id], [self.department.id, 999], [999, self.equipment.id]):
+            sync_response = await sync_to_async(self.client.put)(
+                reverse('department-equipment-update', args=args), payload, content_type='application/json'
+            )
+            async_response = await self.async_client.put(
+                reverse('async-department-equipment-update', args=args), payload, content_type='application/json'
+            )
+            self.assertSameResponse(sync_response, async_response)
+
+        invalid = {**payload, 'equipment_name': ''}
+        sync_response = await sync_to_async(self.client.post)(
+            reverse('department-equipment-create', args=[self.department.id]), invalid,
+            content_type='application/json'
+        )
+        async_response = await self.async_client.post(
+            reverse('async-department-equipment-create', args=[self.department.id]), invalid,
+            content_type='application/json'
+        )
+        self.assertEqual(async_response.status_code, 400)
+        self.assertSameResponse(sync_response, async_response)
+
+        # malformed JSON is a client error, as DRF's parser reports it
+        response = await self.async_client.post(
+            reverse('async-department-equipment-create', args=[self.department.id]), '{',
+            content_type='application/json'
+        )
+        self.assertEqual(response.status_code, 400)
+        self.assertTrue(json.loads(response.content)['error'].startswith('JSON parse error'))
+
+
+class DatabasePoolStatsTests(TestCase):
+
+    def test_reports_connection_settings(self):
+        response = self.client.get(reverse('db-pool-stats'))
+        self.assertEqual(response.status_code, 200)
+        default = response.data['databases'][0]
+        self.assertEqual(default['alias'], 'default')
+        self.assertEqual(default['vendor'], connection.vendor)
+        self.assertEqual(default['pooled'], getattr(connection, 'pool', None) is not None)
+
+
+class RequestProfilingTests(TestCase):
+
+    def setUp(self):
+        clinic_cache().clear()
+
+    def test_server_timing_and_log_record(self):
+        clinic = create_clinic(2, 2, 2, 2)
+        with self.assertLogs('restapi.profiling', 'INFO') as logs:
+            response = self.client.get(reverse('clinic-get', args=[clinic.id]))
+
+        self.assertEqual(response.status_code, 200)
+        timing = response['Server-Timing']
+        self.assertIn('total;dur=', timing)
+        self.assertIn('db;dur=', timing)
+        # ETag aggregate + clinic + one query per nested level
+        self.assertIn('desc="6 queries"', timing)
+        self.assertIn('render;dur=', timing)
+
+        record = logs.records[-1].profile
+        self.assertEqual(record['request_id'], response['X-Request-ID'])
+        self.assertEqual(record['db_queries'], 6)
+        self.assertEqual(record['response_bytes'], len(response.content))
+        self.assertEqual(record['status'], 200)
+
+    def test_serializer_time_on_writes(self):
+        payload = build_clinic_payload(1, 1, 1, 1)
+        response = self.client.post(reverse('clinic-create'), payload, content_type='application/json')
+        self.assertEqual(response.status_code, 201)
+        self.assertIn('serializer;dur=', response['Server-Timing'])
+
+    @override_settings(REQUEST_PROFILING=False)
+    def test_disabled(self):
+        response = self.client.get(reverse('clinic-get', args=[999]))
+        self.assertNotIn('Server-Timing', response)
+        self.assertIn('X-Request-ID', response)
+
+
+class MetricsTests(TestCase):
+
+    def setUp(self):
+        clinic_cache().clear()
+        metrics.store.reset()
+        self.addCleanup(metrics.store.reset)
+
+    def sample(self, text, line_prefix):
+        for line in text.splitlines():
+            if line.startswith(line_prefix + ' '):
+                return float(line.rsplit(' ', 1)[1])
+        return None
+
+    def test_request_histograms_and_cache_ratio(self):
+        clinic = create_clinic(1, 1, 1, 1)
+        url = reverse('clinic-get', args=[clinic.id])
+        self.client.get(url)
+        self.client.get(url)
+        self.client.post(reverse('clinic-create'), build_clinic_payload(2, 2, 1, 1), content_type='application/json')
+
+        response = self.client.get('/metrics')
+        self.assertEqual(response.status_code, 200)
+        text = response.content.decode()
+        labels = 'method="GET",route="clinic-get"'
+        self.assertEqual(self.sample(text, f'api_request_duration_seconds_count{{{labels}}}'), 2)
+        self.assertEqual(self.sample(text, f'api_request_duration_seconds_bucket{{{labels},le="+Inf"}}'), 2)
+        # ETag aggregate + clinic + 4 levels on the miss, the aggregate alone on the hit
+        self.assertEqual(self.sample(text, f'api_request_db_queries_sum{{{labels}}}'), 7)
+        # 1 clinic + 2 departments + 4 equipments + 4 details + 4 parameters
+        self.assertEqual(
+            self.sample(text, 'api_request_payload_nodes_sum{method="POST",route="clinic-create"}'), 15
+        )
+        self.assertEqual(self.sample(text, 'clinic_cache_hit_ratio'), 0.5)
+
+    @unittest.skipUnless(hasattr(os, 'fork'), 'needs fork()')
+    def test_worker_processes_are_summed(self):
+        with tempfile.TemporaryDirectory() as directory, override_settings(METRICS_MULTIPROC_DIR=directory):
+            metrics.observe_cache(hit=True)
+            pid = os.fork()
+            if pid == 0:
+                # a "worker" writing to its own file
+                metrics.observe_cache(hit=False)
+                metrics.observe_cache(hit=False)
+                os._exit(0)
+            os.waitpid(pid, 0)
+
+            self.assertEqual(len(os.listdir(directory)), 2)
+            text = metrics.render()
+            self.assertEqual(self.sample(text, 'clinic_cache_requests_total{result="hit"}'), 1)
+            self.assertEqual(self.sample(text, 'clinic_cache_requests_total{result="miss"}'), 2)
+            self.assertAlmostEqual(self.sample(text, 'clinic_cache_hit_ratio'), 1 / 3)
+
+
+class QueuedLoggingTests(TestCase):
+
+    def queued_handler(self, directory, **kwargs):
+        handler = logqueue.QueuedHandler(
+            {'class': 'logging.FileHandler', 'filename': os.path.join(directory, 'test.log')}, **kwargs
+        )
+        handler.setFormatter(logqueue.JsonFormatter())
+        self.addCleanup(handler.close)
+        return handler
+
+    def test_json_records_carry_the_request_id(self):
+        with tempfile.TemporaryDirectory() as directory:
+            handler = self.queued_handler(directory)
+            logger = logging.getLogger('restapi.exception_handler')
+            logger.addHandler(handler)
+            self.addCleanup(logger.removeHandler, handler)
+
+            response = self.client.get(reverse('clinic-get', args=[999]))
+            handler.flush()
+            with open(os.path.join(directory, 'test.log')) as f:
+                entries = [json.loads(line) for line in f]
+
+        self.assertEqual(response.status_code, 404)
+        self.assertEqual(len(entries), 1)
+        self.assertEqual(entries[0]['level'], 'ERROR')
+        self.assertEqual(entries[0]['request_id'], response['X-Request-ID'])
+        self.assertEqual(entries[0]['message'], f'GET {reverse("clinic-get", args=[999])} failed: Clinic not found')
+
+    def test_messages_are_formatted_by_the_listener(self):
+        with tempfile.TemporaryDirectory() as directory:
+            handler = self.queued_handler(directory)
+            plain = logging.LogRecord('test', logging.INFO, __file__, 1, 'clinic %s took %.1f ms', (7, 2.5), None)
+            queued = handler.prepare(plain)
+            # primitive arguments are left for the listener thread to format
+            self.assertEqual((queued.msg, queued.args), ('clinic %s took %.1f ms', (7, 2.5)))
+
+            ids = [1, 2]
+            mutable = logging.LogRecord('test', logging.INFO, __file__, 1, 'rows %s', (ids,), None)
+            queued = handler.prepare(mutable)
+            ids.append(3)
+            self.assertEqual(queued.getMessage(), 'rows [1, 2]')
+
+    def test_full_queue_drops_instead_of_blocking(self):
+        with tempfile.TemporaryDirectory() as directory:
+            handler = self.queued_handler(directory, queue_size=1)
+            handler.set_name('test_file')
+            handler._listener.stop()    # nothing drains the queue
+            record = logging.LogRecord('test', logging.ERROR, __file__, 1, 'message %s', (1,), None)
+            metrics.store.reset()
+            self.addCleanup(metrics.store.reset)
+            handler.handle(record)
+            handler.handle(record)
+            handler.handle(record)
+            self.assertEqual(handler.dropped, 2)
+            self.assertEqual(handler.queue.get_nowait().getMessage(), 'message 1')
+            self.assertIn('log_records_dropped_total{handler="test_file"} 2\n', metrics.render())
+
+    def test_files_are_left_to_external_rotation_and_tests_log_elsewhere(self):
+        handler = logging.getLogger('restapi').handlers[0]
+        self.assertIsInstance(handler.target, logging.handlers.WatchedFileHandler)
+        self.assertEqual(os.path.dirname(handler.target.baseFilename), str(settings.LOG_DIR))
+        self.assertNotEqual(settings.LOG_DIR, settings.BASE_DIR / 'restapi/log')
+
+
+class EndpointBenchmarkTests(TestCase):
+
+    def test_endpoints_scenario_writes_comparable_json(self):
+        with tempfile.TemporaryDirectory() as directory:
+            output = os.path.join(directory, 'result.json')
+            options = dict(requests=2, departments=1, equipments=2, details=1, parameters=1)
+            call_command('benchmark', 'endpoints', output=output, stdout=io.StringIO(), **options)
+            with open(output) as f:
+                result = json.load(f)
+
+            out = io.StringIO()
+            call_command('benchmark', 'endpoints', compare=output, stdout=out, **options)
+
+        self.assertEqual(result['meta']['options']['requests'], 2)
+        self.assertEqual(set(result['endpoints']), {
+            'clinic-create', 'clinic-update', 'clinic-get', 'clinic-get-cached',
+            'department-equipment-create', 'department-equipment-update',
+        })
+        for name, endpoint in result['endpoints'].items():
+            self.assertEqual(endpoint['errors'], 0, name)
+            self.assertGreater(endpoint['peak_kib'], 0, name)
+        self.assertEqual(result['endpoints']['clinic-get-cached']['queries_per_request'], 1)
+        self.assertIn('endpoints.clinic-get.p50_ms', out.getvalue())
+
+
+class PatchTests(TestCase):
+
+    def setUp(self):
+        clinic_cache().clear()
+        self.clinic = create_clinic(3, 3, 2, 2)
+        self.department = Department.objects.filter(clinic=self.clinic).order_by('id').first()
+        self.equipment = Equipments.objects.filter(dep=self.department).order_by('id').first()
+        self.parameter = Parameters.objects.filter(equipment=self.equipment).order_by('id').first()
+
+    def counts(self):
+        return (
+            Department.objects.count(), Equipments.objects.count(),
+            EquipmentDetails.objects.count(), Parameters.objects.count(),
+        )
+
+    def test_sparse_patch_writes_only_the_touched_row(self):
+        before = self.counts()
+        payload = {'department': [{'id': self.department.id, 'equipments': [{'id': self.equipment.id, 'parameters': [
+            {'id': self.parameter.id, 'content': {'unit': 'g/L', 'min': 1}},
+        ]}]}]}
+        url = reverse('clinic-update', args=[self.clinic.id])
+        # ETag aggregate, clinic, the clinic's version check, one SELECT per
+        # level on the path, one UPDATE, its change record, the new ETag, and
+        # the savepoint pair; none of it depends on the tree size
+        with self.assertNumQueries(11), CaptureQueriesContext(connection) as ctx:
+            response = self.client.patch(url, payload, content_type='application/json')
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['rows'], {'updated': 1, 'created': 0, 'deleted': 0})
+        # the clinic row is neither rewritten nor bumped
+        self.assertEqual(
+            tree_writes(ctx.captured_queries, 'UPDATE'), {**dict.fromkeys(TREE_TABLES, 0), 'restapi_parameters': 1}
+        )
+        self.clinic.refresh_from_db()
+        self.assertEqual(self.clinic.version, 1)
+        self.assertIn('ETag', response)
+        self.parameter.refresh_from_db()
+        self.assertEqual(self.parameter.content, {'unit': 'g/L', 'min': 1})
+        # omitted siblings are left alone
+        self.assertEqual(self.counts(), before)
+
+    def test_sparse_patch_creates_items_without_id(self):
+        payload = {'name': 'Renamed', 'department': [{'name': 'New', 'equipments': [
+            {'equipment_name': 'Fresh', 'parameters': [{'parameter_name': 'p', 'content': {}}]},
+        ]}]}
+        response = self.client.patch(
+            reverse('clinic-update', args=[self.clinic.id]), payload, content_type='application/json'
+        )
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['name'], 'Renamed')
+        self.assertEqual(response.data['rows'], {'updated': 1, 'created': 1, 'deleted': 0})
+        self.assertEqual(Department.objects.filter(clinic=self.clinic).count(), 4)
+        self.assertTrue(Parameters.objects.filter(equipment__equipment_name='Fresh').exists())
+
+    def test_repeated_id_is_merged_into_one_write(self):
+        payload = {'department': [
+            {'id': self.department.id, 'name': 'First'},
+            {'id': self.department.id, 'name': 'Second', 'is_active': False},
+        ]}
+        with CaptureQueriesContext(connection) as ctx:
+            response = self.client.patch(
+                reverse('clinic-update', args=[self.clinic.id]), payload, content_type='application/json'
+            )
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['rows'], {'updated': 1, 'created': 0, 'deleted': 0})
+        self.assertEqual(tree_writes(ctx.captured_queries, 'UPDATE')['restapi_department'], 1)
+        self.department.refresh_from_db()
+        self.assertEqual((self.department.name, self.department.is_active), ('Second', False))
+        self.assertEqual(self.department.version, 2)
+        self.assertEqual(ChangeEvent.objects.filter(model='department', op=ChangeEvent.UPDATE).count(), 1)
+
+    def test_json_patch(self):
+        other = Equipments.objects.filter(dep=self.department).order_by('id').last()
+        base = f'/department/{self.department.id}/equipments'
+        ops = [
+            {'op': 'replace', 'path': f'{base}/{self.equipment.id}/equipment_name', 'value': 'Patched'},
+            {'op': 'add', 'path': f'{base}/-', 'value': {'equipment_name': 'Added'}},
+            {'op': 'remove', 'path': f'{base}/{other.id}'},
+        ]
+        response = self.client.patch(
+            reverse('clinic-update', args=[self.clinic.id]), json.dumps(ops),
+            content_type='application/json-patch+json',
+        )
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['rows'], {'updated': 1, 'created': 1, 'deleted': 1})
+        names = set(Equipments.objects.filter(dep=self.department).values_list('equipment_name', flat=True))
+        self.assertIn('Patched', names)
+        self.assertIn('Added', names)
+        self.assertFalse(Equipments.objects.filter(id=other.id).exists())
+
+    def test_errors(self):
+        url = reverse('clinic-update', args=[self.clinic.id])
+        foreign = create_clinic(1, 1, 1, 1, seed=5)
+        foreign_department = Department.objects.get(clinic=foreign)
+
+        response = self.client.patch(url, {'department': [{'id': foreign_department.id, 'name': 'x'}]},
+                                     content_type='application/json')
+        self.assertEqual(response.status_code, 404)
+
+        response = self.client.patch(url, {'department': [{'id': self.department.id, 'name': ''}]},
+                                     content_type='application/json')
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.data['error']['path'], f'/department/{self.department.id}')
+        self.assertIn('name', response.data['error']['errors'])
+
+        response = self.client.patch(url, json.dumps([{'op': 'move', 'path': '/name', 'from': '/x'}]),
+                                     content_type='application/json-patch+json')
+        self.assertEqual(response.status_code, 400)
+        self.department.refresh_from_db()
+        self.assertNotEqual(self.department.name, 'x')
+
+    def test_equipment_patch(self):
+        url = reverse('department-equipment-update', args=[self.department.id, self.equipment.id])
+        ops = [{'op': 'replace', 'path': f'/parameters/{self.parameter.id}/is_active', 'value': False}]
+        response = self.client.patch(url, json.dumps(ops), content_type='application/json-patch+json')
+
+        self.assertEqual(response.status_code, 200)
+        self.parameter.refresh_from_db()
+        self.assertFalse(self.parameter.is_active)
+        self.assertEqual(Parameters.objects.filter(equipment=self.equipment).count(), 2)
+
+
+class SoftDeleteTests(TestCase):
+
+    def setUp(self):
+        clinic_cache().clear()
+        self.clinic = create_clinic(2, 3, 2, 2)
+        self.url = reverse('clinic-update', args=[self.clinic.id])
+        self.payload = self.client.get(reverse('clinic-get', args=[self.clinic.id])).json()
+        self.dropped = self.payload['department'].pop()
+
+    def test_dropped_subtree_is_soft_deleted_with_one_update_per_level(self):
+        with CaptureQueriesContext(connection) as ctx, self.captureOnCommitCallbacks(execute=True):
+            response = self.client.put(self.url, self.payload, content_type='application/json')
+        self.assertEqual(response.status_code, 200)
+
+        updates = [q['sql'] for q in ctx.captured_queries if q['sql'].startswith('UPDATE') and 'deleted_at' in q['sql']]
+        # departments, equipments, details, parameters
+        self.assertEqual(len(updates), 4)
+        self.assertFalse(any(q['sql'].startswith('DELETE') for q in ctx.captured_queries))
+
+        self.assertFalse(Department.objects.filter(id=self.dropped['id']).exists())
+        self.assertIsNotNone(Department.all_objects.get(id=self.dropped['id']).deleted_at)
+        self.assertEqual(Equipments.all_objects.filter(dep_id=self.dropped['id'], deleted_at__isnull=False).count(), 3)
+        self.assertEqual(Parameters.objects.filter(equipment__dep_id=self.dropped['id']).count(), 0)
+        self.assertEqual(Parameters.objects.count(), 6)
+
+        tree = self.client.get(reverse('clinic-get', args=[self.clinic.id])).json()
+        self.assertEqual([d['id'] for d in tree['department']], [d['id'] for d in self.payload['department']])
+
+    def test_put_naming_a_deleted_row_brings_it_back(self):
+        self.payload['version'] = self.client.put(self.url, self.payload, content_type='application/json').data['version']
+        version = Department.all_objects.get(id=self.dropped['id']).version
+
+        self.payload['department'].append({**self.dropped, 'name': 'Restored'})
+        foreign = Department.objects.get(clinic=create_clinic(1, 1, 1, 1, seed=5))
+        self.payload['department'].append({'id': foreign.id, 'name': 'Not yours'})
+        response = self.client.put(self.url, self.payload, content_type='application/json')
+        self.assertEqual(response.status_code, 200)
+
+        restored = Department.objects.get(id=self.dropped['id'])
+        self.assertEqual((restored.name, restored.version), ('Restored', version + 1))
+        self.assertEqual(
+            set(Equipments.objects.filter(dep=restored).values_list('id', flat=True)),
+            {e['id'] for e in self.dropped['equipments']},
+        )
+        self.assertEqual(Parameters.objects.filter(equipment__dep=restored).count(), 6)
+        # another clinic's id is not taken over: the item becomes a new row
+        foreign.refresh_from_db()
+        self.assertNotEqual(foreign.name, 'Not yours')
+        self.assertTrue(Department.objects.filter(clinic=self.clinic, name='Not yours').exclude(id=foreign.id).exists())
+        self.assertEqual(
+            ChangeEvent.objects.filter(model='department', row_id=restored.id).values_list('op', flat=True)
+            .order_by('id').last(),
+            ChangeEvent.CREATE,
+        )
+
+    def test_archive_moves_deleted_rows(self):
+        self.client.put(self.url, self.payload, content_type='application/json')
+
+        out = io.StringIO()
+        call_command('archive_deleted', days=1, stdout=out)
+        self.assertEqual(json.loads(out.getvalue())['restapi.Department'], 0)
+
+        call_command('archive_deleted', days=0, batch_size=5, stdout=out)
+        self.assertEqual(Department.all_objects.filter(id=self.dropped['id']).count(), 0)
+        self.assertEqual(Parameters.all_objects.filter(deleted_at__isnull=False).count(), 0)
+        # 1 department + 3 equipments + 6 details + 6 parameters
+        self.assertEqual(ArchivedRow.objects.count(), 16)
+        archived = ArchivedRow.objects.get(model='restapi.Department')
+        self.assertEqual(archived.row_id, self.dropped['id'])
+        self.assertEqual(archived.data['name'], self.dropped['name'])
+        # live rows are untouched
+        self.assertEqual(Department.objects.filter(clinic=self.clinic).count(), 1)
+
+    @override_settings(SOFT_DELETE=False)
+    def test_hard_delete_mode(self):
+        self.client.put(self.url, self.payload, content_type='application/json')
+        self.assertFalse(Department.all_objects.filter(id=self.dropped['id']).exists())
+        self.assertEqual(Parameters.all_objects.count(), 6)
+
+
+@override_settings(JOB_WORKERS=0)
+class BackgroundJobTests(TestCase):
+
+    def setUp(self):
+        clinic_cache().clear()
+        self.clinic = create_clinic(1, 1, 1, 1)
+        self.url = reverse('clinic-update', args=[self.clinic.id])
+        self.payload = self.client.get(reverse('clinic-get', args=[self.clinic.id])).json()
+
+    def put_async(self, payload):
+        return self.client.put(f'{self.url}?async=true', payload, content_type='application/json')
+
+    def test_async_put_is_accepted_and_run_by_a_worker(self):
+        self.payload['name'] = 'Renamed later'
+        response = self.put_async(self.payload)
+
+        self.assertEqual(response.status_code, 202)
+        job_url = response['Location']
+        self.assertEqual(job_url, reverse('job-detail', args=[response.data['id']]))
+        self.assertEqual(response.data['status'], 'queued')
+        self.clinic.refresh_from_db()
+        self.assertNotEqual(self.clinic.name, 'Renamed later')
+
+        self.assertEqual(jobs.run_pending(), 1)
+        job = self.client.get(job_url).json()
+        self.assertEqual(job['status'], 'succeeded')
+        self.assertEqual(job['result'], {'id': self.clinic.id, 'name': 'Renamed later'})
+        self.clinic.refresh_from_db()
+        self.assertEqual(self.clinic.name, 'Renamed later')
+
+    def test_invalid_payload_is_rejected_up_front(self):
+        self.payload['name'] = ''
+        response = self.put_async(self.payload)
+        self.assertEqual(response.status_code, 400)
+        self.assertFalse(Job.objects.exists())
+
+    def test_jobs_of_one_clinic_run_one_at_a_time_in_order(self):
+        other = create_clinic(1, 1, 1, 1, seed=3)
+        first = self.put_async({**self.payload, 'name': 'first'}).data['id']
+        second = self.put_async({**self.payload, 'name': 'second'}).data['id']
+        elsewhere = self.client.put(
+            reverse('clinic-update', args=[other.id]) + '?async=true', {'name': 'other'},
+            content_type='application/json',
+        ).data['id']
+
+        claimed = jobs.claim()
+        self.assertEqual(claimed.id, first)
+        # the second job waits for the first; another clinic's job does not
+        self.assertEqual(jobs.claim().id, elsewhere)
+        self.assertIsNone(jobs.claim())
+
+        jobs.run_job(claimed)
+        self.assertEqual(jobs.claim().id, second)
+
+    def test_failed_job_reports_errors(self):
+        job = jobs.enqueue('clinic-update', 999, {'name': 'x'})
+        jobs.run_pending()
+        response = self.client.get(reverse('job-detail', args=[job.id]))
+        self.assertEqual(response.data['status'], 'failed')
+        self.assertIn('detail', response.data['error'])
+        self.assertEqual(self.client.get(reverse('job-detail', args=[job.id + 1])).status_code, 404)
+
+    def test_job_finding_its_rows_locked_goes_back_in_the_queue(self):
+        job = jobs.enqueue('clinic-update', self.clinic.id, {'name': 'x'})
+        locked = mock.Mock(side_effect=concurrency.Locked('Clinic rows are being updated by another request'))
+        with mock.patch.dict(jobs.HANDLERS, {'clinic-update': locked}):
+            self.assertEqual(jobs.run_pending(), 0)
+        job.refresh_from_db()
+        self.assertEqual((job.status, job.started_at), (Job.QUEUED, None))
+
+        self.assertEqual(jobs.run_pending(), 1)
+        job.refresh_from_db()
+        self.assertEqual(job.status, Job.SUCCEEDED)
+
+    @override_settings(JOB_STALE_AFTER=60)
+    def test_pool_requeues_jobs_left_running(self):
+        job = jobs.enqueue('clinic-update', self.clinic.id, {'name': 'x'})
+        fresh = jobs.enqueue('clinic-update', create_clinic(1, 1, 1, 1, seed=3).id, {'name': 'y'})
+        Job.objects.filter(pk=job.pk).update(status=Job.RUNNING, started_at=timezone.now() - timedelta(minutes=5))
+        Job.objects.filter(pk=fresh.pk).update(status=Job.RUNNING, started_at=timezone.now())
+
+        pool = jobs.WorkerPool()
+        self.assertEqual(pool.requeue_stale(), 1)
+        self.assertEqual(Job.objects.get(pk=job.pk).status, Job.QUEUED)
+        self.assertEqual(Job.objects.get(pk=fresh.pk).status, Job.RUNNING)
+        # then only once every JOB_STALE_AFTER seconds
+        Job.objects.filter(pk=job.pk).update(status=Job.RUNNING, started_at=timezone.now() - timedelta(minutes=5))
+        self.assertEqual(pool.requeue_stale(), 0)
+
+
+class OptimisticConcurrencyTests(TestCase):
+
+    def setUp(self):
+        clinic_cache().clear()
+        self.clinic = create_clinic(2, 2, 1, 1)
+        self.get_url = reverse('clinic-get', args=[self.clinic.id])
+        self.put_url = reverse('clinic-update', args=[self.clinic.id])
+
+    def put(self, payload):
+        with self.captureOnCommitCallbacks(execute=True):
+            return self.client.put(self.put_url, payload, content_type='application/json')
+
+    def test_every_write_bumps_the_version(self):
+        payload = self.client.get(self.get_url).json()
+        self.assertEqual(payload['version'], 1)
+
+        payload['department'][0]['name'] = 'Renamed'
+        response = self.put(payload)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['version'], 2)
+
+        payload = self.client.get(self.get_url).json()
+        self.assertEqual(payload['version'], 2)
+        self.assertEqual(payload['department'][0]['version'], 2)
+        self.assertEqual(payload['department'][1]['version'], 1)
+
+    def test_stale_version_is_409_and_writes_nothing(self):
+        payload = self.client.get(self.get_url).json()
+        self.assertEqual(self.put({**payload, 'name': 'first'}).status_code, 200)
+
+        # a second writer that read the same version loses
+        response = self.put({**payload, 'name': 'second'})
+        self.assertEqual(response.status_code, 409)
+        self.assertIn('request_id', response.data)
+        self.clinic.refresh_from_db()
+        self.assertEqual((self.clinic.name, self.clinic.version), ('first', 2))
+
+    def test_stale_nested_version_rolls_back_the_whole_put(self):
+        payload = self.client.get(self.get_url).json()
+        department = payload['department'][1]
+        equipment = department['equipments'][0]
+        equipment_url = reverse('department-equipment-update', args=[department['id'], equipment['id']])
+        response = self.client.put(equipment_url, {**equipment, 'equipment_name': 'moved on'},
+                                   content_type='application/json')
+        self.assertEqual(response.status_code, 200)
+
+        payload['name'] = 'Renamed'
+        payload['department'][0]['name'] = 'Renamed'
+        equipment['equipment_name'] = 'overwrite'
+        response = self.put({key: value for key, value in payload.items() if key != 'version'})
+        self.assertEqual(response.status_code, 409)
+        self.clinic.refresh_from_db()
+        self.assertNotEqual(self.clinic.name, 'Renamed')
+        self.assertEqual(Equipments.objects.get(id=equipment['id']).equipment_name, 'moved on')
+
+    def test_lock_not_available_is_409(self):
+        class LockNotAvailable(Exception):
+            sqlstate = '55P03'
+
+        with self.assertRaises(concurrency.Conflict):
+            with concurrency._nowait(Department):
+                raise OperationalError('could not obtain lock') from LockNotAvailable()
+        with self.assertRaises(OperationalError):
+            with concurrency._nowait(Department):
+                raise OperationalError('server closed the connection')
+
+
+class ChangeFeedTests(TestCase):
+
+    def setUp(self):
+        clinic_cache().clear()
+        self.clinic = create_clinic(2, 1, 1, 1)
+        self.other = create_clinic(1, 1, 1, 1, seed=1)
+
+    def feed(self, **params):
+        response = self.client.get(reverse('change-feed'), params)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['Content-Type'], 'application/x-ndjson')
+        return [json.loads(line) for line in b''.join(response.streaming_content).splitlines()]
+
+    def test_creates_are_recorded_level_by_level(self):
+        records = self.feed(clinic=self.clinic.id)
+        self.assertEqual(
+            [(r['model'], r['op']) for r in records],
+            [('clinic', 'create')] + [('department', 'create')] * 2 + [('equipments', 'create')] * 2
+            + [('equipmentdetails', 'create')] * 2 + [('parameters', 'create')] * 2,
+        )
+        department = records[1]
+        self.assertEqual(department['parent_id'], self.clinic.id)
+        self.assertEqual(department['version'], 1)
+        self.assertEqual(set(department['data']), {'name', 'is_active'})
+
+    def test_since_returns_only_later_changes(self):
+        cursor = self.feed()[-1]['id']
+        payload = self.client.get(reverse('clinic-get', args=[self.clinic.id])).json()
+        dropped = payload['department'].pop()
+        payload['department'][0]['name'] = 'Renamed'
+        response = self.client.put(
+            reverse('clinic-update', args=[self.clinic.id]), payload, content_type='application/json'
+        )
+        self.assertEqual(response.status_code, 200)
+
+        records = self.feed(since=cursor)
+        self.assertEqual(
+            [(r['model'], r['row_id'], r['op'], r['data']) for r in records],
+            [('department', payload['department'][0]['id'], 'update', {'name': 'Renamed'}),
+             ('department', dropped['id'], 'delete', None)],
+        )
+        self.assertEqual(records[0]['version'], 2)
+        self.assertEqual(self.feed(since=records[-1]['id']), [])
+        self.assertEqual(len(self.feed(limit=3)), 3)
+
+    def test_feed_is_in_transaction_order_and_resumes_by_id(self):
+        # two writers whose events got ids out of transaction order
+        ids = list(ChangeEvent.objects.filter(clinic_id=self.clinic.id).order_by('id').values_list('id', flat=True))
+        ChangeEvent.objects.filter(id__in=ids[:3]).update(txid=20)
+        ChangeEvent.objects.filter(id__in=ids[3:]).update(txid=10)
+        ChangeEvent.objects.exclude(clinic_id=self.clinic.id).update(txid=5)
+
+        records = self.feed(clinic=self.clinic.id)
+        self.assertEqual([r['id'] for r in records], ids[3:] + ids[:3])
+        self.assertEqual([r['id'] for r in self.feed(clinic=self.clinic.id, since=ids[-1])], ids[:3])
+        self.assertEqual([r['id'] for r in self.feed(since=ids[1])], ids[2:3])
+
+    def test_unknown_cursor_is_400(self):
+        # interleaved writers: no id range lines up with (txid, id) order
+        ids = list(ChangeEvent.objects.order_by('id').values_list('id', flat=True))
+        for position, txid in zip(ids, [30, 10, 30, 20, 10, 20] * len(ids)):
+            ChangeEvent.objects.filter(id=position).update(txid=txid)
+        gap = ids[2]
+        served = [r['id'] for r in self.feed()]
+        ChangeEvent.objects.filter(id=gap).delete()
+
+        response = self.client.get(reverse('change-feed'), {'since': gap})
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('since', response.data['error'])
+        response = self.client.get(reverse('change-feed'), {'since': ids[-1] + 100})
+        self.assertEqual(response.status_code, 400)
+        # every known cursor resumes exactly after itself
+        served.remove(gap)
+        for position, cursor in enumerate(served):
+            self.assertEqual([r['id'] for r in self.feed(since=cursor)], served[position + 1:])
+
+    def test_failed_write_records_nothing(self):
+        before = ChangeEvent.objects.count()
+        payload = self.client.get(reverse('clinic-get', args=[self.clinic.id])).json()
+        payload['department'][0]['name'] = 'Renamed'
+        payload['department'][1]['version'] = 99
+        response = self.client.put(
+            reverse('clinic-update', args=[self.clinic.id]), payload, content_type='application/json'
+        )
+        self.assertEqual(response.status_code, 409)
+        self.assertEqual(ChangeEvent.objects.count(), before)
+
+    def test_invalid_cursor_is_400(self):
+        response = self.client.get(reverse('change-feed'), {'since': 'x'})
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('since', response.data['error'])
+
+
+@override_settings(CLINIC_SNAPSHOTS=True)
+class ClinicSnapshotTests(TestCase):
+
+    def setUp(self):
+        clinic_cache().clear()
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.post(
+                reverse('clinic-create'), build_clinic_payload(2, 2, 2, 2), content_type='application/json'
+            )
+        self.clinic_id = response.data['id']
+        self.url = reverse('clinic-get', args=[self.clinic_id])
+
+    def test_get_is_one_primary_key_lookup(self):
+        with override_settings(CLINIC_SNAPSHOTS=False):
+            expected = self.client.get(self.url)
+        clinic_cache().clear()
+
+        with self.assertNumQueries(1):
+            response = self.client.get(self.url)
+        self.assertEqual(response.json(), expected.json())
+        self.assertEqual(response['ETag'], expected['ETag'])
+        with self.assertNumQueries(1):
+            response = self.client.get(self.url, HTTP_IF_NONE_MATCH=response['ETag'])
+        self.assertEqual(response.status_code, 304)
+
+    def test_write_rebuilds_the_snapshot(self):
+        payload = self.client.get(self.url).json()
+        payload['department'][0]['name'] = 'Renamed'
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.put(
+                reverse('clinic-update', args=[self.clinic_id]), payload, content_type='application/json'
+            )
+        self.assertEqual(response.status_code, 200)
+
+        snapshot = ClinicSnapshot.objects.get(pk=self.clinic_id)
+        self.assertEqual(snapshot.data['department'][0]['name'], 'Renamed')
+        self.assertEqual(f'"{snapshot.etag}"', response['ETag'])
+
+    def test_missing_snapshot_falls_back_and_command_backfills(self):
+        other = create_clinic(1, 1, 1, 1, seed=2)
+        ClinicSnapshot.objects.all().delete()
+        # the snapshot lookup, then the fingerprint and one query per tree level
+        with self.assertNumQueries(7):
+            self.assertEqual(self.client.get(self.url).status_code, 200)
+
+        out = io.StringIO()
+        call_command('rebuild_snapshots', '--workers', '1', '--batch-size', '1', stdout=out)
+        self.assertIn('Rebuilt 2 snapshots', out.getvalue())
+        self.assertEqual(ClinicSnapshot.objects.get(pk=other.id).data['id'], other.id)
+
+
+class FastJSONTests(TestCase):
+    """FastJSONRenderer / FastJSONParser must be byte-for-byte DRF's JSONRenderer / JSONParser."""
+
+    values = {
+        'aware': datetime(2024, 5, 1, 12, 30, 5, 123456, tzinfo=dt_timezone.utc),
+        'naive': datetime(2024, 5, 1, 12, 30, 5),
+        'date': date(2024, 5, 1),
+        'decimal': Decimal('1.50'),
+        'uuid': uuid.UUID(int=1),
+        'text': 'Gerät µg/L \u2028 \u2029 "quoted" \\ \x01 \U0001f600',
+        'content': {'unit': 'mg/dL', 'min': 0.25, 'max': 100, 'flags': [True, False, None], 'nested': {}},
+        'empty': [],
+        'big': 2 ** 63 + 1,
+    }
+
+    def assertSameRender(self, data, media_type=None, context=None):
+        expected = JSONRenderer().render(data, media_type, context)
+        self.assertEqual(fastjson.FastJSONRenderer().render(data, media_type, context), expected)
+        return expected
+
+    def test_renders_the_same_bytes(self):
+        for name, value in self.values.items():
+            with self.subTest(name):
+                self.assertSameRender({name: value})
+        self.assertSameRender(self.values)
+        self.assertSameRender(build_clinic_payload(2, 2, 2, 2))
+        tree = self.client.get(reverse('clinic-get', args=[create_clinic().id])).data
+        self.assertSameRender(tree)
+        self.assertSameRender(tree, 'application/json; indent=4', {})
+        self.assertEqual(fastjson.FastJSONRenderer().render(None), b'')
+
+    def test_get_response_uses_the_fast_renderer(self):
+        clinic = create_clinic()
+        response = self.client.get(reverse('clinic-get', args=[clinic.id]))
+        self.assertIsInstance(response.accepted_renderer, fastjson.FastJSONRenderer)
+        self.assertEqual(response.content, JSONRenderer().render(response.data))
+
+    def test_parses_the_same_values(self):
+        body = JSONRenderer().render(self.values)
+        self.assertEqual(
+            fastjson.FastJSONParser().parse(io.BytesIO(body)), JSONParser().parse(io.BytesIO(body))
+        )
+        for invalid in (b'{"a": ', b'{"a": NaN}'):
+            with self.subTest(invalid):
+                with self.assertRaises(ParseError) as expected:
+                    JSONParser().parse(io.BytesIO(invalid))
+                with self.assertRaises(ParseError) as fast:
+                    fastjson.FastJSONParser().parse(io.BytesIO(invalid))
+                self.assertEqual(str(fast.exception.detail), str(expected.exception.detail))
+
+    def test_falls_back_without_orjson(self):
+        with mock.patch.object(fastjson, 'orjson', None):
+            self.assertSameRender(self.values)
+            body = JSONRenderer().render(self.values)
+            self.assertEqual(fastjson.FastJSONParser().parse(io.BytesIO(body)), json.loads(body))
+
+    def test_benchmark_scenario(self):
+        result = SCENARIOS['json']({**SCENARIOS['json'].defaults, 'departments': 1, 'equipments': 2, 'repeat': 1})
+        self.assertEqual(result['nodes'], 1 + 1 + 2 * (1 + 10 + 10))
+        self.assertGreater(result['rendered_bytes'], 0)
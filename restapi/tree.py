@@ -0,0 +1,304 @@
+"""
+Level-by-level writer for the clinic -> department -> equipment ->
+details/parameters tree.
+
+Every node of a payload is built in memory first and each model is then
+inserted with one bulk_create, so writing a clinic costs one query per
+level of the tree instead of one query per node. Updates work the same
+way: each level's existing rows are loaded with one query, diffed against
+the payload in memory and written back with bulk_create / bulk_update /
+a single delete.
+
+Every row written is also reported to changes.py, which appends it to
+the ChangeEvent outbox in the same transaction.
+
+Deletes are soft by default (``SOFT_DELETE``): a dropped row and its
+subtree get ``deleted_at`` set with one UPDATE per level, and
+``manage.py archive_deleted`` moves them out of the live tables later.
+"""
+from django.conf import settings
+from django.db import connections, router
+from django.utils import timezone
+
+from .changes import record_created, record_deleted, record_updated
+from .concurrency import Conflict, check_version, lock_rows, write_version
+from .models import Department, Equipments, EquipmentDetails, Parameters
+
+
+class Level:
+    """Describes how payload dicts at one depth of the tree map onto a model."""
+
+    def __init__(self, model, parent_field, fields, children=(), defaults=None):
+        self.model = model
+        self.parent_field = parent_field    # FK on the model pointing at the parent row
+        self.fields = fields                # payload keys copied onto new rows
+        self.children = children            # (payload key, Level) pairs
+        self.defaults = defaults or {}      # payload key -> callable for missing keys
+
+    @property
+    def parent_attname(self):
+        return self.model._meta.get_field(self.parent_field).attname
+
+    @property
+    def update_fields(self):
+        return [f for f in self.fields if f != 'id']
+
+    def build(self, parent, data):
+        values = {k: data[k] for k in self.fields if k in data}
+        for k, default in self.defaults.items():
+            values.setdefault(k, default())
+        return self.model(**{self.parent_field: parent}, **values)
+
+
+PARAMETERS = Level(
+    Parameters, 'equipment',
+    ['parameter_name', 'is_active', 'content'],
+    defaults={'content': dict},
+)
+EQUIPMENT_DETAILS = Level(
+    EquipmentDetails, 'equipment',
+    ['equipment_num', 'make', 'model', 'is_active'],
+)
+EQUIPMENTS = Level(
+    Equipments, 'dep',
+    ['id', 'equipment_name'],
+    children=[('equipment_details', EQUIPMENT_DETAILS), ('parameters', PARAMETERS)],
+)
+DEPARTMENTS = Level(
+    Department, 'clinic',
+    ['id', 'name', 'is_active'],
+    children=[('equipments', EQUIPMENTS)],
+)
+
+
+def bulk_insert(model, objs):
+    """
+    INSERT all objs with one bulk_create and set their primary keys.
+
+    Backends that cannot return rows from a bulk insert would leave the
+    pks unset, and the next level needs them for its FKs, so those fall
+    back to one INSERT per row.
+    """
+    if not objs:
+        return objs
+    connection = connections[router.db_for_write(model)]
+    if connection.features.can_return_rows_from_bulk_insert:
+        return model.objects.bulk_create(objs)
+    for obj in objs:
+        obj.save(force_insert=True)
+    return objs
+
+
+def create_children(level, pending):
+    """
+    Create the subtrees described by ``pending``, a list of
+    ``(parent, [payload, ...])`` pairs, and return the rows created at
+    this level.
+
+    Parents from any number of clinics/departments can be mixed; each
+    level below is still written with a single bulk_create.
+    """
+    rows = []
+    nested = {key: [] for key, _ in level.children}
+    for parent, items in pending:
+        for data in items:
+            obj = level.build(parent, data)
+            rows.append(obj)
+            for key, _ in level.children:
+                nested[key].append((obj, data.get(key) or []))
+
+    bulk_insert(level.model, rows)
+    record_created(rows, level.fields)
+
+    for key, child in level.children:
+        if nested[key]:
+            create_children(child, nested[key])
+    return rows
+
+
+def assign(obj, data, fields):
+    """Copy ``fields`` present in data onto obj and return the names that changed."""
+    changed = []
+    for name in fields:
+        if name in data and getattr(obj, name) != data[name]:
+            setattr(obj, name, data[name])
+            changed.append(name)
+    return changed
+
+
+def update_row(obj, data, fields, version=None):
+    """
+    assign() and save only the changed columns (plus updated_at).
+
+    ``version`` is the version the client sent, None if it sent none. If
+    it sent one or a column changed, the row is written through
+    write_version(): its version is bumped in the same UPDATE, which
+    raises Conflict if another write got there first (compared with
+    ``version``, else with the version the request read). Otherwise the
+    row is not written, only locked NOWAIT and checked against the version
+    the request read, so a write that only touches rows below it neither
+    rewrites it nor bumps its version.
+    """
+    changed = assign(obj, data, fields)
+    if changed or version is not None:
+        values = {name: getattr(obj, name) for name in changed}
+        if changed:
+            obj.updated_at = values['updated_at'] = timezone.now()
+        write_version(obj, obj.version if version is None else version, **values)
+        record_updated([(obj, changed)])
+        return changed
+    model = type(obj)
+    current = lock_rows(model._default_manager.filter(pk=obj.pk).only('version')).get(obj.pk)
+    if current is None or current.version != obj.version:
+        raise Conflict(f'{model.__name__} {obj.pk} was changed by another request; reload it and retry.')
+    return changed
+
+
+def delete_rows(level, rows):
+    """
+    Delete ``rows`` (instances of ``level.model``) with their subtrees.
+
+    With SOFT_DELETE (the default) this is one UPDATE per level of the
+    subtree, each selecting its rows through a subquery on the level
+    above, so nothing is loaded into Python however big the subtree is.
+    Otherwise the rows are hard-deleted through Django's cascade.
+    """
+    record_deleted(rows)
+    queryset = level.model.objects.filter(pk__in=[obj.pk for obj in rows])
+    if not getattr(settings, 'SOFT_DELETE', True):
+        queryset.delete()
+        return
+    _soft_delete(level, queryset, timezone.now())
+
+
+def _soft_delete(level, queryset, now):
+    # children first: once a level is marked, the live-rows subquery the
+    # level below selects through no longer matches it
+    for _, child in level.children:
+        _soft_delete(
+            child,
+            child.model.objects.filter(**{f'{child.parent_field}__in': queryset.values('pk')}),
+            now,
+        )
+    queryset.update(deleted_at=now, updated_at=now)
+
+
+def sync_children(level, pending):
+    """
+    Reconcile the children of already-saved parents with the payload.
+
+    ``pending`` is a list of ``(parent, [payload, ...])`` pairs. Items whose
+    id matches an existing child of the same parent are updated, others are
+    created with their subtree, and existing children missing from the
+    payload are deleted with delete_rows(). A missing nested list means
+    "no children", same as on create. Items carrying a ``version`` must
+    match the row's (Conflict otherwise); every updated row's version is
+    bumped. An item naming a soft-deleted child of its parent brings that
+    row back (see _revive()).
+
+    The level's existing rows are read with lock_rows(), so they stay
+    locked until the transaction ends and a concurrent writer gets
+    Conflict instead of interleaving its own reconcile with this one.
+
+    Per level this costs one SELECT, at most one bulk UPDATE (only the
+    columns that changed, only for rows that changed), the bulk INSERTs for
+    new subtrees and at most one delete_rows().
+    """
+    if not pending:
+        return
+
+    parent_attname = level.parent_attname
+    parents = {parent.pk: parent for parent, _ in pending}
+    existing = lock_rows(level.model.objects.filter(**{f'{level.parent_field}__in': list(parents)}))
+    for obj in existing.values():
+        # cache the parent, so walking up to the clinic needs no query
+        setattr(obj, level.parent_field, parents[getattr(obj, parent_attname)])
+
+    to_create = []
+    matched = {}
+    for parent, items in pending:
+        new_items = []
+        for data in items:
+            obj = existing.get(data.get('id'))
+            if obj is not None and getattr(obj, parent_attname) == parent.pk:
+                check_version(obj, data.get('version'))
+                # a repeated id in the payload: the last occurrence wins
+                matched[obj.pk] = (obj, data)
+            else:
+                new_items.append(data)
+        if new_items:
+            to_create.append((parent, new_items))
+    revived, to_create = _revive(level, to_create)
+    matched.update(revived)
+
+    changes = []
+    changed_fields = set()
+    for obj, data in matched.values():
+        changed = assign(obj, data, level.update_fields)
+        if obj.deleted_at is not None:
+            obj.deleted_at = None
+            changed.append('deleted_at')
+        if changed:
+            changes.append((obj, changed))
+            changed_fields.update(changed)
+    if changes:
+        # bulk_update skips pre_save, so auto_now has to be applied by hand
+        now = timezone.now()
+        for obj, _ in changes:
+            obj.updated_at = now
+            obj.version += 1    # the row is locked, so this is version + 1 in the database too
+        # all_objects: the live-rows manager would leave the revived rows out
+        level.model.all_objects.bulk_update(
+            [obj for obj, _ in changes], sorted(changed_fields) + ['updated_at', 'version']
+        )
+        record_updated([(obj, changed) for obj, changed in changes if obj.pk not in revived])
+        record_created([obj for obj, _ in revived.values()], level.fields)
+
+    stale = [obj for pk, obj in existing.items() if pk not in matched]
+    if stale:
+        delete_rows(level, stale)
+
+    if to_create:
+        create_children(level, to_create)
+
+    for key, child in level.children:
+        sync_children(child, [(obj, data.get(key) or []) for obj, data in matched.values()])
+
+
+def _revive(level, pending):
+    """
+    Sort out the items of ``pending`` (``(parent, [payload, ...])`` pairs
+    that matched no live child) whose id is already taken in the table,
+    so that creating them cannot fail on the primary key.
+
+    A soft-deleted row of the same parent is brought back: it is returned
+    in ``{pk: (row, payload)}``, locked, for sync_children() to update
+    like a matched row (clearing deleted_at) and to sync its subtree,
+    whose rows come back only where the payload names them. Any other
+    taken id belongs to another parent's row, so the item is created as a
+    new row without it. Costs one SELECT, and none if no item carries an id.
+    """
+    ids = {data['id'] for _, items in pending for data in items if type(data.get('id')) is int}
+    if 'id' not in level.fields or not ids:
+        return {}, pending
+
+    parent_attname = level.parent_attname
+    taken = lock_rows(level.model.all_objects.filter(pk__in=ids))
+    revived = {}
+    to_create = []
+    for parent, items in pending:
+        new_items = []
+        for data in items:
+            obj = taken.get(data.get('id'))
+            if obj is None:
+                new_items.append(data)
+            elif obj.deleted_at is not None and getattr(obj, parent_attname) == parent.pk:
+                check_version(obj, data.get('version'))
+                setattr(obj, level.parent_field, parent)
+                # a repeated id in the payload: the last occurrence wins
+                revived[obj.pk] = (obj, data)
+            else:
+                new_items.append({k: v for k, v in data.items() if k != 'id'})
+        if new_items:
+            to_create.append((parent, new_items))
+    return revived, to_create
@@ -1,8 +1,20 @@
 from django.urls import path
+from .async_views import (
+    AsyncGetClinicView,
+    AsyncDepartmentEquipmentCreateView,
+    AsyncDepartmentEquipmentUpdateView,
+)
 from .views import (
     ClinicCreateAPIView,
     ClinicUpdateAPIView,
     GetClinicView,
+    ClinicListView,
+    ClinicExportView,
+    ClinicBulkImportAPIView,
+    ParameterSearchView,
+    DatabasePoolStatsView,
+    JobDetailView,
+    ChangeFeedView,
     DepartmentEquipmentCreateAPIView,
     DepartmentEquipmentUpdateAPIView
 )
@@ -11,12 +23,33 @@ urlpatterns = [
     # Create Clinic
     path('clinics', ClinicCreateAPIView.as_view(), name='clinic-create'),
 
+    # Bulk import Clinics (POST, NDJSON or JSON array)
+    path('clinics/bulk', ClinicBulkImportAPIView.as_view(), name='clinic-bulk-import'),
+
     # Update Clinic (PUT)
     path('clinics/<int:clinic_id>/', ClinicUpdateAPIView.as_view(), name='clinic-update'),
 
     # Get Clinic by ID (GET)
     path('get_clinic/<int:clinic_id>/', GetClinicView.as_view(), name='clinic-get'),
 
+    # List Clinics (GET, ?cursor=&limit=&depth=&department_active=&detail_active=)
+    path('get_clinics/', ClinicListView.as_view(), name='clinic-list'),
+
+    # Export all Clinics as NDJSON (GET, streamed)
+    path('export_clinics/', ClinicExportView.as_view(), name='clinic-export'),
+
+    # Search Parameters by JSON content (GET, ?contains=&has_key=&range=)
+    path('parameters/search', ParameterSearchView.as_view(), name='parameter-search'),
+
+    # Status of a background write started with ?async=true (GET)
+    path('jobs/<int:job_id>/', JobDetailView.as_view(), name='job-detail'),
+
+    # Change feed of every tree write (GET, NDJSON, ?since=<cursor>&clinic=&limit=)
+    path('changes', ChangeFeedView.as_view(), name='change-feed'),
+
+    # Connection pool stats of this worker process (GET)
+    path('db_pool_stats/', DatabasePoolStatsView.as_view(), name='db-pool-stats'),
+
     # Create Equipment under Department
     path(
         'departments/<int:department_id>/equipments/', 
@@ -26,6 +59,15 @@ urlpatterns = [
     "departments/<int:department_id>/equipments/<int:equipment_id>/",
     DepartmentEquipmentUpdateAPIView.as_view(),
     name="department-equipment-update"
-)
+),
+
+    # Async (ASGI-native) versions, same contracts as the views above
+    path('async/get_clinic/<int:clinic_id>/', AsyncGetClinicView.as_view(), name='async-clinic-get'),
+    path(
+        'async/departments/<int:department_id>/equipments/',
+        AsyncDepartmentEquipmentCreateView.as_view(), name='async-department-equipment-create'),
+    path(
+        'async/departments/<int:department_id>/equipments/<int:equipment_id>/',
+        AsyncDepartmentEquipmentUpdateView.as_view(), name='async-department-equipment-update'),
 
 ]
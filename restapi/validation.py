@@ -0,0 +1,216 @@
+"""
+Compiled validation for the nested write serializers.
+
+DRF validates a nested payload by walking its Field tree and calling
+``run_validation`` / ``to_internal_value`` / validators on every node,
+which dominates CPU time for large clinic payloads. ``compile_serializer``
+turns a serializer's writable fields (i.e. its ``Meta.fields`` as built by
+ModelSerializer) into a plain-Python checker once per class; checking a
+payload is then a single pass with type tests and length checks.
+
+The compiled pass only ever accepts input that DRF would accept and it
+returns the same validated data. Anything it is not sure about (a coercion
+DRF would perform, a blank string, a value that is too long, ...) makes it
+give up, and the DRF path runs instead. Error responses are therefore
+always produced by DRF and have exactly the same structure and codes.
+"""
+import json
+import re
+
+from django.conf import settings
+from django.core import validators as django_validators
+from rest_framework import serializers
+from rest_framework import validators as drf_validators
+from rest_framework.fields import empty
+
+
+class FastPathMiss(Exception):
+    """The compiled pass cannot vouch for this payload; use the DRF path."""
+
+
+class Unsupported(Exception):
+    """The serializer uses something the compiler does not understand."""
+
+
+_SURROGATES = re.compile('[\ud800-\udfff]')
+
+_STRING_VALIDATORS = (
+    django_validators.MaxLengthValidator,
+    django_validators.MinLengthValidator,
+    django_validators.ProhibitNullCharactersValidator,
+    drf_validators.ProhibitSurrogateCharactersValidator,
+)
+_INTEGER_VALIDATORS = (
+    django_validators.MaxValueValidator,
+    django_validators.MinValueValidator,
+)
+
+
+def _miss():
+    raise FastPathMiss
+
+
+def _compile_char(field):
+    if not all(isinstance(v, _STRING_VALIDATORS) for v in field.validators):
+        raise Unsupported(field)
+    max_lengths = [v.limit_value for v in field.validators
+                   if isinstance(v, django_validators.MaxLengthValidator)]
+    min_lengths = [v.limit_value for v in field.validators
+                   if isinstance(v, django_validators.MinLengthValidator)]
+    max_length = min(max_lengths) if max_lengths else None
+    min_length = max(min_lengths) if min_lengths else 0
+    trim = field.trim_whitespace
+
+    def check(value):
+        if type(value) is not str:
+            _miss()
+        if trim:
+            value = value.strip()
+        # '' is either an error or a special case in DRF: let it decide
+        if not value or len(value) < min_length:
+            _miss()
+        if max_length is not None and len(value) > max_length:
+            _miss()
+        if not value.isascii() and _SURROGATES.search(value):
+            _miss()
+        if '\x00' in value:
+            _miss()
+        return value
+    return check
+
+
+def _compile_integer(field):
+    if not all(isinstance(v, _INTEGER_VALIDATORS) for v in field.validators):
+        raise Unsupported(field)
+    max_value, min_value = field.max_value, field.min_value
+
+    def check(value):
+        if type(value) is not int:
+            _miss()
+        if max_value is not None and value > max_value:
+            _miss()
+        if min_value is not None and value < min_value:
+            _miss()
+        return value
+    return check
+
+
+def _compile_boolean(field):
+    if field.validators:
+        raise Unsupported(field)
+
+    def check(value):
+        if type(value) is not bool:
+            _miss()
+        return value
+    return check
+
+
+def _compile_json(field):
+    if field.validators or field.binary:
+        raise Unsupported(field)
+    encoder = field.encoder
+
+    def check(value):
+        if value is None:
+            _miss()
+        try:
+            json.dumps(value, cls=encoder)
+        except (TypeError, ValueError):
+            _miss()
+        return value
+    return check
+
+
+def _compile_list(field):
+    if field.validators or type(field).validate is not serializers.ListSerializer.validate:
+        raise Unsupported(field)
+    item = compile_serializer(field.child)
+    allow_empty, min_length, max_length = field.allow_empty, field.min_length, field.max_length
+
+    def check(value):
+        if type(value) is not list:
+            _miss()
+        if (not allow_empty and not value) \
+                or (min_length is not None and len(value) < min_length) \
+                or (max_length is not None and len(value) > max_length):
+            _miss()
+        return [item(data) for data in value]
+    return check
+
+
+# exact classes only: a subclass may change to_internal_value
+_COMPILERS = {
+    serializers.CharField: _compile_char,
+    serializers.IntegerField: _compile_integer,
+    serializers.BooleanField: _compile_boolean,
+    serializers.JSONField: _compile_json,
+    serializers.ListSerializer: _compile_list,
+}
+
+
+def compile_serializer(serializer):
+    """
+    Return ``check(data) -> validated_data`` for a serializer instance, or
+    raise Unsupported. ``check`` raises FastPathMiss when DRF has to decide.
+    """
+    if serializer.validators or type(serializer).validate is not serializers.Serializer.validate:
+        raise Unsupported(serializer)
+
+    plan = []
+    for field in serializer._writable_fields:
+        if getattr(serializer, 'validate_' + field.field_name, None) is not None:
+            raise Unsupported(field)
+        if field.source_attrs != [field.field_name]:
+            raise Unsupported(field)
+        compiler = _COMPILERS.get(type(field))
+        if compiler is None:
+            raise Unsupported(field)
+        plan.append((field.field_name, field.required, compiler(field)))
+
+    def check(data):
+        if type(data) is not dict:
+            _miss()
+        ret = {}
+        for name, required, check_value in plan:
+            value = data.get(name, empty)
+            if value is empty:
+                if required:
+                    _miss()
+                continue
+            ret[name] = check_value(value)
+        return ret
+    return check
+
+
+_compiled = {}
+
+
+def compiled_validator(serializer_class):
+    """Compiled checker for ``serializer_class`` (built on first use), or None if unsupported."""
+    if serializer_class not in _compiled:
+        try:
+            _compiled[serializer_class] = compile_serializer(serializer_class())
+        except Unsupported:
+            _compiled[serializer_class] = None
+    return _compiled[serializer_class]
+
+
+class CompiledValidationMixin:
+    """
+    Validate top-level payloads with the compiled checker when possible.
+
+    Disabled with ``COMPILED_VALIDATION = False``; partial updates and
+    form-encoded input always take the DRF path.
+    """
+
+    def run_validation(self, data=empty):
+        if self.parent is None and not self.partial and type(data) is dict \
+                and getattr(settings, 'COMPILED_VALIDATION', True):
+            check = compiled_validator(type(self))
+            if check is not None:
+                try:
+                    return check(data)
+                except FastPathMiss:
+                    pass
+        return super().run_validation(data)
@@ -2,15 +2,60 @@ from rest_framework.views import APIView
 from rest_framework.response import Response
 from rest_framework import status
 from rest_framework.exceptions import NotFound, ValidationError, APIException
+from rest_framework import serializers
+from rest_framework.settings import api_settings
+from drf_yasg import openapi
 from drf_yasg.utils import swagger_auto_schema
-import traceback
-from .models import Clinic, Department, Equipments
-from .serializers import ClinicSerializer, ClinicReadSerializer, EquipmentSerializer
+from django.utils.decorators import method_decorator
+from django.views.decorators.http import condition
+from django.db import transaction
+from django.db.models import Exists, OuterRef, Q
+from django.urls import reverse
+from django.http import HttpResponse, StreamingHttpResponse
+from django.views.decorators.http import require_GET
+from .models import Clinic, Department, Equipments, EquipmentDetails, Job, Parameters
+from .serializers import (
+    ClinicSerializer,
+    ClinicReadSerializer,
+    ClinicSummaryReadSerializer,
+    ClinicDepartmentsReadSerializer,
+    EquipmentSerializer,
+    JobSerializer,
+    ParameterSearchReadSerializer,
+)
+from .pagination import ClinicCursorPagination, ParameterCursorPagination
+from .export import DEFAULT_CHUNK_SIZE, iter_ndjson
+from .importer import DEFAULT_BATCH_SIZE, import_clinics, iter_payloads
+from .prefetch import planned_queryset
+from .readers import tree_reader
+from .cache import get_clinic_tree
+from .signals import notify_clinic_changed
+from .jobs import enqueue
+from .changes import iter_ndjson as iter_changes_ndjson
+from .patch import JSONPatchParser, from_json_patch, is_json_patch, patch_tree
+from .tree import DEPARTMENTS, EQUIPMENTS
+from .search import search
+from .dbpool import all_connection_stats
+from . import metrics
+from .conditional import clinic_etag, clinic_fingerprint
+from .concurrency import Conflict
+from .snapshots import request_snapshot, snapshot_etag, snapshot_last_modified
 import logging
 
 logger = logging.getLogger(__name__)
 
 
+def query_flag(request, name):
+    """Boolean query parameter ``name``, or None if absent; ValidationError if it is not a boolean."""
+    value = request.query_params.get(name)
+    if value is None:
+        return None
+    try:
+        return serializers.BooleanField().to_internal_value(value)
+    except ValidationError as ve:
+        raise ValidationError({name: ve.detail})
+
+
 # -------------------------------------------------------------------
 #  1. Create Clinic (POST)
 # -------------------------------------------------------------------
@@ -32,6 +77,7 @@ class ClinicCreateAPIView(APIView):
             serializer.is_valid(raise_exception=True)
 
             clinic = serializer.save()
+            notify_clinic_changed(clinic.id)
 
             return Response(
                 ClinicSerializer(clinic).data,
@@ -42,7 +88,7 @@ class ClinicCreateAPIView(APIView):
             return Response({"error": ve.detail}, status=400)
 
         except Exception as e:
-            logger.exception(f"Unhandled Clinic Create Error: {e}")
+            logger.exception("Unhandled Clinic Create Error: %s", e)
             return Response({"error": "Internal Server Error"}, status=500)
 
 
@@ -51,17 +97,26 @@ class ClinicCreateAPIView(APIView):
 #  2. Update Clinic (PUT)
 # -------------------------------------------------------------------
 class ClinicUpdateAPIView(APIView):
+    parser_classes = [*api_settings.DEFAULT_PARSER_CLASSES, JSONPatchParser]
 
     @swagger_auto_schema(
-        operation_description="Update an existing clinic",
+        operation_description="Update an existing clinic; with ?async=true the write runs in the background",
         request_body=ClinicSerializer,
+        manual_parameters=[
+            openapi.Parameter("async", openapi.IN_QUERY, type=openapi.TYPE_BOOLEAN,
+                              description="Validate now, write in a background job and answer 202"),
+        ],
         responses={
             200: ClinicSerializer,
+            202: JobSerializer,
             400: "Validation Error",
             404: "Clinic not found",
+            409: "Conflict (version mismatch, or the tree is being written by another request)",
+            412: "Precondition Failed (If-Match does not match the current ETag)",
             500: "Internal Server Error",
         }
     )
+    @method_decorator(condition(etag_func=clinic_etag))
     def put(self, request, clinic_id):
 
         try:
@@ -70,11 +125,75 @@ class ClinicUpdateAPIView(APIView):
             serializer = ClinicSerializer(clinic, data=request.data)
             serializer.is_valid(raise_exception=True)
 
+            if query_flag(request, "async"):
+                # validated now, written by a job worker (restapi/jobs.py)
+                job = enqueue("clinic-update", clinic.id, serializer.validated_data)
+                return Response(
+                    JobSerializer(job).data,
+                    status=status.HTTP_202_ACCEPTED,
+                    headers={"Location": reverse("job-detail", args=[job.id])}
+                )
+
             updated = serializer.save()
+            notify_clinic_changed(updated.id)
 
+            # new ETag so the client can chain If-Match on its next PUT
+            fingerprint = clinic_fingerprint(updated.id)
             return Response(
                 ClinicSerializer(updated).data,
-                status=status.HTTP_200_OK
+                status=status.HTTP_200_OK,
+                headers={"ETag": f'"{fingerprint.etag}"'}
+            )
+
+        except Clinic.DoesNotExist:
+            raise NotFound("Clinic not found")
+
+        except ValidationError as ve:
+            return Response({"error": ve.detail}, status=400)
+
+        except Conflict:
+            raise
+
+        except Exception as e:
+            logger.exception("Unhandled Clinic Update Error: %s", e)
+            return Response({"error": "Internal Server Error"}, status=500)
+
+    @swagger_auto_schema(
+        operation_description=(
+            "Partially update a clinic. Send a sparse nested payload (items with an id patch that row, "
+            "items without one are created; nothing is deleted) or an application/json-patch+json "
+            "document whose paths address rows by id, e.g. /department/12/equipments/40/equipment_name"
+        ),
+        request_body=ClinicSerializer,
+        responses={
+            200: "Clinic id and name, and the number of rows updated, created and deleted",
+            400: "Validation Error",
+            404: "Clinic, or a row addressed by id, not found",
+            409: "Conflict (version mismatch, or the tree is being written by another request)",
+            412: "Precondition Failed (If-Match does not match the current ETag)",
+            500: "Internal Server Error",
+        }
+    )
+    @method_decorator(condition(etag_func=clinic_etag))
+    def patch(self, request, clinic_id):
+
+        try:
+            clinic = Clinic.objects.get(id=clinic_id)
+
+            data = request.data
+            if is_json_patch(request):
+                data = from_json_patch(ClinicSerializer, data)
+
+            # only the addressed rows are read and written
+            with transaction.atomic():
+                result = patch_tree(clinic, ClinicSerializer, [('department', DEPARTMENTS)], data)
+                notify_clinic_changed(clinic.id)
+
+            fingerprint = clinic_fingerprint(clinic.id)
+            return Response(
+                {"id": clinic.id, "name": clinic.name, "rows": result.as_dict()},
+                status=status.HTTP_200_OK,
+                headers={"ETag": f'"{fingerprint.etag}"'}
             )
 
         except Clinic.DoesNotExist:
@@ -83,8 +202,11 @@ class ClinicUpdateAPIView(APIView):
         except ValidationError as ve:
             return Response({"error": ve.detail}, status=400)
 
+        except (NotFound, Conflict):
+            raise
+
         except Exception as e:
-            logger.exception(f"Unhandled Clinic Update Error: {e}")
+            logger.exception("Unhandled Clinic Patch Error: %s", e)
             return Response({"error": "Internal Server Error"}, status=500)
 
 
@@ -98,23 +220,42 @@ class GetClinicView(APIView):
         operation_description="Retrieve clinic details by ID",
         responses={
             200: ClinicReadSerializer,
+            304: "Not Modified (If-None-Match / If-Modified-Since)",
             404: "Clinic not found",
             500: "Internal Server Error"
         }
     )
+    @method_decorator(condition(etag_func=snapshot_etag, last_modified_func=snapshot_last_modified))
     def get(self, request, clinic_id):
 
         try:
-            clinic = Clinic.objects.get(id=clinic_id)
-
-            serializer = ClinicReadSerializer(clinic)
-            return Response(serializer.data, status=status.HTTP_200_OK)
+            def build():
+                # with CLINIC_SNAPSHOTS the tree is the row the ETag came from
+                snapshot = request_snapshot(request, clinic_id)
+                if snapshot is not None:
+                    return snapshot.data
+                # one query per tree level, however big the clinic is
+                reader = tree_reader(ClinicReadSerializer)
+                if reader is not None:
+                    rows = reader.read(Clinic.objects.filter(id=clinic_id))
+                    if not rows:
+                        raise Clinic.DoesNotExist
+                    return rows[0]
+                clinic = planned_queryset(ClinicReadSerializer).get(id=clinic_id)
+                return ClinicReadSerializer(clinic).data
+
+            data, hit = get_clinic_tree(clinic_id, snapshot_etag(request, clinic_id), build)
+            return Response(
+                data,
+                status=status.HTTP_200_OK,
+                headers={"X-Cache": "HIT" if hit else "MISS"}
+            )
 
         except Clinic.DoesNotExist:
             raise NotFound("Clinic not found")
 
         except Exception as e:
-            logger.exception(f"Unhandled Clinic Fetch Error: {e}")
+            logger.exception("Unhandled Clinic Fetch Error: %s", e)
             return Response({"error": "Internal Server Error"}, status=500)
 
 
@@ -143,6 +284,7 @@ class DepartmentEquipmentCreateAPIView(APIView):
             serializer.is_valid(raise_exception=True)
 
             equipment = serializer.save(dep=department)
+            notify_clinic_changed(department.clinic_id)
 
             return Response(
                 EquipmentSerializer(equipment).data,
@@ -156,7 +298,7 @@ class DepartmentEquipmentCreateAPIView(APIView):
             return Response({"error": ve.detail}, status=400)
 
         except Exception as e:
-            logger.exception(f"Unhandled Equipment Create Error: {e}")
+            logger.exception("Unhandled Equipment Create Error: %s", e)
             return Response({"error": "Internal Server Error"}, status=500)
 
 
@@ -165,6 +307,7 @@ class DepartmentEquipmentCreateAPIView(APIView):
 #  5. Update Equipment under Department (PUT)
 
 class DepartmentEquipmentUpdateAPIView(APIView):
+    parser_classes = [*api_settings.DEFAULT_PARSER_CLASSES, JSONPatchParser]
 
     @swagger_auto_schema(
         operation_description="Update an existing equipment under a specific department",
@@ -173,13 +316,14 @@ class DepartmentEquipmentUpdateAPIView(APIView):
             200: EquipmentSerializer,
             400: "Validation Error",
             404: "Department or Equipment not found",
+            409: "Conflict (version mismatch, or the equipment is being written by another request)",
             500: "Internal Server Error"
         }
     )
     def put(self, request, department_id, equipment_id):
 
         try:
-            logger.info(f"PUT Request Received - dep_id={department_id}, eq_id={equipment_id}")
+            logger.info("PUT Request Received - dep_id=%s, eq_id=%s", department_id, equipment_id)
 
             # 1) Check department
             try:
@@ -204,20 +348,382 @@ class DepartmentEquipmentUpdateAPIView(APIView):
             logger.info("Serializer valid, saving...")
 
             updated_equipment = serializer.save()
+            notify_clinic_changed(department.clinic_id)
 
             logger.info("Save success")
 
             return Response(EquipmentSerializer(updated_equipment).data, status=200)
 
         except ValidationError as ve:
-            logger.error(f"ValidationError: {ve.detail}")
+            logger.error("ValidationError: %s", ve.detail)
             return Response({"error": ve.detail}, status=400)
 
-        except NotFound as nf:
-            logger.warning(str(nf))
+        except (NotFound, Conflict) as nf:
+            logger.warning("%s", nf)
             raise nf  
 
         except Exception as e:
-            logger.error("Unhandled Exception during update:\n" + traceback.format_exc())
+            logger.exception("Unhandled Exception during update")
+            return Response({"error": "Internal Server Error"}, status=500)
+
+    @swagger_auto_schema(
+        operation_description=(
+            "Partially update an equipment under a specific department: a sparse payload or an "
+            "application/json-patch+json document addressing details/parameters by id, "
+            "e.g. /parameters/7/content"
+        ),
+        request_body=EquipmentSerializer,
+        responses={
+            200: EquipmentSerializer,
+            400: "Validation Error",
+            404: "Department, Equipment or an addressed row not found",
+            409: "Conflict (version mismatch, or the equipment is being written by another request)",
+            500: "Internal Server Error"
+        }
+    )
+    def patch(self, request, department_id, equipment_id):
+
+        try:
+            department = Department.objects.filter(id=department_id).first()
+            if department is None:
+                raise NotFound("Department not found")
+
+            equipment = Equipments.objects.filter(id=equipment_id, dep_id=department_id).first()
+            if not equipment:
+                raise NotFound("Equipment not found under this department")
+
+            data = request.data
+            if is_json_patch(request):
+                data = from_json_patch(EquipmentSerializer, data)
+
+            with transaction.atomic():
+                patch_tree(equipment, EquipmentSerializer, EQUIPMENTS.children, data)
+                notify_clinic_changed(department.clinic_id)
+
+            return Response(EquipmentSerializer(equipment).data, status=200)
+
+        except ValidationError as ve:
+            logger.error("ValidationError: %s", ve.detail)
+            return Response({"error": ve.detail}, status=400)
+
+        except (NotFound, Conflict) as nf:
+            logger.warning("%s", nf)
+            raise nf
+
+        except Exception as e:
+            logger.exception("Unhandled Equipment Patch Error: %s", e)
+            return Response({"error": "Internal Server Error"}, status=500)
+
+
+
+# -------------------------------------------------------------------
+#  6. List Clinics (GET, keyset paginated)
+# -------------------------------------------------------------------
+class ClinicListView(APIView):
+
+    # ?depth= -> serializer used for each clinic on the page
+    depth_serializers = {
+        "clinic": ClinicSummaryReadSerializer,
+        "departments": ClinicDepartmentsReadSerializer,
+        "full": ClinicReadSerializer,
+    }
+
+    @swagger_auto_schema(
+        operation_description="List clinics, paginated with an opaque cursor ordered by id",
+        manual_parameters=[
+            openapi.Parameter("cursor", openapi.IN_QUERY, type=openapi.TYPE_STRING),
+            openapi.Parameter("limit", openapi.IN_QUERY, type=openapi.TYPE_INTEGER),
+            openapi.Parameter("depth", openapi.IN_QUERY, type=openapi.TYPE_STRING,
+                              enum=["clinic", "departments", "full"]),
+            openapi.Parameter("department_active", openapi.IN_QUERY, type=openapi.TYPE_BOOLEAN),
+            openapi.Parameter("detail_active", openapi.IN_QUERY, type=openapi.TYPE_BOOLEAN),
+        ],
+        responses={
+            200: ClinicSummaryReadSerializer(many=True),
+            400: "Validation Error",
+            404: "Invalid cursor",
+            500: "Internal Server Error"
+        }
+    )
+    def get(self, request):
+
+        try:
+            depth = request.query_params.get("depth", "clinic")
+            serializer_class = self.depth_serializers.get(depth)
+            if serializer_class is None:
+                raise ValidationError({"depth": [f"Must be one of: {', '.join(self.depth_serializers)}."]})
+
+            queryset = Clinic.objects.all()
+            filters = {}
+
+            # filters keep only matching nested rows, and only clinics that have some
+            department_active = query_flag(request, "department_active")
+            if department_active is not None:
+                queryset = queryset.filter(Exists(
+                    Department.objects.filter(clinic=OuterRef("pk"), is_active=department_active)
+                ))
+                filters[Department] = Q(is_active=department_active)
+
+            detail_active = query_flag(request, "detail_active")
+            if detail_active is not None:
+                queryset = queryset.filter(Exists(
+                    EquipmentDetails.objects.filter(equipment__dep__clinic=OuterRef("pk"), is_active=detail_active)
+                ))
+                filters[EquipmentDetails] = Q(is_active=detail_active)
+
+            reader = tree_reader(serializer_class)
+            if reader is not None:
+                queryset = reader.values(queryset)
+            else:
+                queryset = planned_queryset(serializer_class, queryset, filters)
+
+            # nested rows are fetched for the current page only
+            paginator = ClinicCursorPagination()
+            page = paginator.paginate_queryset(queryset, request, view=self)
+            if reader is not None:
+                data = reader.render(page, filters)
+            else:
+                data = serializer_class(page, many=True).data
+            return paginator.get_paginated_response(data)
+
+        except ValidationError as ve:
+            return Response({"error": ve.detail}, status=400)
+
+        except NotFound:
+            raise
+
+        except Exception as e:
+            logger.exception("Unhandled Clinic List Error: %s", e)
+            return Response({"error": "Internal Server Error"}, status=500)
+
+
+
+# -------------------------------------------------------------------
+#  7. Export all Clinics (GET, streamed NDJSON)
+# -------------------------------------------------------------------
+class ClinicExportView(APIView):
+
+    @swagger_auto_schema(
+        operation_description="Stream every clinic tree as NDJSON, one clinic per line",
+        manual_parameters=[
+            openapi.Parameter("chunk_size", openapi.IN_QUERY, type=openapi.TYPE_INTEGER),
+        ],
+        responses={
+            200: "application/x-ndjson stream of ClinicReadSerializer objects",
+            400: "Validation Error",
+        }
+    )
+    def get(self, request):
+
+        try:
+            chunk_size = serializers.IntegerField(min_value=1, max_value=5000).run_validation(
+                request.query_params.get("chunk_size", DEFAULT_CHUNK_SIZE)
+            )
+        except ValidationError as ve:
+            return Response({"error": {"chunk_size": ve.detail}}, status=400)
+
+        response = StreamingHttpResponse(iter_ndjson(chunk_size), content_type="application/x-ndjson")
+        response["Content-Disposition"] = 'attachment; filename="clinics.ndjson"'
+        return response
+
+
+
+# -------------------------------------------------------------------
+#  8. Bulk import Clinics (POST, NDJSON or JSON array)
+# -------------------------------------------------------------------
+class ClinicBulkImportAPIView(APIView):
+
+    @swagger_auto_schema(
+        operation_description=(
+            "Import many clinics at once. The body is NDJSON or a JSON array of "
+            "ClinicSerializer payloads; it is read as a stream and committed in batches."
+        ),
+        manual_parameters=[
+            openapi.Parameter("batch_size", openapi.IN_QUERY, type=openapi.TYPE_INTEGER),
+        ],
+        responses={
+            200: "Import report: received / created / failed counts and per-record errors",
+            400: "Validation Error",
+            500: "Internal Server Error"
+        }
+    )
+    def post(self, request):
+
+        try:
+            batch_size = serializers.IntegerField(min_value=1, max_value=5000).run_validation(
+                request.query_params.get("batch_size", DEFAULT_BATCH_SIZE)
+            )
+        except ValidationError as ve:
+            return Response({"error": {"batch_size": ve.detail}}, status=400)
+
+        try:
+            # read the raw body incrementally instead of parsing it into request.data
+            stream = request.stream
+            records = iter_payloads(stream) if stream is not None else iter(())
+            report = import_clinics(records, batch_size=batch_size)
+            return Response(report.as_dict(), status=status.HTTP_200_OK)
+
+        except Exception as e:
+            logger.exception("Unhandled Clinic Bulk Import Error: %s", e)
+            return Response({"error": "Internal Server Error"}, status=500)
+
+
+
+# -------------------------------------------------------------------
+#  9. Search Parameters by content (GET, keyset paginated)
+# -------------------------------------------------------------------
+class ParameterSearchView(APIView):
+
+    @swagger_auto_schema(
+        operation_description=(
+            "Find parameters by their JSON content. All conditions must hold and each "
+            "can be repeated: contains={json object}, has_key=<key>, range=<key>,<min>,<max> "
+            "(inclusive numeric bounds, either may be empty)."
+        ),
+        manual_parameters=[
+            openapi.Parameter("contains", openapi.IN_QUERY, type=openapi.TYPE_STRING),
+            openapi.Parameter("has_key", openapi.IN_QUERY, type=openapi.TYPE_STRING),
+            openapi.Parameter("range", openapi.IN_QUERY, type=openapi.TYPE_STRING),
+            openapi.Parameter("is_active", openapi.IN_QUERY, type=openapi.TYPE_BOOLEAN),
+            openapi.Parameter("cursor", openapi.IN_QUERY, type=openapi.TYPE_STRING),
+            openapi.Parameter("limit", openapi.IN_QUERY, type=openapi.TYPE_INTEGER),
+        ],
+        responses={
+            200: ParameterSearchReadSerializer(many=True),
+            400: "Validation Error",
+            404: "Invalid cursor",
+            500: "Internal Server Error"
+        }
+    )
+    def get(self, request):
+
+        try:
+            queryset = search(Parameters.objects.all(), request.query_params)
+
+            is_active = query_flag(request, "is_active")
+            if is_active is not None:
+                queryset = queryset.filter(is_active=is_active)
+
+            paginator = ParameterCursorPagination()
+            page = paginator.paginate_queryset(queryset, request, view=self)
+            return paginator.get_paginated_response(ParameterSearchReadSerializer(page, many=True).data)
+
+        except ValidationError as ve:
+            return Response({"error": ve.detail}, status=400)
+
+        except NotFound:
+            raise
+
+        except Exception as e:
+            logger.exception("Unhandled Parameter Search Error: %s", e)
             return Response({"error": "Internal Server Error"}, status=500)
 
+
+
+# -------------------------------------------------------------------
+#  10. Database connection pool stats (GET)
+# -------------------------------------------------------------------
+class DatabasePoolStatsView(APIView):
+
+    @swagger_auto_schema(
+        operation_description=(
+            "Connection reuse settings and, when pooling is enabled, this worker "
+            "process's pool counters (size, waiting requests, wait time)"
+        ),
+        responses={
+            200: "One entry per database alias",
+            500: "Internal Server Error"
+        }
+    )
+    def get(self, request):
+
+        try:
+            return Response({"databases": all_connection_stats()}, status=status.HTTP_200_OK)
+
+        except Exception as e:
+            logger.exception("Unhandled DB Pool Stats Error: %s", e)
+            return Response({"error": "Internal Server Error"}, status=500)
+
+
+
+# -------------------------------------------------------------------
+#  11. Metrics (GET, Prometheus text format)
+# -------------------------------------------------------------------
+@require_GET
+def metrics_view(request):
+    # plain Django view: the exposition format is not JSON
+    return HttpResponse(metrics.render(), content_type="text/plain; version=0.0.4; charset=utf-8")
+
+
+
+# -------------------------------------------------------------------
+#  12. Background job status (GET)
+# -------------------------------------------------------------------
+class JobDetailView(APIView):
+
+    @swagger_auto_schema(
+        operation_description="Status of a background write started with ?async=true, with its result or errors",
+        responses={
+            200: JobSerializer,
+            404: "Job not found",
+            500: "Internal Server Error"
+        }
+    )
+    def get(self, request, job_id):
+
+        try:
+            job = Job.objects.get(id=job_id)
+            return Response(JobSerializer(job).data, status=status.HTTP_200_OK)
+
+        except Job.DoesNotExist:
+            raise NotFound("Job not found")
+
+        except Exception as e:
+            logger.exception("Unhandled Job Fetch Error: %s", e)
+            return Response({"error": "Internal Server Error"}, status=500)
+
+
+
+# -------------------------------------------------------------------
+#  13. Change feed (GET, streamed NDJSON)
+# -------------------------------------------------------------------
+class ChangeFeedView(APIView):
+
+    @swagger_auto_schema(
+        operation_description=(
+            "Stream the tree changes recorded after cursor `since` as NDJSON, in order (ids can come "
+            "out of sequence). Each record has its cursor as `id`; resume with since=<last id seen>. "
+            "A delete stands for the row's subtree."
+        ),
+        manual_parameters=[
+            openapi.Parameter("since", openapi.IN_QUERY, type=openapi.TYPE_INTEGER,
+                              description="id of the last record seen; an id never recorded is a 400"),
+            openapi.Parameter("clinic", openapi.IN_QUERY, type=openapi.TYPE_INTEGER),
+            openapi.Parameter("limit", openapi.IN_QUERY, type=openapi.TYPE_INTEGER),
+        ],
+        responses={
+            200: "application/x-ndjson stream of change records",
+            400: "Validation Error",
+        }
+    )
+    def get(self, request):
+
+        fields = {
+            "since": serializers.IntegerField(min_value=0),
+            "clinic": serializers.IntegerField(min_value=1),
+            "limit": serializers.IntegerField(min_value=1, max_value=100000),
+        }
+        values = {"since": 0, "clinic": None, "limit": None}
+        for name, field in fields.items():
+            if name in request.query_params:
+                try:
+                    values[name] = field.run_validation(request.query_params[name])
+                except ValidationError as ve:
+                    return Response({"error": {name: ve.detail}}, status=400)
+
+        try:
+            records = iter_changes_ndjson(values["since"], values["clinic"], values["limit"])
+        except ValidationError as ve:
+            return Response({"error": ve.detail}, status=400)
+
+        return StreamingHttpResponse(records, content_type="application/x-ndjson")